@@ -0,0 +1,128 @@
+"""관리자 채널로 서버 상태를 주기적으로 밀어 주는 기능.
+
+스냅숏은 관리자 수와 상관없이 `interval`초마다 한 번만 만들고 한 번만 직렬화합니다.
+스냅숏에 들어가는 값은 모두 평소에 세어 두는 값(`Room.events_emitted`, `Room.bytes_sent`, `Room.cpu_ns`,
+`Room.sending`, 감시견의 루프 지연 등)을 읽기만 하므로 방 수에 비례하는 가벼운 순회 한 번이면 끝납니다.
+비율(초당 이벤트 수 등)은 직전 스냅숏의 값과의 차이로 냅니다.
+"""
+from __future__ import annotations
+import json
+import time
+import asyncio
+from typing import TYPE_CHECKING, Optional
+from websockets.exceptions import ConnectionClosed
+from starlette.websockets import WebSocket
+from log import logger
+
+if TYPE_CHECKING:
+    from game import GameServer
+
+INTERVAL = 2  # 초
+TOP = 5
+SEND_TIMEOUT = 5  # 초. 관리자 한 명에게 보내는 데 이보다 오래 걸리면 그 관리자에게는 더 보내지 않습니다.
+
+
+class AdminFeed:
+    """관리자들에게 서버 상태를 밀어 줍니다.
+
+    Attributes:
+        `interval`: 스냅숏을 보내는 간격(초).
+        `top`: 많이 쓰는 방을 몇 개까지 보낼지.
+        `subscribers`: 스냅숏을 받는 관리자들의 `WebSocket`.
+    """
+
+    def __init__(self, server: GameServer, interval: float = INTERVAL, top: int = TOP):
+        self.server = server
+        self.interval = interval
+        self.top = top
+        self.subscribers: set[WebSocket] = set()
+        self._previous: dict[int, tuple[int, int, int]] = dict()  # 방 ID: (이벤트 수, 바이트 수, CPU 시간)
+        self._previous_time = time.monotonic()
+        self._pump: Optional[asyncio.Task] = None
+
+    def add(self, ws: WebSocket):
+        self.subscribers.add(ws)
+        if self._pump is None or self._pump.done():
+            self._previous_time = time.monotonic()
+            self._pump = asyncio.create_task(self._run(), name="admin feed")
+
+    def remove(self, ws: WebSocket):
+        self.subscribers.discard(ws)
+        if not self.subscribers:
+            self.close()
+
+    def close(self):
+        if self._pump:
+            self._pump.cancel()
+            self._pump = None
+        self._previous.clear()
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        elapsed = max(now - self._previous_time, 1e-9)
+        rooms = []
+        current: dict[int, tuple[int, int, int]] = dict()
+        for room in self.server.rooms.values():
+            current[room.id] = (room.events_emitted, room.bytes_sent, room.cpu_ns)
+            events, sent, cpu = self._previous.get(room.id, current[room.id])
+            rooms.append({
+                "id": room.id,
+                "title": room.title,
+                "phase": room.phase().name,
+                "day": room.day if room.in_game() else None,
+                "members": len(room.members),
+                "spectators": len(room.spectators),
+                "events_per_second": (room.events_emitted - events) / elapsed,
+                "bytes_per_second": (room.bytes_sent - sent) / elapsed,
+                "cpu_share": (room.cpu_ns - cpu) / 1e9 / elapsed,  # 이 방이 쓴 CPU 시간 / 흐른 시간
+                "outbound": {"sending": room.sending, "spectator_backlog": room.spectators.backlog()},
+            })
+        self._previous, self._previous_time = current, now
+        return {
+            "type": "SNAPSHOT",
+            "time": time.time(),
+            "online": len(self.server.online),
+            "rooms": rooms,
+            "top": {
+                key: [room["id"] for room in sorted(rooms, key=lambda r: r[key], reverse=True)[:self.top]]
+                for key in ("cpu_share", "bytes_per_second", "events_per_second")
+            },
+            "top_users": self.server.top_usage(self.top)["users"],
+            "tasks": {
+                "total": len(asyncio.all_tasks()),
+                "games": [task_state(game) for game in self.server.running_games],
+                "archiver": [task_state(worker) for worker in self.server.archiver.workers()],
+            },
+            "loop_lag": self.server.watchdog.percentiles(),
+            "archive_pending": self.server.archiver.pending(),
+        }
+
+    async def _send(self, ws: WebSocket, text: str):
+        try:
+            await asyncio.wait_for(ws.send_text(text), SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("admin %s is too slow; no more snapshots to it", ws.client)
+            self.subscribers.discard(ws)
+        except (RuntimeError, ConnectionClosed):  # 이미 끊긴 경우. admin_endpoint의 finally에서 빠집니다.
+            pass
+
+    async def _run(self):
+        while self.subscribers:
+            await asyncio.sleep(self.interval)
+            text = json.dumps(self.snapshot())
+            await asyncio.gather(*[self._send(ws, text) for ws in list(self.subscribers)])
+
+
+def task_state(task: asyncio.Task) -> dict:
+    """`task`의 이름과 상태("running", "done", "cancelled", "failed"). 실패했으면 그 예외도."""
+    state = {"name": task.get_name()}
+    if not task.done():
+        state["state"] = "running"
+    elif task.cancelled():
+        state["state"] = "cancelled"
+    elif (exception := task.exception()) is not None:
+        state["state"] = "failed"
+        state["exception"] = repr(exception)
+    else:
+        state["state"] = "done"
+    return state
@@ -0,0 +1,165 @@
+from __future__ import annotations
+import json
+import asyncio
+from typing import Optional, TYPE_CHECKING
+import db
+import record
+from log import logger
+
+if TYPE_CHECKING:
+    from game import GameSummary
+
+DEAD_LETTER_PATH = "sql/dead-letter.jsonl"
+
+class Archiver:
+    """끝난 게임을 백그라운드에서 DB에 보관하는 큐.
+    큐가 가득 차면 게임 태스크를 기다리게 하지 않고 바로 dead letter 파일에 씁니다.
+    보관에 `retries`번 실패한 게임도 dead letter 파일로 갑니다.
+
+    Attributes:
+        `conns`: DB 연결 관리자.
+        `retries`: 게임 하나를 보관하려고 시도하는 최대 횟수.
+        `backoff`: 첫 재시도 전에 기다리는 시간(초). 재시도할 때마다 2배가 됩니다.
+        `dead_letter_path`: 끝내 보관하지 못한 게임을 한 줄에 하나씩 JSON으로 쓰는 파일.
+    """
+
+    def __init__(self,
+                 conns: db.ConnectionManager,
+                 maxsize: int = 64,
+                 workers: int = 1,
+                 retries: int = 3,
+                 backoff: float = 1,
+                 dead_letter_path: str = DEAD_LETTER_PATH):
+        self.conns = conns
+        self.retries = retries
+        self.backoff = backoff
+        self.dead_letter_path = dead_letter_path
+        self._queue: asyncio.Queue[GameSummary] = asyncio.Queue(maxsize)
+        self._number_of_workers = workers
+        self._workers: list[asyncio.Task] = []
+        self._in_progress = 0
+        self._dead_lettering: set[asyncio.Task] = set()
+
+    def start(self):
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"archiver {i}")
+            for i in range(self._number_of_workers)
+        ]
+
+    def workers(self) -> list[asyncio.Task]:
+        """보관하는 태스크들. `start()` 전이나 `close()` 뒤에는 비어 있습니다."""
+        return list(self._workers)
+
+    def pending(self) -> int:
+        """큐에서 기다리거나 보관 중인 게임 수."""
+        return self._queue.qsize() + self._in_progress
+
+    def submit(self, summary: GameSummary):
+        """`summary`를 보관 큐에 넣습니다. 기다리지 않습니다."""
+        try:
+            self._queue.put_nowait(summary)
+        except asyncio.QueueFull:
+            logger.warning("Archive queue is full. Dead-lettering: %s", summary.title)
+            task = asyncio.create_task(self._dead_letter(summary))
+            self._dead_lettering.add(task)
+            task.add_done_callback(self._dead_lettering.discard)
+
+    async def close(self, timeout: float = 30):
+        """큐에 남은 게임을 최대 `timeout`초까지 보관하고 작업 태스크를 끝냅니다.
+        그때까지 보관하지 못한 게임은 dead letter 파일로 갑니다."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Archive queue not drained in %ss", timeout)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        while not self._queue.empty():
+            await self._dead_letter(self._queue.get_nowait())
+        await asyncio.gather(*self._dead_lettering, return_exceptions=True)
+
+    async def _work(self):
+        while True:
+            summary = await self._queue.get()
+            self._in_progress += 1
+            try:
+                await self._archive_with_retry(summary)
+            finally:
+                self._in_progress -= 1
+                self._queue.task_done()
+
+    async def _archive_with_retry(self, summary: GameSummary):
+        """메타데이터가 한 번 커밋되면 그 게임 ID로 기록만 다시 씁니다. 같은 게임이 두 번 보관되지 않습니다."""
+        delay = self.backoff
+        game_id = None
+        for attempt in range(1, self.retries+1):
+            try:
+                if game_id is None:
+                    game_id = await db.archive_metadata(self.conns, summary)
+                await db.archive_record(self.conns, game_id, summary.record)
+            except asyncio.CancelledError:
+                await self._dead_letter(summary, game_id)
+                raise
+            except:
+                logger.error("ARCHIVING FAILED (%d/%d): %s", attempt, self.retries, summary.title, exc_info=True)
+                if attempt < self.retries:
+                    await asyncio.sleep(delay)
+                    delay *= 2
+            else:
+                try:
+                    await summary.record.discard()
+                except OSError:
+                    logger.error("ERROR while removing the journal of %s", summary.title, exc_info=True)
+                return
+        await self._dead_letter(summary, game_id)
+
+    def _append_dead_letter(self, line: str):
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    async def _dead_letter(self, summary: GameSummary, game_id: Optional[int] = None):
+        """`summary`를 기록까지 dead letter 파일에 쓰고 저널을 지웁니다. 따라서 남은 저널은 모두 `recover()`할 것입니다.
+        `game_id`는 메타데이터가 이미 커밋된 게임의 ID입니다. 그 게임은 기록만 `db.archive_record()`로 다시 넣으면 됩니다."""
+        try:
+            entries = await asyncio.to_thread(list, summary.record)  # 저널이 있으면 파일에서 읽습니다.
+            line = json.dumps({
+                "game_id": game_id,
+                "title": summary.title,
+                "private": summary.private,
+                "setup": {
+                    "title": summary.setup_title,
+                    "formation": json.loads(summary.formation),
+                    "constraints": json.loads(summary.constraints),
+                    "exclusion": json.loads(summary.exclusion),
+                },
+                "inventor": summary.inventor,
+                "participants": [p._asdict() for p in summary.participants],
+                "record": entries,
+            }, ensure_ascii=False, default=str)
+            await asyncio.to_thread(self._append_dead_letter, line)
+        except:
+            logger.error("ERROR while dead-lettering %s", summary.title, exc_info=True)
+            return
+        logger.warning("DEAD-LETTERED: %s", summary.title)
+        try:
+            await summary.record.discard()
+        except OSError:
+            logger.error("ERROR while removing the journal of %s", summary.title, exc_info=True)
+
+    async def recover(self, paths: list[str]):
+        """서버가 게임 도중 죽어 남은 저널들을 dead letter 파일로 옮기고 지웁니다.
+        저널에는 기록만 있고 설정과 참가자가 없으므로 DB에 보관하지는 않습니다."""
+        for path in paths:
+            journal = record.Journal(path)
+            try:
+                entries = await asyncio.to_thread(
+                    lambda: [entry for chunk in journal.chunks() for entry in record.decode_chunk(chunk.data)[1]]
+                )
+                line = json.dumps({"journal": path, "recovered": True, "record": entries}, ensure_ascii=False, default=str)
+                await asyncio.to_thread(self._append_dead_letter, line)
+                await journal.remove()
+            except:
+                logger.error("ERROR while recovering the journal %s", path, exc_info=True)
+            else:
+                logger.warning("RECOVERED: %s", path)
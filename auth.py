@@ -0,0 +1,304 @@
+"""회원 가입과 로그인, 세션 토큰.
+
+bcrypt는 한 번에 수백 ms씩 CPU를 쓰므로 이벤트 루프에서 부르면 모든 게임이 그동안 멈춥니다.
+`Authenticator`는 bcrypt를 크기가 정해진 스레드 풀에서만 돌리고,
+IP마다 동시에 진행할 수 있는 가입·로그인 수와 전체 대기 수를 제한합니다.
+
+bcrypt는 로그인할 때 한 번만 거칩니다. 로그인하면 `SessionTokens`가 서명한 토큰을 주고,
+이후 `/game` 접속은 이 토큰의 HMAC 서명만 확인하므로 DB도 bcrypt도 거치지 않습니다.
+토큰 꼴: base64url(JSON 내용).base64url(HMAC-SHA256 서명)
+"""
+from __future__ import annotations
+import hmac
+import json
+import time
+import base64
+import hashlib
+import asyncio
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, NamedTuple, Optional
+import bcrypt
+from starlette.authentication import AuthenticationBackend, AuthenticationError, AuthCredentials, SimpleUser
+from starlette.requests import HTTPConnection
+import db
+from log import logger
+
+ROUNDS = 12
+USERNAME_MAX_LENGTH = 16
+PASSWORD_MIN_LENGTH = 8
+PASSWORD_MAX_LENGTH = 72  # bcrypt는 72바이트 뒤를 무시합니다.
+SESSION_TTL = 60*60*24  # 초
+USER_CACHE_TTL = 300  # 초
+BASIC = "basic"  # Users.Permission
+ADMIN = "admin"
+PERMISSIONS = (BASIC, ADMIN)
+
+
+class AuthenticationRejected(Exception):
+    """가입이나 로그인을 받아들일 수 없는 경우. 메시지는 그대로 클라이언트에게 보여 줍니다."""
+
+
+class TooManyAttempts(AuthenticationRejected):
+    """한 IP에서 동시에 너무 많이 시도하는 경우."""
+
+
+class Busy(AuthenticationRejected):
+    """서버 전체에서 기다리는 해시 작업이 너무 많은 경우."""
+
+
+class AuthenticatedUser(SimpleUser):
+    """로그인한 유저. `request.user`로 쓰입니다."""
+
+    def __init__(self, username: str, id: int):
+        super().__init__(username)
+        self.id = id
+
+
+class UserRecord(NamedTuple):
+    """`Users` 테이블에서 접속 허가와 권한 확인에 필요한 값."""
+    id: int
+    username: str
+    permission: str
+    banned: bool
+
+
+class UserCache:
+    """`UserRecord`를 유저 ID로 찾는 LRU·TTL 캐시.
+    차단이나 권한 변경은 `ban()`, `set_permission()`을 거치므로 그때 바로 지웁니다.
+    `ttl`은 서버 밖에서 DB를 고친 경우를 위한 것입니다.
+    같은 유저를 동시에 여러 번 찾아도 DB에서는 한 번만 읽습니다.
+
+    Attributes:
+        `ttl`: 캐시된 값을 믿는 시간(초).
+        `capacity`: 최대로 보관하는 유저 수.
+    """
+
+    def __init__(self, conns: db.ConnectionManager, ttl: float = USER_CACHE_TTL, capacity: int = 10000):
+        self.conns = conns
+        self.ttl = ttl
+        self.capacity = capacity
+        self._records: OrderedDict[int, tuple[float, UserRecord]] = OrderedDict()
+        self._loading: dict[int, asyncio.Future] = dict()
+
+    def __len__(self):
+        return len(self._records)
+
+    def put(self, record: UserRecord):
+        self._records[record.id] = (time.monotonic() + self.ttl, record)
+        self._records.move_to_end(record.id)
+        while len(self._records) > self.capacity:
+            self._records.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self._records.pop(user_id, None)
+
+    async def warmup(self):
+        """최근에 가입한 유저부터 `capacity`명을 한 번에 읽어 둡니다."""
+        for row in reversed(await db.user_records(self.conns, self.capacity)):
+            self.put(UserRecord(*row))
+        logger.info("user cache warmed up: %d users", len(self._records))
+
+    async def get(self, user_id: int) -> Optional[UserRecord]:
+        if (cached := self._records.get(user_id)) and cached[0] > time.monotonic():
+            self._records.move_to_end(user_id)
+            return cached[1]
+        if loading := self._loading.get(user_id):
+            return await asyncio.shield(loading)
+        loading = self._loading[user_id] = asyncio.get_running_loop().create_future()
+        try:
+            row = await db.user_record(self.conns, user_id)
+        except BaseException as e:
+            loading.set_exception(e)
+            loading.exception()  # 기다리는 쪽이 없어도 경고가 뜨지 않게
+            raise
+        else:
+            record = UserRecord(*row) if row else None
+            if record:
+                self.put(record)
+            loading.set_result(record)
+            return record
+        finally:
+            del self._loading[user_id]
+
+    async def ban(self, user_id: int, banned: bool = True) -> bool:
+        changed = await db.set_banned(self.conns, user_id, banned)
+        self.invalidate(user_id)
+        return changed
+
+    async def set_permission(self, user_id: int, permission: str) -> bool:
+        changed = await db.set_permission(self.conns, user_id, permission)
+        self.invalidate(user_id)
+        return changed
+
+
+class Authenticator:
+    """bcrypt로 비밀번호를 해시하고 확인합니다.
+
+    Attributes:
+        `conns`: DB 연결 관리자.
+        `rounds`: 새로 만드는 해시의 bcrypt cost.
+        `per_ip`: IP 하나가 동시에 진행할 수 있는 가입·로그인 수.
+        `max_pending`: 풀에서 돌거나 기다릴 수 있는 해시 작업의 최대 수. 넘으면 `Busy`.
+    """
+
+    def __init__(self,
+                 conns: db.ConnectionManager,
+                 workers: int = 2,
+                 rounds: int = ROUNDS,
+                 per_ip: int = 2,
+                 max_pending: int = 64):
+        self.conns = conns
+        self.rounds = rounds
+        self.per_ip = per_ip
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+        self._attempts: defaultdict[str, int] = defaultdict(int)
+        self._dummy: Optional[str] = None
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, function, *args):
+        if self._pending >= self.max_pending:
+            raise Busy("지금은 요청이 많습니다. 잠시 후에 다시 시도해 주세요.")
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+        finally:
+            self._pending -= 1
+
+    @asynccontextmanager
+    async def _limit(self, ip: str) -> AsyncIterator[None]:
+        if self._attempts[ip] >= self.per_ip:
+            raise TooManyAttempts("시도가 너무 많습니다. 잠시 후에 다시 시도해 주세요.")
+        self._attempts[ip] += 1
+        try:
+            yield
+        finally:
+            self._attempts[ip] -= 1
+            if not self._attempts[ip]:
+                del self._attempts[ip]
+
+    async def hash(self, password: str) -> str:
+        return await self._run(lambda: bcrypt.hashpw(password.encode(), bcrypt.gensalt(self.rounds)).decode())
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(bcrypt.checkpw, password.encode(), hashed.encode())
+
+    async def register(self, username: str, password: str, ip: str) -> int:
+        """가입시키고 새 유저의 ID를 반환합니다.
+
+        Raises:
+            `AuthenticationRejected`: 사용자명이나 비밀번호가 올바르지 않거나 이미 있는 사용자명인 경우.
+        """
+        if not isinstance(username, str) or len(username) > USERNAME_MAX_LENGTH or not db.proper_name(username):
+            raise AuthenticationRejected(f"사용자명은 {USERNAME_MAX_LENGTH}자 이하의 한글, 영문, 숫자여야 합니다.")
+        if not isinstance(password, str) or not PASSWORD_MIN_LENGTH <= len(password.encode()) <= PASSWORD_MAX_LENGTH:
+            raise AuthenticationRejected(f"비밀번호는 {PASSWORD_MIN_LENGTH}~{PASSWORD_MAX_LENGTH}바이트여야 합니다.")
+        async with self._limit(ip):
+            hashed = await self.hash(password)
+            id = await db.create_user(self.conns, username, hashed)
+        if id is None:
+            raise AuthenticationRejected("이미 있는 사용자명입니다.")
+        logger.info("registered: %s (%s)", username, id)
+        return id
+
+    async def login(self, username: str, password: str, ip: str) -> Optional[AuthenticatedUser]:
+        """비밀번호가 맞으면 유저를, 틀리거나 없는 유저거나 차단된 유저면 `None`을 반환합니다.
+        없는 유저여도 해시를 한 번 확인하므로 응답 시간으로 유저가 있는지 알 수 없습니다."""
+        if not isinstance(username, str) or not isinstance(password, str) or len(password.encode()) > PASSWORD_MAX_LENGTH:
+            return None
+        async with self._limit(ip):
+            credentials = await db.user_credentials(self.conns, username)
+            if credentials is None:
+                if self._dummy is None:
+                    self._dummy = await self.hash("")
+                await self.verify(password, self._dummy)
+                return None
+            id, hashed, banned = credentials
+            if not await self.verify(password, hashed) or banned:
+                return None
+        return AuthenticatedUser(username, id)
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "="*(-len(data) % 4))
+
+
+class SessionTokens:
+    """만료 시각이 있는 세션 토큰을 서명하고 확인합니다.
+    토큰은 서버에 저장하지 않습니다. 차단 등으로 토큰을 무효로 해야 하면 `revoke()`로
+    그 유저가 그때까지 받은 토큰을 모두 거부합니다. 폐기 목록은 메모리에만 두며(`verify()` 참고)
+    `ttl`이 지나면 저절로 줄어듭니다.
+
+    Attributes:
+        `ttl`: 토큰 유효 기간(초).
+    """
+
+    def __init__(self, secret: bytes, ttl: float = SESSION_TTL):
+        self._secret = secret
+        self.ttl = ttl
+        self._revoked: dict[int, float] = dict()  # 유저 ID: 폐기 시각
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self._secret, payload, hashlib.sha256).digest()
+
+    def issue(self, user: AuthenticatedUser) -> tuple[str, float]:
+        """`user`의 토큰과 만료 시각(Unix time)을 반환합니다."""
+        issued = time.time()
+        expires = issued + self.ttl
+        payload = json.dumps({"id": user.id, "username": user.username, "iat": issued, "exp": expires}, separators=(",", ":")).encode()
+        return f"{_b64encode(payload)}.{_b64encode(self._sign(payload))}", expires
+
+    def verify(self, token: str) -> Optional[AuthenticatedUser]:
+        """서명이 맞고, 만료되지 않았고, 폐기되지 않은 토큰이면 그 유저를 반환합니다.
+
+        폐기 목록은 메모리에만 있으므로 서버를 다시 시작하면 잊힙니다. 다시 시작한 뒤에는 `revoke()`한 토큰도
+        만료될 때까지(최대 `ttl`) 여기를 통과합니다. `/game` 접속은 `UserCache`로 차단 여부를 따로 확인하므로
+        차단된 유저는 들어올 수 없지만, 토큰만 확인하는 HTTP 경로에서는 차단 전에 받은 토큰이 그대로 쓰입니다.
+        """
+        try:
+            encoded_payload, encoded_signature = token.split(".")
+            payload = _b64decode(encoded_payload)
+            signature = _b64decode(encoded_signature)
+        except (ValueError, UnicodeError):
+            return None
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        claims = json.loads(payload)
+        if claims["exp"] <= time.time():
+            return None
+        if (revoked := self._revoked.get(claims["id"])) is not None and claims["iat"] <= revoked:
+            return None
+        return AuthenticatedUser(claims["username"], claims["id"])
+
+    def revoke(self, user_id: int):
+        """`user_id`가 지금까지 받은 토큰을 모두 무효로 합니다."""
+        now = time.time()
+        self._revoked = {id: at for id, at in self._revoked.items() if at > now - self.ttl}
+        self._revoked[user_id] = now
+        logger.info("sessions revoked: %s", user_id)
+
+
+class TokenAuthBackend(AuthenticationBackend):
+    """`Authorization: Bearer <토큰>` 헤더나, 헤더를 정할 수 없는 브라우저 WebSocket을 위한 `?token=` 쿼리로 인증합니다."""
+
+    def __init__(self, sessions: SessionTokens):
+        self.sessions = sessions
+
+    async def authenticate(self, conn: HTTPConnection):
+        if authorization := conn.headers.get("Authorization"):
+            scheme, _, token = authorization.partition(" ")
+            if scheme.lower() != "bearer":
+                return
+        elif not (token := conn.query_params.get("token")):
+            return
+        if user := self.sessions.verify(token.strip()):
+            return AuthCredentials(["Authenticated"]), user
+        raise AuthenticationError("Invalid or expired session token")
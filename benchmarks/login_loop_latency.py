@@ -0,0 +1,78 @@
+"""로그인이 몰릴 때 이벤트 루프가 얼마나 밀리는지 잽니다.
+
+`--logins`개의 로그인을 한꺼번에 보내면서 `--tick`초마다 깨어나는 태스크가 늦게 깨어난 시간(루프 지연)을 잽니다.
+    inline: 예전처럼 이벤트 루프에서 bcrypt를 바로 부르는 경우
+    pooled: `auth.Authenticator`로 스레드 풀에서 bcrypt를 돌리는 경우
+
+    python benchmarks/login_loop_latency.py [--logins 100] [--rounds 10] [--workers 2]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import bcrypt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+import auth
+
+PASSWORD = "password1234"
+
+def percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered)-1, int(len(ordered)*p))]
+
+async def measure_lag(tick: float, lags: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        before = time.perf_counter()
+        await asyncio.sleep(tick)
+        lags.append(time.perf_counter() - before - tick)
+
+async def run(name: str, login, logins: int, tick: float):
+    lags: list[float] = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(tick, lags, stop))
+    await asyncio.sleep(tick*5)
+    started = time.perf_counter()
+    results = await asyncio.gather(*[login(i) for i in range(logins)], return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    ok = sum(1 for r in results if r is True)
+    print(f"{name:>7}: {ok}/{logins} logins in {elapsed:.2f}s | "
+          f"loop lag p50 {percentile(lags, 0.5)*1000:.1f}ms "
+          f"p99 {percentile(lags, 0.99)*1000:.1f}ms "
+          f"max {max(lags)*1000:.1f}ms "
+          f"mean {statistics.mean(lags)*1000:.1f}ms")
+
+async def main(args):
+    os.chdir(tempfile.mkdtemp())
+    conns = db.ConnectionManager()
+    await conns.open()
+    await db.create_databases(conns)
+    authenticator = auth.Authenticator(conns, workers=args.workers, rounds=args.rounds, max_pending=args.logins*2)
+    await authenticator.register("bench", PASSWORD, "127.0.0.1")
+
+    async def inline(i: int):
+        _, hashed, _ = await db.user_credentials(conns, "bench")
+        return bcrypt.checkpw(PASSWORD.encode(), hashed.encode())
+
+    async def pooled(i: int):
+        # 모두 다른 IP에서 오는 것으로 쳐서 IP별 제한에 걸리지 않게 합니다.
+        return await authenticator.login("bench", PASSWORD, f"10.0.{i//256}.{i%256}") is not None
+
+    await run("inline", inline, args.logins, args.tick)
+    await run("pooled", pooled, args.logins, args.tick)
+    authenticator.close()
+    await conns.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="동시 로그인 중의 이벤트 루프 지연")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=10, help="bcrypt cost")
+    parser.add_argument("--workers", type=int, default=2, help="bcrypt 스레드 수")
+    parser.add_argument("--tick", type=float, default=0.01, help="루프 지연을 재는 간격(초)")
+    asyncio.run(main(parser.parse_args()))
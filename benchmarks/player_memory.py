@@ -0,0 +1,128 @@
+"""동시에 도는 15인 게임 `--games`개의 `Player`가 차지하는 메모리를 잽니다.
+
+방마다 15명을 만들고 `--days`일 동안 날마다 모두가 무작위로 누군가를 방문하고, 능력을 쓰고, 범죄를 저지르게 한 뒤
+tracemalloc으로 늘어난 메모리를 잽니다.
+    slots: 지금의 `game.Player`
+    dict: 예전처럼 `__dict__`에 속성을 두고, 날마다 리스트와 집합을 늘리고, 범죄를 dict로 두는 경우
+
+    python benchmarks/player_memory.py [--games 1000] [--days 7]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import game
+import roles
+
+PLAYERS = 15
+
+
+class DictPlayer:
+    """예전 `game.Player`의 속성 배치."""
+
+    def __init__(self, user, nickname, index, role, constraints, room):
+        self.user = user
+        self.index = index
+        self.nickname = nickname
+        self.room = room
+        self._role_record = [role(self, constraints)]
+        self.has_left = False
+        self.lw = ""
+        self.crimes = {c: False for c in game.CrimeType}
+        self.visits = [None, None]
+        self.visited_by = [None, set()]
+        self.bodyguarded_by = []
+        self.healed_by = []
+        self.act = [False, False]
+        self.oiled = False
+        self.is_behind = None
+        self.has_voted_to = None
+        self.has_voted_to_skip = False
+        self.voted_count = 0
+        self.execution_choice = game.VoteType.ABSTENTION
+        self.will_suicide = False
+        self.jailed_by = None
+        self.controlled_by = None
+        self.framed = dict()
+        self.blackmailed_on = 0
+        self.cause_of_death = []
+        self.dead_sanitized = False
+
+    def start_day(self, day):
+        self.visits.append(None)
+        self.visited_by.append(set())
+        self.act.append(False)
+        self.healed_by.clear()
+        self.bodyguarded_by.clear()
+
+    def add_visitor(self, day, visitor):
+        self.visited_by[day].add(visitor)
+
+    def commit_crime(self, crime):
+        self.crimes[crime] = True
+
+
+def simulate(player_class, rooms: list, days: int, rng: random.Random) -> list:
+    crimes = list(game.CrimeType)
+    constraints = {
+        option: spec[roles.ConstraintKey.DEFAULT]
+        for option, spec in (roles.Citizen.modifiable_constraints() or {}).items()
+    }
+    lineups = []
+    for room in rooms:
+        lineup = {
+            index: player_class(room.host, f"p{index}", index, roles.Citizen, constraints, room)
+            for index in range(1, PLAYERS+1)
+        }
+        room.lineup = lineup
+        lineups.append(lineup)
+    for day in range(1, days+1):
+        for lineup in lineups:
+            if day > 1:
+                for player in lineup.values():
+                    player.start_day(day)
+            for player in lineup.values():
+                target = lineup[rng.randint(1, PLAYERS)]
+                player.visits[day] = target
+                target.add_visitor(day, player)
+                player.act[day] = rng.random() < 0.3
+                player.commit_crime(rng.choice(crimes))
+    return lineups
+
+
+def measure(name: str, player_class, args) -> int:
+    rng = random.Random(args.seed)
+    host = game.User("bench", None)
+    rooms = [game.Room(host, f"bench {i}", PLAYERS, i, None, None) for i in range(args.games)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    lineups = simulate(player_class, rooms, args.days, rng)
+    elapsed = time.perf_counter() - started
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    players = args.games * PLAYERS
+    print(f"{name:>5}: {used/2**20:7.1f}MiB for {players} players | "
+          f"{used/players:6.0f}B per player | {elapsed:.2f}s")
+    del lineups
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(f"{args.games} games x {PLAYERS} players, {args.days} days")
+    dict_used = measure("dict", DictPlayer, args)
+    slots_used = measure("slots", game.Player, args)
+    print(f"slots use {slots_used/dict_used:.0%} of dict")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,153 @@
 import re
-from typing import Callable, TYPE_CHECKING
-import bcrypt
+import os
+import json
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional, TYPE_CHECKING
 import asyncio
 import aiosqlite
 from datetime import datetime
 from log import logger
+import tracing
 
 if TYPE_CHECKING:
-    from game import GameData
+    from game import GameSummary
+    from record import GameRecord
 """
 DB 구조
 1. user DB: 테이블 하나만 있음. 각 행에는 유저의 정보가 있음.
     1.1. 테이블 이름: "User"
         ID|Username|Password|Permission|Banned|Since|Setup1|Setup2|Setup3|...|Setup10
-2. 전적 DB: 유저별로 테이블이 하나씩 있고, 테이블 각 행에는 그 유저가 플레이한 게임이 있음.
-    2.1. 테이블 이름: "(User의 id)"
-        순번|게임 ID
-3. 게임 메타데이터 DB: 테이블 하나만 있음. 각 행에는 게임 ID, 게임 정보, 그 게임에 참여한 유저들이 있음.
-    2.1. 테이블 이름: "EachGameMetadata"
-        게임 ID|설정 이름|설정 주인|직업 구성|직업 설정|제외 설정|총원|참가자 1|참가자 2|참가자 3|...|참가자 15 (15인 미만이면 나머지는 NULL.)
-4. 인게임 기록 DB: 게임별로 테이블이 하나씩 있고, 각 행에는 인게임 기록이 있음.
-    4.1. 테이블 이름: "(게임의 ID)"
-        순번|이벤트|내용|...
+2. 전적 DB: 더 이상 쓰지 않음. 유저가 플레이한 게임은 GameParticipants의 유저별 색인으로 찾음.
+3. 게임 메타데이터 DB: 테이블이 둘 있음.
+    3.1. 테이블 이름: "EachGameMetadata". 각 행에는 게임 ID와 게임 정보가 있음.
+        게임 ID|설정 이름|설정 주인|직업 구성|직업 설정|제외 설정|총원|비공개 방 여부
+    비공개 방의 게임은 그 게임의 참가자에게만 보임.
+    3.2. 테이블 이름: "GameParticipants". 각 행은 게임 하나의 참가자 한 명. 유저별·직업별 색인이 있음.
+        게임 ID|유저 ID|번호|처음 직업|마지막 직업|승리 여부|사인 (기본 키: 게임 ID, 번호)
+4. 인게임 기록 DB: 테이블 하나만 있음. 각 행에는 인게임 기록 덩어리 하나가 있음.
+    4.1. 테이블 이름: "GameRecordChunks"
+        게임 ID|순번|날짜|단계|이벤트 수|덩어리(압축된 BLOB. `record.py` 참고) (기본 키: 게임 ID, 순번)
+예전처럼 유저별·게임별로 테이블이 하나씩 있거나 기록이 한 줄씩 GameEvents에 있는 DB는 `migrate.py`로 옮길 수 있음.
 5. 견본 닉네임 DB: 테이블이 하나 있고 각 행에는 견본 닉네임이 있음.
     4.1. 테이블 이름: "SampleNicknames"
         순번|닉네임
+6. 설정 DB: user DB 안에 테이블이 하나 있고, 각 행에는 내용이 같은 설정이 한 번만 저장됨.
+    6.1. 테이블 이름: "Setups"
+        해시|내용(JSON)
+    유저의 Setup1~Setup10 열에는 설정 내용 대신 이 테이블의 해시가 들어감.
 """
 USERS_DB_PATH = "sql/users.db"
-GAMES_PER_USER_DB_PATH = "sql/games-per-user.db"
 EACH_GAME_METADATA_DB_PATH = "sql/each-game-metadata.db"
 INGAME_RECORDS_DB_PATH = "sql/records.db"
 SAMPLE_NICKNAMES_DB_PATH = "sql/sample-nicknames.db"
 USER_TABLE_NAME = "Users"
 EACH_GAME_METADATA_TABLE_NAME = "EachGameMetadata"
 SAMPLE_NICKNAMES_TABLE_NAME = "SampleNicknames"
+GAME_PARTICIPANTS_TABLE_NAME = "GameParticipants"
+GAME_EVENTS_TABLE_NAME = "GameEvents" # 옛 형식. migrate.py에서만 씀.
+GAME_RECORD_CHUNKS_TABLE_NAME = "GameRecordChunks"
+SETUPS_TABLE_NAME = "Setups"
+SETUP_SLOTS = 10
+DB_PATHS = (
+    USERS_DB_PATH,
+    EACH_GAME_METADATA_DB_PATH,
+    INGAME_RECORDS_DB_PATH,
+    SAMPLE_NICKNAMES_DB_PATH,
+)
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",  # WAL에서는 NORMAL이어도 DB가 깨지지 않음. 정전 시 마지막 커밋만 잃을 수 있음.
+    "PRAGMA cache_size=-8000",  # 8MB
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+class ConnectionManager:
+    """DB 파일마다 오래 유지되는 쓰기 연결 하나와 읽기 연결 몇 개를 관리합니다.
+    `aiosqlite` 연결은 각자 스레드를 하나씩 띄우므로 요청마다 새로 연결하지 않습니다.
+    `GameServer`가 소유하며, 서버 시작 시 `open()`, 종료 시 `close()`를 호출해야 합니다.
+
+    Attributes:
+        `paths`: 관리하는 DB 파일 경로.
+        `readers_per_db`: DB 파일마다 유지하는 읽기 연결 수.
+    """
+
+    def __init__(self, paths: tuple[str, ...] = DB_PATHS, readers_per_db: int = 2):
+        self.paths = paths
+        self.readers_per_db = readers_per_db
+        self._writers: dict[str, aiosqlite.Connection] = dict()
+        self._write_locks: dict[str, asyncio.Lock] = dict()
+        self._readers: dict[str, asyncio.Queue[aiosqlite.Connection]] = dict()
+        self._all: list[aiosqlite.Connection] = []
+
+    async def _connect(self, path: str, read_only: bool):
+        # isolation_level=None: 트랜잭션은 write()에서 명시적으로 엽니다.
+        conn = await aiosqlite.connect(path, isolation_level=None)
+        self._all.append(conn)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if read_only:
+            await conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    async def open(self):
+        for path in self.paths:
+            if directory := os.path.dirname(path):
+                os.makedirs(directory, exist_ok=True)
+            self._writers[path] = await self._connect(path, read_only=False)
+            self._write_locks[path] = asyncio.Lock()
+            self._readers[path] = asyncio.Queue()
+            for _ in range(self.readers_per_db):
+                self._readers[path].put_nowait(await self._connect(path, read_only=True))
+        logger.info("DB connections opened: %d", len(self._all))
+
+    async def close(self):
+        for conn in self._all:
+            try:
+                await conn.close()
+            except:
+                logger.error("ERROR while closing DB connection %s", conn, exc_info=True)
+        self._all.clear()
+        self._writers.clear()
+        self._readers.clear()
+        logger.info("DB connections closed")
+
+    @asynccontextmanager
+    async def write(self, path: str) -> AsyncIterator[aiosqlite.Connection]:
+        """`path`의 쓰기 연결로 트랜잭션 하나를 엽니다.
+        블록이 무사히 끝나면 커밋하고, 예외가 나면 롤백합니다.
+        같은 파일에 대한 쓰기는 차례대로 실행됩니다."""
+        async with self._write_locks[path]:
+            conn = self._writers[path]
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except:
+                await conn.execute("ROLLBACK")
+                raise
+            else:
+                await conn.execute("COMMIT")
+
+    @asynccontextmanager
+    async def read(self, path: str) -> AsyncIterator[aiosqlite.Connection]:
+        """`path`의 읽기 연결을 하나 빌립니다. 모두 쓰이고 있다면 반납될 때까지 기다립니다."""
+        pool = self._readers[path]
+        conn = await pool.get()
+        try:
+            yield conn
+        finally:
+            pool.put_nowait(conn)
+
+async def create_databases(conns: ConnectionManager):
+    await create_user_database(conns)
+    await create_setup_database(conns)
+    await create_game_metadata_database(conns)
+    await create_ingame_record_database(conns)
+    await create_sample_nickname_database(conns)
+
 proper_name: Callable[[str], bool] = lambda name: name!='' and len(re.findall('[가-힣]|[a-z]|[A-Z]|[0-9]', name)) == len(name)
-async def create_user_database():
-    async with aiosqlite.connect(USERS_DB_PATH) as DB:
+async def create_user_database(conns: ConnectionManager):
+    async with conns.write(USERS_DB_PATH) as DB:
         await DB.execute(f"""
             CREATE TABLE IF NOT EXISTS {USER_TABLE_NAME} (
                 ID INTEGER NOT NULL UNIQUE,
@@ -54,12 +165,21 @@ async def create_user_database():
                 Setup7 text,
                 Setup8 text,
                 Setup9 text,
-                Setup10 text,
+                Setup10 text
             )
         """)
 
-async def create_game_metadata_database():
-    async with aiosqlite.connect(EACH_GAME_METADATA_DB_PATH) as DB:
+async def create_setup_database(conns: ConnectionManager):
+    async with conns.write(USERS_DB_PATH) as DB:
+        await DB.execute(f"""
+            CREATE TABLE IF NOT EXISTS {SETUPS_TABLE_NAME} (
+                Hash text PRIMARY KEY,
+                Content text NOT NULL
+            )
+        """)
+
+async def create_game_metadata_database(conns: ConnectionManager):
+    async with conns.write(EACH_GAME_METADATA_DB_PATH) as DB:
         await DB.execute(f"""
             CREATE TABLE IF NOT EXISTS {EACH_GAME_METADATA_TABLE_NAME} (
                 ID INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -69,88 +189,372 @@ async def create_game_metadata_database():
                 Constraints text not null,
                 Exclusion text not null,
                 Total INTEGER NOT NULL,
-                Player1 INTEGER,
-                Player2 INTEGER,
-                Player3 INTEGER,
-                Player4 INTEGER,
-                Player5 INTEGER,
-                Player6 INTEGER,
-                Player7 INTEGER,
-                Player8 INTEGER,
-                Player9 INTEGER,
-                Player10 INTEGER,
-                Player11 INTEGER,
-                Player12 INTEGER,
-                Player13 INTEGER,
-                Player14 INTEGER,
-                Player15 INTEGER
+                Private bool NOT NULL DEFAULT false
+            )
+        """)
+        cursor = await DB.execute(f"PRAGMA table_info({EACH_GAME_METADATA_TABLE_NAME})")
+        if "Private" not in [column[1] for column in await cursor.fetchall()]:  # Private 열이 생기기 전의 DB
+            await DB.execute(f"ALTER TABLE {EACH_GAME_METADATA_TABLE_NAME} ADD COLUMN Private bool NOT NULL DEFAULT false")
+        await DB.execute(f"""
+            CREATE TABLE IF NOT EXISTS {GAME_PARTICIPANTS_TABLE_NAME} (
+                GameID INTEGER NOT NULL,
+                UserID INTEGER,
+                Seat INTEGER NOT NULL,
+                InitialRole text,
+                FinalRole text,
+                Won bool,
+                DeathCause text,
+                PRIMARY KEY (GameID, Seat)
+            ) WITHOUT ROWID
+        """)
+        await DB.execute(f"""
+            CREATE INDEX IF NOT EXISTS {GAME_PARTICIPANTS_TABLE_NAME}ByUser
+            ON {GAME_PARTICIPANTS_TABLE_NAME} (UserID, GameID)
+        """)
+        await DB.execute(f"""
+            CREATE INDEX IF NOT EXISTS {GAME_PARTICIPANTS_TABLE_NAME}ByRole
+            ON {GAME_PARTICIPANTS_TABLE_NAME} (InitialRole, Won)
+        """)
+
+async def create_ingame_record_database(conns: ConnectionManager):
+    async with conns.write(INGAME_RECORDS_DB_PATH) as DB:
+        await DB.execute(f"""
+            CREATE TABLE IF NOT EXISTS {GAME_RECORD_CHUNKS_TABLE_NAME} (
+                GameID INTEGER NOT NULL,
+                Seq INTEGER NOT NULL,
+                Day INTEGER NOT NULL,
+                Phase text NOT NULL,
+                Events INTEGER NOT NULL,
+                Data BLOB NOT NULL,
+                PRIMARY KEY (GameID, Seq)
             )
         """)
 
-async def create_sample_nickname_database():
-    async with aiosqlite.connect(SAMPLE_NICKNAMES_DB_PATH) as DB:
+async def create_sample_nickname_database(conns: ConnectionManager):
+    async with conns.write(SAMPLE_NICKNAMES_DB_PATH) as DB:
         await DB.execute(f"""
             CREATE TABLE IF NOT EXISTS {SAMPLE_NICKNAMES_TABLE_NAME} (
-                Index integer primary key autoincrement,
+                ID integer primary key autoincrement,
                 nickname text not null
             )
         """)
 
-async def create_user(id: int, username: str, password: str):
-    async with aiosqlite.connect(USERS_DB_PATH) as DB:
-        await DB.execute("""
-            INSERT INTO Users (ID, Username, Password, Permission, Since)
+async def create_user(conns: ConnectionManager, username: str, password_hash: str) -> Optional[int]:
+    """유저를 만들고 ID를 반환합니다. 이미 있는 사용자명이면 `None`.
+    `password_hash`는 bcrypt 해시여야 합니다. 해시는 `auth.Authenticator`가 이벤트 루프 밖에서 만듭니다."""
+    async with conns.write(USERS_DB_PATH) as DB:
+        cursor = await DB.execute(f"SELECT 1 FROM {USER_TABLE_NAME} WHERE Username=?", (username,))
+        if await cursor.fetchone():
+            return None
+        cursor = await DB.execute(f"SELECT COALESCE(MAX(ID), 0) + 1 FROM {USER_TABLE_NAME}")
+        id, = await cursor.fetchone()
+        await DB.execute(f"""
+            INSERT INTO {USER_TABLE_NAME} (ID, Username, Password, Permission, Since)
             VALUES (
                 ?, ?, ?, ?, ?
             )
-        """, (id, username, bcrypt.hashpw(password, bcrypt.gensalt()), "basic", str(datetime.now())))
-    async with aiosqlite.connect(GAMES_PER_USER_DB_PATH) as DB:
-        await DB.execute(f"""
-            CREATE TABLE {id} (
-                Index INTEGER primary key,
-                ID INTEGER NOT NULL UNIQUE
-            )
-        """)
+        """, (id, username, password_hash, "basic", str(datetime.now())))
+    return id
 
-async def archive(game_data: "GameData"):
-    async with aiosqlite.connect(EACH_GAME_METADATA_DB_PATH) as DB:
+async def user_credentials(conns: ConnectionManager, username: str) -> Optional[tuple[int, str, bool]]:
+    """`username`의 (ID, 비밀번호 해시, 차단 여부). 없는 유저면 `None`."""
+    async with conns.read(USERS_DB_PATH) as DB:
         cursor = await DB.execute(f"""
-            SELECT seq FROM sqlite_sequence where name="{EACH_GAME_METADATA_TABLE_NAME}"
-        """)
+            SELECT ID, Password, Banned FROM {USER_TABLE_NAME} WHERE Username=?
+        """, (username,))
         row = await cursor.fetchone()
-        id_for_this_game = row[0]+1 if row else 1
-    logger.info(f"ARCHIVING: {id_for_this_game}")
-    async with aiosqlite.connect(INGAME_RECORDS_DB_PATH) as DB:
+    return (row[0], row[1], bool(row[2])) if row else None
+
+async def user_records(conns: ConnectionManager, limit: Optional[int] = None) -> list[tuple[int, str, str, bool]]:
+    """유저들의 (ID, 사용자명, 권한, 차단 여부)를 ID가 큰 것부터 최대 `limit`개 반환합니다."""
+    async with conns.read(USERS_DB_PATH) as DB:
+        cursor = await DB.execute(f"""
+            SELECT ID, Username, Permission, Banned FROM {USER_TABLE_NAME}
+            ORDER BY ID DESC
+            LIMIT ?
+        """, (-1 if limit is None else limit,))
+        rows = await cursor.fetchall()
+    return [(id, username, permission, bool(banned)) for id, username, permission, banned in rows]
+
+async def user_record(conns: ConnectionManager, user_id: int) -> Optional[tuple[int, str, str, bool]]:
+    """`user_id`의 (ID, 사용자명, 권한, 차단 여부). 없는 유저면 `None`."""
+    async with conns.read(USERS_DB_PATH) as DB:
+        cursor = await DB.execute(f"""
+            SELECT ID, Username, Permission, Banned FROM {USER_TABLE_NAME} WHERE ID=?
+        """, (user_id,))
+        row = await cursor.fetchone()
+    return (row[0], row[1], row[2], bool(row[3])) if row else None
+
+async def set_banned(conns: ConnectionManager, user_id: int, banned: bool) -> bool:
+    async with conns.write(USERS_DB_PATH) as DB:
+        cursor = await DB.execute(f"UPDATE {USER_TABLE_NAME} SET Banned=? WHERE ID=?", (banned, user_id))
+        return cursor.rowcount > 0
+
+async def set_permission(conns: ConnectionManager, user_id: int, permission: str) -> bool:
+    async with conns.write(USERS_DB_PATH) as DB:
+        cursor = await DB.execute(f"UPDATE {USER_TABLE_NAME} SET Permission=? WHERE ID=?", (permission, user_id))
+        return cursor.rowcount > 0
+
+@tracing.SERVER.wrap("archive")
+async def archive(conns: ConnectionManager, summary: "GameSummary") -> int:
+    """게임 하나를 보관하고 게임 ID를 반환합니다. `archive_metadata()`와 `archive_record()`를 차례로 부릅니다.
+    두 DB 파일에 나눠 쓰므로 둘을 한 트랜잭션으로 묶을 수 없습니다. 기록을 쓰다 실패하면 메타데이터만 남으며,
+    그때는 `archive_record()`를 같은 게임 ID로 다시 부르면 됩니다(`archiver.Archiver`가 그렇게 재시도합니다).
+    끝내 실패한 게임은 게임 ID와 함께 dead letter 파일로 갑니다. 서버가 그 사이에 죽으면 기록은 저널에 남아
+    `archiver.Archiver.recover()`가 dead letter 파일로 옮깁니다."""
+    game_id = await archive_metadata(conns, summary)
+    await archive_record(conns, game_id, summary.record)
+    return game_id
+
+async def archive_metadata(conns: ConnectionManager, summary: "GameSummary") -> int:
+    """메타데이터와 참가자를 한 트랜잭션으로 넣고 커밋한 뒤 게임 ID를 반환합니다.
+    메타데이터 행을 넣으면서 게임 ID를 받으므로 동시에 끝난 게임끼리 ID가 겹치지 않습니다.
+    커밋된 뒤로는 기록이 아직 없어도 전적에 보이며, 그동안 다시보기는 기록이 없다고 답합니다."""
+    async with conns.write(EACH_GAME_METADATA_DB_PATH) as META:
+        cursor = await META.execute(f"""
+            INSERT INTO {EACH_GAME_METADATA_TABLE_NAME} (Title, Inventor, Formation, Constraints, Exclusion, Total, Private)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (
+            summary.setup_title,
+            summary.inventor,
+            summary.formation,
+            summary.constraints,
+            summary.exclusion,
+            len(summary.participants),
+            summary.private
+        ))
+        id_for_this_game = cursor.lastrowid
+        logger.info("ARCHIVING: %s", id_for_this_game)
+        await META.executemany(f"""
+            INSERT INTO {GAME_PARTICIPANTS_TABLE_NAME} (GameID, UserID, Seat, InitialRole, FinalRole, Won, DeathCause)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(id_for_this_game, *p) for p in summary.participants])
+    return id_for_this_game
+
+async def archive_record(conns: ConnectionManager, game_id: int, game_record: "GameRecord"):
+    """`game_id` 게임의 기록 덩어리를 `executemany()`로 한 트랜잭션에 넣습니다.
+    이미 있는 덩어리는 지우고 넣으므로 같은 게임 ID로 몇 번을 다시 불러도 됩니다."""
+    async with conns.write(INGAME_RECORDS_DB_PATH) as RECORDS:
+        await RECORDS.execute(f"DELETE FROM {GAME_RECORD_CHUNKS_TABLE_NAME} WHERE GameID=?", (game_id,))
+        await RECORDS.executemany(f"""
+            INSERT INTO {GAME_RECORD_CHUNKS_TABLE_NAME} (GameID, Seq, Day, Phase, Events, Data)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, ((game_id, seq, *chunk) for seq, chunk in enumerate(game_record.chunks())))
+    logger.info("ARCHIVED: %s", game_id)
+
+HISTORY_PAGE_SIZE = 20
+HISTORY_PAGE_SIZE_MAX = 50
+# `viewer`에게 보이는 게임. 공개 방의 게임이거나 `viewer`가 참가한 게임입니다. 매개변수는 `viewer` 하나입니다.
+VISIBLE = f"""(NOT M.Private OR EXISTS (
+    SELECT 1 FROM {GAME_PARTICIPANTS_TABLE_NAME} AS V WHERE V.GameID=M.ID AND V.UserID=?
+))"""
+
+async def match_history(conns: ConnectionManager, user_id: int, before: Optional[int] = None,
+                        limit: int = HISTORY_PAGE_SIZE, viewer: Optional[int] = None) -> list[dict]:
+    """`user_id`가 참가한 게임 중 `viewer`에게 보이는 것을 최신순으로 `limit`개 반환합니다.
+    `before`를 주면 게임 ID가 그보다 작은 게임부터 반환합니다(keyset pagination).
+    다음 쪽을 가져오려면 마지막 게임 ID를 `before`로 넘기면 됩니다."""
+    limit = max(1, min(limit, HISTORY_PAGE_SIZE_MAX))
+    async with conns.read(EACH_GAME_METADATA_DB_PATH) as DB:
+        cursor = await DB.execute(f"""
+            SELECT P.GameID, M.Title, M.Total, P.Seat, P.InitialRole, P.FinalRole, P.Won, P.DeathCause
+            FROM {GAME_PARTICIPANTS_TABLE_NAME} AS P
+            JOIN {EACH_GAME_METADATA_TABLE_NAME} AS M ON M.ID=P.GameID
+            WHERE P.UserID=? AND P.GameID<? AND {VISIBLE}
+            ORDER BY P.GameID DESC
+            LIMIT ?
+        """, (user_id, before if before is not None else 2**63-1, viewer, limit))
+        rows = await cursor.fetchall()
+    return [{
+        "game_id": game_id,
+        "title": title,
+        "total": total,
+        "seat": seat,
+        "initial_role": initial_role,
+        "final_role": final_role,
+        "won": None if won is None else bool(won),
+        "death_cause": death_cause,
+    } for game_id, title, total, seat, initial_role, final_role, won, death_cause in rows]
+
+async def game_metadata(conns: ConnectionManager, game_id: int, viewer: Optional[int] = None) -> Optional[dict]:
+    """게임 하나의 메타데이터와 참가자들을 반환합니다. 그런 게임이 없거나 `viewer`에게 보이지 않으면 `None`."""
+    async with conns.read(EACH_GAME_METADATA_DB_PATH) as DB:
+        cursor = await DB.execute(f"""
+            SELECT Title, Inventor, Formation, Constraints, Exclusion, Total
+            FROM {EACH_GAME_METADATA_TABLE_NAME} AS M WHERE ID=? AND {VISIBLE}
+        """, (game_id, viewer))
+        row = await cursor.fetchone()
+        if not row:
+            return None
+        cursor = await DB.execute(f"""
+            SELECT UserID, Seat, InitialRole, FinalRole, Won, DeathCause
+            FROM {GAME_PARTICIPANTS_TABLE_NAME} WHERE GameID=?
+            ORDER BY Seat
+        """, (game_id,))
+        participants = await cursor.fetchall()
+    title, inventor, formation, constraints, exclusion, total = row
+    return {
+        "game_id": game_id,
+        "title": title,
+        "inventor": inventor,
+        "formation": json.loads(formation),
+        "constraints": json.loads(constraints),
+        "exclusion": json.loads(exclusion),
+        "total": total,
+        "participants": [{
+            "user_id": user_id,
+            "seat": seat,
+            "initial_role": initial_role,
+            "final_role": final_role,
+            "won": None if won is None else bool(won),
+            "death_cause": death_cause,
+        } for user_id, seat, initial_role, final_role, won, death_cause in participants],
+    }
+
+async def game_access(conns: ConnectionManager, game_id: int, viewer: Optional[int]) -> tuple[bool, Optional[int]]:
+    """`viewer`가 `game_id`를 볼 수 있는지와, 참가했다면 앉았던 자리 번호를 반환합니다.
+    그런 게임이 없거나 `viewer`에게 보이지 않으면 `(False, None)`."""
+    async with conns.read(EACH_GAME_METADATA_DB_PATH) as DB:
+        cursor = await DB.execute(f"""
+            SELECT (SELECT Seat FROM {GAME_PARTICIPANTS_TABLE_NAME} WHERE GameID=M.ID AND UserID=?)
+            FROM {EACH_GAME_METADATA_TABLE_NAME} AS M WHERE ID=? AND {VISIBLE}
+        """, (viewer, game_id, viewer))
+        row = await cursor.fetchone()
+    if not row:
+        return False, None
+    return True, row[0]
+
+async def user_profile(conns: ConnectionManager, user_id: int, top_roles: int = 5, viewer: Optional[int] = None) -> dict:
+    """`user_id`의 총 게임 수, 마지막 직업별 승리 수, 많이 한 처음 직업을 `viewer`에게 보이는 게임만으로 반환합니다."""
+    played_games = f"""{GAME_PARTICIPANTS_TABLE_NAME} AS P
+            JOIN {EACH_GAME_METADATA_TABLE_NAME} AS M ON M.ID=P.GameID
+            WHERE P.UserID=? AND {VISIBLE}"""
+    async with conns.read(EACH_GAME_METADATA_DB_PATH) as DB:
+        cursor = await DB.execute(f"""
+            SELECT COUNT(*) FROM {played_games}
+        """, (user_id, viewer))
+        played, = await cursor.fetchone()
+        cursor = await DB.execute(f"""
+            SELECT P.FinalRole, COUNT(*) FROM {played_games} AND P.Won
+            GROUP BY P.FinalRole
+        """, (user_id, viewer))
+        wins_by_role = dict(await cursor.fetchall())
+        cursor = await DB.execute(f"""
+            SELECT P.InitialRole, COUNT(*) AS N FROM {played_games} AND P.InitialRole IS NOT NULL
+            GROUP BY P.InitialRole
+            ORDER BY N DESC, P.InitialRole
+            LIMIT ?
+        """, (user_id, viewer, top_roles))
+        most_played = await cursor.fetchall()
+    return {
+        "user_id": user_id,
+        "played": played,
+        "wins_by_role": wins_by_role,
+        "most_played": [{"role": role, "count": count} for role, count in most_played],
+    }
+
+RECORD_BATCH = 4
+
+async def record_start(conns: ConnectionManager, game_id: int, day: Optional[int] = None, phase: Optional[str] = None) -> Optional[int]:
+    """`game_id`의 기록에서 `day`일 `phase` 단계가 시작되는 덩어리 순번을 반환합니다.
+    `phase`가 없으면 `day`일 이후의 첫 덩어리, `day`도 없으면 첫 덩어리입니다. 없으면 `None`."""
+    conditions, parameters = ["GameID=?"], [game_id]
+    if day is not None:
+        conditions.append("Day>=?" if phase is None else "Day=?")
+        parameters.append(day)
+    if phase is not None:
+        conditions.append("Phase=?")
+        parameters.append(phase)
+    async with conns.read(INGAME_RECORDS_DB_PATH) as DB:
+        cursor = await DB.execute(f"""
+            SELECT MIN(Seq) FROM {GAME_RECORD_CHUNKS_TABLE_NAME} WHERE {" AND ".join(conditions)}
+        """, parameters)
+        row = await cursor.fetchone()
+    return row[0]
+
+async def record_chunks(conns: ConnectionManager, game_id: int, start: int = 0, batch: int = RECORD_BATCH) -> AsyncIterator[tuple[int, int, str, bytes]]:
+    """`game_id`의 기록 덩어리를 순번 `start`부터 (순번, 날짜, 단계, 덩어리) 꼴로 차례로 내놓습니다.
+    한 번에 `batch`개씩만 읽고, 읽을 때만 읽기 연결을 빌리므로 천천히 소비해도 연결을 붙잡지 않습니다."""
+    while True:
+        async with conns.read(INGAME_RECORDS_DB_PATH) as DB:
+            cursor = await DB.execute(f"""
+                SELECT Seq, Day, Phase, Data FROM {GAME_RECORD_CHUNKS_TABLE_NAME}
+                WHERE GameID=? AND Seq>=?
+                ORDER BY Seq
+                LIMIT ?
+            """, (game_id, start, batch))
+            rows = await cursor.fetchall()
+        for row in rows:
+            yield row
+        if len(rows) < batch:
+            return
+        start = rows[-1][0] + 1
+
+def _setup_column(slot: int):
+    if not isinstance(slot, int) or not 1 <= slot <= SETUP_SLOTS:
+        raise ValueError(f"설정 칸은 1~{SETUP_SLOTS}번만 있습니다: {slot}")
+    return f"Setup{slot}"
+
+async def save_setup(conns: ConnectionManager, username: str, slot: int, digest: str, content: str) -> bool:
+    """`content`를 `digest`로 한 번만 저장하고 `username`의 `slot`번 칸이 이를 가리키게 합니다.
+    그런 유저가 없으면 `False`를 반환합니다."""
+    column = _setup_column(slot)
+    async with conns.write(USERS_DB_PATH) as DB:
         await DB.execute(f"""
-            CREATE TABLE "{id_for_this_game}" (
-                index integer primary key autoincrement,
-                text not null
-            )
-        """)
-        async def _insert_one_record(line: dict):
-            await DB.execute(f"""
-                INSERT INTO {id_for_this_game} (text)
-                VALUES (?)
-            """, (str(line)))
-        await asyncio.gather(*[_insert_one_record(line) for line in game_data.record])
-    async with aiosqlite.connect(EACH_GAME_METADATA_DB_PATH) as DB:
-        setup = game_data.setup
-        query =  f"INSERT INTO {EACH_GAME_METADATA_TABLE_NAME} (Title, Inventor, Formation, Constraints, Exclusion, Total"
-        values = f"VALUES (?, ?, ?, ?"
-        for i, in range(game_data.lineup):
-            query += f", Player{i+1}"
-            values += f", ?"
-        query += ")"
-        values += ")"
-        await DB.execute(query + values, [
-            setup.title,
-            setup.inventor,
-            setup.formation,
-            setup.constraints,
-            setup.exclusion,
-            len(game_data.lineup)
-        ]+[user.id for user in game_data.lineup])
-    logger.info(f"ARCHIVED: {id_for_this_game}")
+            INSERT OR IGNORE INTO {SETUPS_TABLE_NAME} (Hash, Content)
+            VALUES (?, ?)
+        """, (digest, content))
+        cursor = await DB.execute(f"""
+            UPDATE {USER_TABLE_NAME} SET {column}=? WHERE Username=?
+        """, (digest, username))
+        return cursor.rowcount > 0
+
+async def list_setups(conns: ConnectionManager, username: str) -> list[tuple[int, str, str]]:
+    """`username`이 저장한 설정을 `(칸 번호, 해시, 내용)`의 `list`로 반환합니다."""
+    columns = ", ".join(_setup_column(slot) for slot in range(1, SETUP_SLOTS+1))
+    async with conns.read(USERS_DB_PATH) as DB:
+        cursor = await DB.execute(f"""
+            SELECT {columns} FROM {USER_TABLE_NAME} WHERE Username=?
+        """, (username,))
+        row = await cursor.fetchone()
+        if not row:
+            return []
+        saved = {slot: digest for slot, digest in enumerate(row, 1) if digest}
+        if not saved:
+            return []
+        cursor = await DB.execute(f"""
+            SELECT Hash, Content FROM {SETUPS_TABLE_NAME}
+            WHERE Hash IN ({", ".join("?"*len(saved))})
+        """, tuple(set(saved.values())))
+        contents = dict(await cursor.fetchall())
+    return [(slot, digest, contents[digest]) for slot, digest in saved.items() if digest in contents]
+
+async def load_setup_digest(conns: ConnectionManager, username: str, slot: int) -> Optional[str]:
+    """`username`의 `slot`번 칸에 저장된 설정의 해시를 반환합니다."""
+    column = _setup_column(slot)
+    async with conns.read(USERS_DB_PATH) as DB:
+        cursor = await DB.execute(f"""
+            SELECT {column} FROM {USER_TABLE_NAME} WHERE Username=?
+        """, (username,))
+        row = await cursor.fetchone()
+    return row[0] if row else None
+
+async def load_setup_content(conns: ConnectionManager, digest: str) -> Optional[str]:
+    async with conns.read(USERS_DB_PATH) as DB:
+        cursor = await DB.execute(f"""
+            SELECT Content FROM {SETUPS_TABLE_NAME} WHERE Hash=?
+        """, (digest,))
+        row = await cursor.fetchone()
+    return row[0] if row else None
+
+async def delete_setup(conns: ConnectionManager, username: str, slot: int) -> bool:
+    """`username`의 `slot`번 칸을 비웁니다. 설정 내용은 다른 유저가 참조할 수 있으므로 지우지 않습니다."""
+    column = _setup_column(slot)
+    async with conns.write(USERS_DB_PATH) as DB:
+        cursor = await DB.execute(f"""
+            UPDATE {USER_TABLE_NAME} SET {column}=NULL WHERE Username=?
+        """, (username,))
+        return cursor.rowcount > 0
 
 async def add_sample_nickname(nickname: str):
     pass # TODO
\ No newline at end of file
@@ -1,20 +1,40 @@
 from __future__ import annotations
 from contextlib import suppress
+from collections import OrderedDict
+from array import array
 import re
+import copy
+import json
+import heapq
+import hashlib
+import functools
 import itertools
 import time
 import string
 import random
+import secrets
 import inspect
 import asyncio
 from asyncio.tasks import Task
+from operator import attrgetter
 from enum import Enum, IntEnum, auto, unique
-from typing import Any, Optional, Union, Callable, Type
-from websockets.exceptions import ConnectionClosed
+from typing import Any, NamedTuple, Optional, Union, Callable, Type
 from starlette.websockets import WebSocket, WebSocketDisconnect
-from log import logger
+from log import logger, current_user
 import db
 import roles
+import archiver
+import metrics
+import tracing
+import profiler
+import memory
+import admin
+import loopwatch
+import auth
+import record
+import replay
+import spectator
+import transport
 
 DEMOCRACY = "Democracy"
 
@@ -57,25 +77,83 @@ class BroadCaster:
         }) for user in self.server.online])
 
 class GameServer:
-    def __init__(self):
+    def __init__(self, spectator_delay: float = spectator.DELAY, sessions: Optional[auth.SessionTokens] = None,
+                 admin_interval: float = admin.INTERVAL, debug: bool = False):
+        self.debug = debug  # 참이면 로그인 없이 접속하고 게임 단계가 짧아집니다.
         self.broadcaster = BroadCaster(self)
         self.online: set[User] = set()
         self.rooms: dict[int, Room] = dict()
         self.running_games: list[Task] = []
-        self.recording_tasks: list[Task] = []
+        self.db = db.ConnectionManager()
+        self.archiver = archiver.Archiver(self.db)
+        self.setup_cache = SetupCache(self.db)
+        self.authenticator = auth.Authenticator(self.db)
+        self.sessions = sessions or auth.SessionTokens(secrets.token_bytes(32))
+        self.users = auth.UserCache(self.db)
+        self.watchdog = loopwatch.LoopWatchdog()
+        self.snapshots = memory.MemorySnapshots()
+        self.admin = admin.AdminFeed(self, admin_interval)
+        metrics.gauge("online_users", "Connected users.", lambda: len(self.online))
+        metrics.gauge("rooms", "Rooms by phase.", self.rooms_by_phase, "phase")
+        metrics.gauge("running_games", "Game tasks still running.", lambda: len(self.running_games))
+        metrics.gauge("archive_pending", "Finished games waiting to be archived.", self.archiver.pending)
+        for key, name, scale in self.USAGE:  # /metrics는 인증이 없으므로 유저별 순위는 관리자 피드에만 보냅니다.
+            metrics.gauge(f"top_rooms_{name}", f"Rooms with the most {name} so far.",
+                          functools.partial(self.top_rooms_gauge, key, scale), "room")
         self.next_username = 0
         self.next_room_id = 1
+        self.spectator_delay = spectator_delay
+
+    def rooms_by_phase(self) -> dict[str, int]:
+        counts: dict[str, int] = dict()
+        for room in self.rooms.values():
+            counts[room.phase().name] = counts.get(room.phase().name, 0) + 1
+        return counts
+
+    async def startup(self):
+        await self.db.open()
+        await db.create_databases(self.db)
+        await self.users.warmup()
+        self.watchdog.start()
+        profiler.install()
+        memory.LEAKS.start()
+        if journals := record.journals():
+            logger.warning("%d journal(s) of unfinished games found in %s/", len(journals), record.JOURNAL_DIR)
+            await self.archiver.recover(journals)
+        self.archiver.start()
+
+    async def shutdown(self):
+        self.admin.close()
+        await self.watchdog.stop()
+        await memory.LEAKS.stop()
+        await self.archiver.close()
+        self.authenticator.close()
+        await self.db.close()
 
     async def endpoint(self, ws: WebSocket):
-        if ws.app.debug:
+        record = None
+        if self.debug:
             self.next_username += 1
         elif not ws.user.is_authenticated:
             return
+        elif (record := await self.users.get(ws.user.id)) is None or record.banned:
+            logger.info("refused: %s", ws.user.username)
+            await ws.close(code=1008)  # policy violation
+            return
         connected = User(
-            self.next_username if ws.app.debug else ws.username, ws)
+            self.next_username if self.debug else record.username, transport.WebSocketTransport(ws))
+        if record:
+            connected.id = record.id
+            connected.permission = record.permission
+        await self.serve(connected)
+
+    async def serve(self, connected: User):
+        """`connected`의 접속 하나를 끝날 때까지 처리합니다.
+        봇과 테스트는 `transport.LoopbackTransport`를 가진 `User`로 이것을 바로 부를 수 있습니다."""
+        current_user.set(connected)
         self.online.add(connected)
-        await ws.accept()
-        logger.info(f"connected: {connected.username}")
+        await connected.transport.accept()
+        logger.info("connected: %s", connected.username)
         welcoming = asyncio.create_task(self.broadcaster.connection(connected))
         try:
             rooms_data = [room.info() for room in self.rooms.values()]
@@ -86,34 +164,243 @@ class GameServer:
                 "username": connected.username,
             }
             await connected.listen(data)
-            while message := await ws.receive_json():
-                ws._raise_on_disconnect(message)
-                await self.process_message(connected, message)
-        except WebSocketDisconnect:
+            while message := await connected.transport.receive():
+                connected.messages += 1
+                await profiler.RoomStep(
+                    self.process_message(connected, message), connected.room or connected.spectating, connected)
+        except transport.Closed:
             if connected.room:
                 await self.leave_and_delete_room_if_empty(connected)
         finally:
-            logger.info(f"{connected} disconncted")
+            logger.info("%s disconncted", connected)
             welcoming.cancel()
             with suppress(asyncio.CancelledError):
                 await welcoming
             self.online.remove(connected)
+            if connected.replay:
+                connected.replay.stop()
+            if connected.spectating:
+                connected.stop_spectating()
             if connected.room:
                 await self.leave_and_delete_room_if_empty(connected)
             try:
-                await ws.close()
+                await connected.transport.close()
             except:
-                logger.error(
-                    f"ERROR while closing {ws} of {connected}", exc_info=True)
+                logger.error("ERROR while closing %s of %s", connected.transport, connected, exc_info=True)
             await self.broadcaster.disconnection(connected)
+            memory.LEAKS.watch(connected, "User")
+
+    async def admin_endpoint(self, ws: WebSocket):
+        """관리자 채널. 디버그 모드가 아니면 관리자만 접속할 수 있습니다."""
+        if not self.debug and not (ws.user.is_authenticated and await self.is_admin(ws.user.id)):
+            logger.info("refused admin: %s", ws.user.display_name or "anonymous")
+            await ws.close(code=1008)  # policy violation
+            return
+        await ws.accept()
+        logger.info("admin connected: %s", ws.user.display_name or "debug")
+        self.admin.add(ws)
+        try:
+            while message := await ws.receive_json():
+                ws._raise_on_disconnect(message)
+                await ws.send_json(await self.process_admin_message(message))
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.admin.remove(ws)
+            logger.info("admin disconnected: %s", ws.user.display_name or "debug")
+
+    async def process_admin_message(self, message: dict) -> dict:
+        """관리자 채널의 명령을 처리하고 응답을 반환합니다.
+            `PROFILE_ROOM`: `room_id` 방을 `days`일 동안 프로파일링합니다. 하루마다 pstats 파일이 생깁니다.
+            `PROFILE_STOP`: `room_id` 방의 프로파일링을 멈추고 지금까지의 결과를 씁니다.
+            `MEMORY`: 방마다 붙잡고 있는 메모리의 어림값과, 누수로 보이는 객체들.
+            `TRACEMALLOC_START`, `TRACEMALLOC_STOP`: tracemalloc을 켜고 끕니다.
+            `TRACEMALLOC_DIFF`: 스냅숏을 찍어 직전 스냅숏보다 많이 늘어난 곳 `top`개.
+            `TOP`: 지금까지 CPU 시간, 바이트, 이벤트를 가장 많이 쓴 방과 유저 `n`개씩.
+            `REVOKE_SESSIONS`: `user_id`의 세션 토큰을 모두 폐기하고 접속을 끊습니다.
+            `BAN`, `UNBAN`: `user_id`를 차단하거나 차단을 풉니다.
+            `SET_PERMISSION`: `user_id`의 권한을 `permission`(`auth.PERMISSIONS` 중 하나)으로 바꿉니다.
+        """
+        type = message.get("type")
+        if type in ("PROFILE_ROOM", "PROFILE_STOP"):
+            return await self.toggle_profile(type, message)
+        if type == "MEMORY":
+            return {
+                "type": type,
+                "rooms": {room.id: memory.room_footprint(room) for room in self.rooms.values()},
+                "running_games": len(self.running_games),
+                "leaks": [leak._asdict() for leak in memory.LEAKS.leaks()],
+            }
+        if type == "TOP":
+            n = message.get("n", admin.TOP)
+            if not isinstance(n, int) or n < 1:
+                return {"type": "ERROR", "reason": "n은 1 이상의 정수여야 합니다."}
+            return {"type": type, **self.top_usage(n)}
+        if type == "TRACEMALLOC_START":
+            self.snapshots.start()
+            logger.info("tracemalloc started")
+            return {"type": type}
+        if type == "TRACEMALLOC_STOP":
+            self.snapshots.stop()
+            logger.info("tracemalloc stopped")
+            return {"type": type}
+        if type == "TRACEMALLOC_DIFF":
+            if not self.snapshots.tracing:
+                return {"type": "ERROR", "reason": "tracemalloc이 꺼져 있습니다."}
+            top = message.get("top", 20)
+            if not isinstance(top, int) or top < 1:
+                return {"type": "ERROR", "reason": "top은 1 이상의 정수여야 합니다."}
+            return {"type": type, "top": await self.snapshots.diff(top)}
+        if type in ("REVOKE_SESSIONS", "BAN", "UNBAN", "SET_PERMISSION"):
+            return await self.manage_user(type, message)
+        return {"type": "ERROR", "reason": f"알 수 없는 명령: {type}"}
+
+    async def toggle_profile(self, type: str, message: dict) -> dict:
+        if (room := self.rooms.get(message.get("room_id"))) is None:
+            return {"type": "ERROR", "reason": "그런 방이 없습니다."}
+        if type == "PROFILE_ROOM":
+            days = message.get("days", 1)
+            if not isinstance(days, int) or days < 1:
+                return {"type": "ERROR", "reason": "days는 1 이상의 정수여야 합니다."}
+            if room.profile:
+                return {"type": "ERROR", "reason": "이미 프로파일링하고 있습니다."}
+            room.profile = profiler.RoomProfile(room.id, days, room.day if room.in_game() else 1)
+            logger.info("profiling %s for %d day(s)", room, days)
+            return {"type": type, "room_id": room.id, "days": days}
+        if not room.profile:
+            return {"type": "ERROR", "reason": "프로파일링하고 있지 않습니다."}
+        profile, room.profile = room.profile, None
+        return {"type": type, "room_id": room.id, "path": await profile.finish()}
+
+    async def manage_user(self, type: str, message: dict) -> dict:
+        if not is_positive_int(user_id := message.get("user_id")):
+            return {"type": "ERROR", "reason": "user_id는 양의 정수여야 합니다."}
+        if type == "REVOKE_SESSIONS":
+            await self.revoke_sessions(user_id)
+            return {"type": type, "user_id": user_id}
+        if type == "SET_PERMISSION":
+            if (permission := message.get("permission")) not in auth.PERMISSIONS:
+                return {"type": "ERROR", "reason": f"permission은 {', '.join(auth.PERMISSIONS)} 중 하나여야 합니다."}
+            changed = await self.set_permission(user_id, permission)
+        else:
+            changed = await self.ban(user_id, type == "BAN")
+        if not changed:
+            return {"type": "ERROR", "reason": "그런 유저가 없습니다."}
+        logger.info("%s: %s", type, user_id)
+        return {"type": type, "user_id": user_id}
+
+    async def ban(self, user_id: int, banned: bool = True) -> bool:
+        """`user_id`를 차단하거나 차단을 풉니다. 차단하면 그 유저의 세션 토큰을 모두 폐기하고 접속을 끊습니다."""
+        changed = await self.users.ban(user_id, banned)
+        if changed and banned:
+            await self.revoke_sessions(user_id)
+        return changed
+
+    async def revoke_sessions(self, user_id: int):
+        """`user_id`가 지금까지 받은 세션 토큰을 모두 폐기하고 접속 중이면 끊습니다."""
+        self.sessions.revoke(user_id)
+        for user in [u for u in self.online if u.id == user_id]:
+            logger.info("disconnecting %s: sessions revoked", user)
+            await user.transport.close(code=1008)
+
+    async def set_permission(self, user_id: int, permission: str) -> bool:
+        changed = await self.users.set_permission(user_id, permission)
+        for user in self.online:
+            if user.id == user_id:
+                user.permission = permission
+        return changed
+
+    async def is_admin(self, user_id: Optional[int]) -> bool:
+        if user_id is None:
+            return False
+        record = await self.users.get(user_id)
+        return record is not None and record.permission == auth.ADMIN and not record.banned
+
+    USAGE = (  # (속성, 지표 이름, 단위 환산)
+        ("cpu_ns", "cpu_seconds", 1e-9),
+        ("bytes_sent", "bytes_sent", 1),
+        ("events_emitted", "events_emitted", 1),
+    )
+
+    def top_usage(self, n: int = admin.TOP) -> dict[str, dict[str, list]]:
+        """CPU 시간, 보낸 바이트 수, 보낸 이벤트 수가 가장 많은 방과 (접속 중인) 유저를 `n`개씩 반환합니다."""
+        return {
+            "rooms": {
+                key: [(room.id, getattr(room, key)) for room in heapq.nlargest(n, self.rooms.values(), key=attrgetter(key))]
+                for key, _, _ in self.USAGE
+            },
+            "users": {
+                key: [(user.username, getattr(user, key)) for user in heapq.nlargest(n, self.online, key=attrgetter(key))]
+                for key, _, _ in self.USAGE
+            },
+        }
+
+    def top_rooms_gauge(self, key: str, scale: float) -> dict[str, float]:
+        return {
+            str(room.id): getattr(room, key)*scale
+            for room in heapq.nlargest(admin.TOP, self.rooms.values(), key=attrgetter(key))
+        }
+
+    def trace(self, room_id: int) -> Optional[dict]:
+        """`room_id` 방의 구간 기록을 Chrome trace 형식으로 반환합니다. 0이면 방에 속하지 않는 서버 작업의 기록."""
+        if room_id == 0:
+            return tracing.SERVER.chrome_trace()
+        if room := self.rooms.get(room_id):
+            return room.tracer.chrome_trace()
+        return None
+
+    async def history(self, user_id: int, before: Optional[int] = None, limit: int = db.HISTORY_PAGE_SIZE,
+                      viewer: Optional[int] = None):
+        """`viewer`가 보는 `user_id`의 전적 한 쪽. 비공개 방의 게임은 `viewer`도 참가했을 때만 보입니다.
+        다음 쪽은 `next`를 `before`로 넘겨 받습니다. 마지막 쪽이면 `next`는 `None`입니다."""
+        games = await db.match_history(self.db, user_id, before, limit, viewer)
+        return {
+            "user_id": user_id,
+            "games": games,
+            "next": games[-1]["game_id"] if len(games) == max(1, min(limit, db.HISTORY_PAGE_SIZE_MAX)) else None,
+        }
+
+    async def game_metadata(self, game_id: int, viewer: Optional[int] = None):
+        return await db.game_metadata(self.db, game_id, viewer)
+
+    async def profile(self, user_id: int, viewer: Optional[int] = None):
+        """`viewer`가 보는 `user_id`의 요약 전적. 승리 수는 마지막 직업의 세력별로 묶습니다."""
+        profile = await db.user_profile(self.db, user_id, viewer=viewer)
+        wins_by_faction: dict[str, int] = dict()
+        for role_name, count in profile.pop("wins_by_role").items():
+            role = getattr(roles, role_name, None) if role_name else None
+            team = roles.faction(role) if inspect.isclass(role) else None
+            name = team.__name__ if team else "Unknown"
+            wins_by_faction[name] = wins_by_faction.get(name, 0) + count
+        profile["wins_by_faction"] = wins_by_faction
+        return profile
 
     async def leave_and_delete_room_if_empty(self, user: User):
         left = user.room
         await user.leave()
         if left.empty():
+            for watching in list(left.spectators.spectators):
+                watching.stop_spectating()
+            left.spectators.close()
             if left.id in self.rooms:
                 del self.rooms[left.id]
                 await self.broadcaster.deleted_room(left)
+                if not left.in_game():
+                    memory.LEAKS.watch(left, "Room")
+
+    def game_done(self, room: Room, game: Task):
+        """게임 태스크가 끝나면 불립니다. 게임 중에 지워진 방은 이제 다 쓴 것입니다."""
+        self.running_games.remove(game)
+        if self.rooms.get(room.id) is not room:
+            memory.LEAKS.watch(room, "Room")
+
+    @staticmethod
+    def setup_slot(message: dict) -> Optional[int]:
+        """메시지의 설정 칸 번호. 없거나 정수가 아니거나 범위를 벗어나면 `None`."""
+        slot = message.get("slot")
+        if type(slot) is int and 1 <= slot <= db.SETUP_SLOTS:
+            return slot
+        return None
 
     async def process_message(self, user: User, message: dict):
         msg_type = message["type"]
@@ -124,8 +411,11 @@ class GameServer:
                            title=message["title"],
                            password=message["password"],
                            capacity=15,
-                           room_id=self.next_room_id)
-            logger.debug(f"{user} creates {created}")
+                           room_id=self.next_room_id,
+                           broadcaster=self.broadcaster,
+                           archiver=self.archiver,
+                           spectator_delay=self.spectator_delay)
+            logger.debug("%s creates %s", user, created)
             # TODO: Event로 바꿔야 할까?
             await user.listen({"type": EventType.CREATE.name, "content": {"CREATED": created.id}})
             await user.enter(created)
@@ -144,10 +434,25 @@ class GameServer:
                 pass  # TODO: 그런 방이 없습니다.
         elif msg_type == EventType.LEAVE.name and user.room:
             await self.leave_and_delete_room_if_empty(user)
+        elif msg_type == EventType.SPECTATE.name and not user.room:
+            if not (room := self.rooms.get(message.get("id"))):
+                await user.listen({"type": EventType.ERROR.name, "content": {ContentKey.REASON.name: "그런 방이 없습니다."}})
+            elif not room.admits(message.get("password")):
+                await user.listen({"type": EventType.ERROR.name, "content": {ContentKey.REASON.name: "비밀번호가 틀렸습니다."}})
+            else:
+                if user.spectating:
+                    user.stop_spectating()
+                user.spectate(room)
+                await user.listen({"type": EventType.SPECTATE.name, "content": {
+                    "room": room.info(),
+                    "delay": room.spectators.delay,
+                }})
+        elif msg_type == EventType.SPECTATE_LEAVE.name and user.spectating:
+            user.stop_spectating()
         elif msg_type == EventType.MESSAGE.name and user.room:
             if is_command(message["text"], Command.BEGIN):
                 if user is user.room.host:
-                    if user.room.in_game():
+                    if user.room.in_game() or user.room.start_requested:
                         pass
                     elif not user.room.setup:
                         await user.room.emit(Event(EventType.ERROR, user.room.members, {
@@ -158,13 +463,15 @@ class GameServer:
                             ContentKey.REASON.name: f"설정은 {len(user.room.setup.formation)}인이지만 현재 인원은 {len(user.room.members)}인입니다."
                         }))
                     else:
-                        logger.info(
-                            f"Host({user}) requested game start in {user.room}")
+                        logger.info("Host(%s) requested game start in %s", user, user.room)
                         task_name = f"game in {user.room.id}"
+                        user.room.start_requested = True
+                        user.room.open_record()
                         await user.room.turn_phase(PhaseType.INITIATING)
-                        self.running_games.append(asyncio.create_task(
-                            user.room.run_game(user.ws.app.debug), name=task_name))
-                        logger.debug(f"create game task <{task_name}>")
+                        game = profiler.create_room_task(user.room, user.room.run_game(self.debug), task_name)
+                        game.add_done_callback(functools.partial(self.game_done, user.room))
+                        self.running_games.append(game)
+                        logger.debug("create game task <%s>", task_name)
                 else:
                     await user.room.emit(Event(EventType.ERROR, user, {ContentKey.REASON.name: "게임은 방장이 시작할 수 있습니다."}))
             else:
@@ -172,8 +479,7 @@ class GameServer:
                     await user.speak(message["text"])
                 except:
                     # 유저 접속은 유지하고 예외만 띄움
-                    logger.error(
-                        f"Error while processing {user}'s message: {message['text']}", exc_info=True)
+                    logger.error("Error while processing %s's message: %s", user, message["text"], exc_info=True)
         elif msg_type == EventType.SETUP.name and user.room and user is user.room.host:
             setup = message["setup"]
             try:
@@ -185,20 +491,111 @@ class GameServer:
                     setup["exclusion"]
                 )
             except SetupMalformed as e:
-                logger.warning(
-                    f"{user} malformed a formation({e}) for: {user.room}")
+                logger.warning("%s malformed a formation(%s) for: %s", user, e, user.room)
                 # await leave_and_delete_room_if_empty(user)
-                # await user.ws.close()
+                # await user.transport.close()
                 # TODO: add to blacklist
                 await user.room.emit(Event(EventType.ERROR, user, {ContentKey.REASON.name: "있을 수 없는 값이 설정에 있습니다."}))
             except SetupInvalid as e:
                 await user.room.emit(Event(EventType.ERROR, user, {ContentKey.REASON.name: str(e)}))
             except:
-                logger.error(
-                    f"{user}의 설정 적용 중 알 수 없는 오류가 발생했습니다.", exc_info=True)
+                logger.error("%s의 설정 적용 중 알 수 없는 오류가 발생했습니다.", user, exc_info=True)
                 await user.room.emit(Event(EventType.ERROR, user, {ContentKey.REASON.name: "설정 적용 중 알 수 없는 오류가 발생했습니다."}))
             else:
                 await user.room.emit(Event(EventType.SETUP, user.room.members, user.room.setup.jsonablify()))
+        elif (
+            msg_type in (EventType.SETUP_SAVE.name, EventType.SETUP_LOAD.name, EventType.SETUP_DELETE.name)
+            and (slot := self.setup_slot(message)) is None
+        ):
+            await user.listen({"type": EventType.ERROR.name, "content": {
+                ContentKey.REASON.name: f"설정 칸은 1~{db.SETUP_SLOTS}번만 있습니다."}})
+        elif msg_type == EventType.SETUP_SAVE.name:
+            try:
+                digest, setup = self.setup_cache.compile(message["setup"], user)
+                saved = await db.save_setup(self.db, str(user.username), slot, digest, setup.canonical_json())
+            except (SetupMalformed, ValueError, KeyError, TypeError) as e:
+                logger.warning("%s tried to save a malformed setup(%s)", user, e)
+                await user.listen({"type": EventType.ERROR.name, "content": {ContentKey.REASON.name: "있을 수 없는 값이 설정에 있습니다."}})
+            except SetupInvalid as e:
+                await user.listen({"type": EventType.ERROR.name, "content": {ContentKey.REASON.name: str(e)}})
+            else:
+                if saved:
+                    await user.listen({"type": EventType.SETUP_SAVE.name, "content": {"slot": slot, "hash": digest}})
+                else:
+                    await user.listen({"type": EventType.ERROR.name, "content": {ContentKey.REASON.name: "설정을 저장하려면 로그인해야 합니다."}})
+        elif msg_type == EventType.SETUP_LIST.name:
+            await user.listen({"type": EventType.SETUP_LIST.name, "content": {
+                "setups": [
+                    {"slot": slot, "hash": digest, "setup": json.loads(content)}
+                    for slot, digest, content in await db.list_setups(self.db, str(user.username))
+                ]
+            }})
+        elif msg_type == EventType.SETUP_LOAD.name and user.room and user is user.room.host and not user.room.in_game():
+            try:
+                digest = await db.load_setup_digest(self.db, str(user.username), slot)
+                setup = await self.setup_cache.load(digest, user) if digest else None
+            except ValueError as e:
+                await user.listen({"type": EventType.ERROR.name, "content": {ContentKey.REASON.name: str(e)}})
+            except:
+                logger.error("%s의 설정 불러오기 중 알 수 없는 오류가 발생했습니다.", user, exc_info=True)
+                await user.listen({"type": EventType.ERROR.name, "content": {ContentKey.REASON.name: "설정 불러오기 중 알 수 없는 오류가 발생했습니다."}})
+            else:
+                if setup:
+                    user.room.setup = setup
+                    await user.room.emit(Event(EventType.SETUP, user.room.members, user.room.setup.jsonablify()))
+                else:
+                    await user.listen({"type": EventType.ERROR.name, "content": {ContentKey.REASON.name: "그 칸에는 저장된 설정이 없습니다."}})
+        elif msg_type == EventType.HISTORY.name:
+            user_id = message.get("user_id", user.id)
+            before = message.get("before")
+            limit = message.get("limit", db.HISTORY_PAGE_SIZE)
+            if not is_positive_int(user_id) or not (before is None or is_positive_int(before)) or not is_positive_int(limit):
+                await user.listen({"type": EventType.ERROR.name, "content": {
+                    ContentKey.REASON.name: "user_id, before, limit은 양의 정수여야 합니다."}})
+            else:
+                await user.listen({"type": EventType.HISTORY.name, "content": await self.history(
+                    user_id, before, limit, user.id)})
+        elif msg_type == EventType.GAME_METADATA.name:
+            if is_positive_int(message.get("game_id")):
+                await user.listen({"type": EventType.GAME_METADATA.name, "content": await self.game_metadata(
+                    message["game_id"], user.id)})
+        elif msg_type == EventType.PROFILE.name:
+            user_id = message.get("user_id", user.id)
+            if is_positive_int(user_id):
+                await user.listen({"type": EventType.PROFILE.name, "content": await self.profile(user_id, user.id)})
+        elif msg_type == EventType.REPLAY.name and not user.room:
+            try:
+                replaying = replay.Replay(
+                    self.db,
+                    user,
+                    message["game_id"],
+                    message.get("speed", "1x"),
+                    message.get("day"),
+                    message.get("phase"),
+                    message.get("perspective")
+                )
+            except (KeyError, ValueError) as e:
+                await user.listen({"type": EventType.ERROR.name, "content": {ContentKey.REASON.name: str(e)}})
+            else:
+                if user.replay:
+                    user.replay.stop()
+                user.replay = replaying
+                replaying.start()
+        elif msg_type == EventType.REPLAY_SPEED.name and user.replay:
+            try:
+                user.replay.set_speed(message["speed"])
+            except (KeyError, ValueError) as e:
+                await user.listen({"type": EventType.ERROR.name, "content": {ContentKey.REASON.name: str(e)}})
+        elif msg_type == EventType.REPLAY_STOP.name and user.replay:
+            user.replay.stop()
+            user.replay = None
+        elif msg_type == EventType.SETUP_DELETE.name:
+            try:
+                deleted = await db.delete_setup(self.db, str(user.username), slot)
+            except ValueError as e:
+                await user.listen({"type": EventType.ERROR.name, "content": {ContentKey.REASON.name: str(e)}})
+            else:
+                await user.listen({"type": EventType.SETUP_DELETE.name, "content": {"slot": slot, "deleted": deleted}})
 
 
 def jsonablify(injsonable: dict):
@@ -209,6 +606,10 @@ def jsonablify(injsonable: dict):
     return remove_class(remove_enum(injsonable))
 
 
+def is_positive_int(value: Any) -> bool:
+    return type(value) is int and value > 0
+
+
 def is_command(msg: str, command: Command):
     return msg.startswith(command.value)
 
@@ -235,6 +636,9 @@ class CrimeType(Enum):
     ARSON = "방화"
 
 
+CRIME_BITS = {crime: 1 << bit for bit, crime in enumerate(CrimeType)}  # `Player.crimes`에서 각 범죄의 비트
+
+
 @unique
 class VoteType(IntEnum):
     ABSTENTION = 0
@@ -313,7 +717,21 @@ class EventType(Enum):
     AFK = auto()
     GAME_INFO = auto()
     SETUP = auto()
+    SETUP_SAVE = auto()
+    SETUP_LIST = auto()
+    SETUP_LOAD = auto()
+    SETUP_DELETE = auto()
     BACK_TO_IDLE = auto()
+    HISTORY = auto()
+    GAME_METADATA = auto()
+    PROFILE = auto()
+    SPECTATE = auto()
+    SPECTATE_LEAVE = auto()
+    REPLAY = auto()
+    REPLAY_EVENT = auto()
+    REPLAY_SPEED = auto()
+    REPLAY_STOP = auto()
+    REPLAY_END = auto()
 
     BEGIN = auto()
     FINISH = auto()
@@ -388,6 +806,7 @@ class Setup:
         exclusion: 제외 설정.
     """
 
+    @metrics.SETUP_VALIDATION_SECONDS.timed
     def __init__(self,
                  title: str,
                  inventor: User,
@@ -633,6 +1052,86 @@ class Setup:
             },
         }
 
+    def canonical(self):
+        """`inventor`를 뺀 설정 내용을 `__init__()`에 그대로 다시 넣을 수 있는 `dict` 꼴로 반환합니다.
+        내용이 같은 설정은 항상 같은 값을 반환합니다."""
+        jsonablified = self.jsonablify()
+        return {
+            "title": jsonablified["title"],
+            "formation": jsonablified["formation"],
+            "constraints": jsonablified["constraints"],
+            "exclusion": {
+                key: {name: True for name in excluded}
+                for key, excluded in jsonablified["exclusion"].items()
+            },
+        }
+
+    def canonical_json(self):
+        return json.dumps(self.canonical(), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+    def digest(self):
+        """설정 내용의 해시. 저장된 설정은 이 값으로 한 번만 저장됩니다."""
+        return hashlib.sha256(self.canonical_json().encode()).hexdigest()
+
+
+class SetupCache:
+    """검증을 마친 `Setup`을 해시로 찾는 LRU 캐시.
+    캐시에 있는 설정을 불러올 때는 `Setup.__init__()`의 검증을 다시 거치지 않습니다.
+
+    Attributes:
+        `capacity`: 최대로 보관하는 `Setup` 수.
+    """
+
+    def __init__(self, conns: db.ConnectionManager, capacity: int = 256):
+        self.conns = conns
+        self.capacity = capacity
+        self._setups: OrderedDict[str, Setup] = OrderedDict()
+
+    def get(self, digest: str) -> Optional[Setup]:
+        if setup := self._setups.get(digest):
+            self._setups.move_to_end(digest)
+        return setup
+
+    def put(self, digest: str, setup: Setup):
+        self._setups[digest] = setup
+        self._setups.move_to_end(digest)
+        while len(self._setups) > self.capacity:
+            self._setups.popitem(last=False)
+
+    def compile(self, content: dict, inventor: User) -> tuple[str, Setup]:
+        """`content`를 검증하여 `Setup`을 만들고 캐시에 넣습니다.
+
+        Raises:
+            `SetupInvalid`, `SetupMalformed`: `Setup.__init__()`을 참고하세요.
+        """
+        setup = self._validate(content, inventor)
+        digest = setup.digest()
+        self.put(digest, setup)
+        return digest, setup
+
+    @staticmethod
+    def _validate(content: dict, inventor: User) -> Setup:
+        return Setup(
+            content["title"],
+            inventor,
+            content["formation"],
+            content["constraints"],
+            content["exclusion"]
+        )
+
+    async def load(self, digest: str, inventor: User) -> Optional[Setup]:
+        """`digest`에 해당하는 `Setup`을 반환합니다. 캐시에 없을 때만 DB에서 읽어 검증하고 `digest`로 캐시합니다.
+        반환값은 캐시된 `Setup`의 깊은 복사본이며 `inventor`만 다릅니다. 방에서 고쳐도 캐시는 바뀌지 않습니다."""
+        if not (setup := self.get(digest)):
+            content = await db.load_setup_content(self.conns, digest)
+            if content is None:
+                return None
+            setup = self._validate(json.loads(content), inventor)
+            self.put(digest, setup)
+        loaded = copy.deepcopy(setup)
+        loaded.inventor = inventor.username
+        return loaded
+
 
 class Room:
     """게임방.
@@ -645,8 +1144,15 @@ class Room:
             `id`: 방 ID.
             `password`: 비밀번호. 기본값은 `None`이며 이 경우 비번 없는 공방이 됩니다.
             `members`: 재실자 `User` 목록.
-            `start_requested`: 게임 태스크가 만들어졌는지 여부. 자세한 것은 ws.process_message()를 참조하세요.
+            `start_requested`: 게임 태스크가 만들어졌고 아직 끝나지 않았는지 여부. 게임이 끝나 대기 상태로 돌아간 뒤에도
+                정리가 끝날 때까지는 참이므로 새 게임을 시작할 수 없습니다. 자세한 것은 `GameServer.process_message()`를 참조하세요.
             `setup`: 게임 설정 `Setup` 인스턴스.
+            `spectators`: 관전자들. `spectator.SpectatorTier`입니다.
+            `tracer`: 이 방의 구간 기록. `tracing.Tracer`입니다.
+            `profile`: 이 방을 프로파일링하고 있으면 `profiler.RoomProfile`, 아니면 `None`.
+            `events_emitted`, `bytes_sent`: 지금까지 보낸 이벤트 수와 바이트 수(관전자에게 보낸 것 포함).
+            `cpu_ns`: 이 방의 게임 태스크와 이 방 사람들의 메시지 처리에 쓴 CPU 시간(ns). `profiler.RoomStep`이 셉니다.
+            `sending`: 보내는 중인 메시지 수.
         In-game: 게임 시작 시 초기화되는 attributes.
             `role_name_pool`: 출현 가능한 직업 명단.
             `lineup_user`: 게임에 참가한 `User`.
@@ -667,7 +1173,7 @@ class Room:
             `executed`: 오늘 사형된 사람 목록.
             `suiciders`: 강제 자살자 목록.
             `TIME`: 단계별 제한시간.
-            `record`: 게임 기록.
+            `record`: 게임 기록. `record.GameRecord`입니다.
             `submitted_nickname`: 유저별 닉네임.
             `there_is`: 세력별 생존자.
     """
@@ -678,8 +1184,9 @@ class Room:
                  capacity: int,
                  room_id: int,
                  broadcaster: BroadCaster,
-                 recording_tasks: list[Task],
-                 password: Optional[str] = None):
+                 archiver: archiver.Archiver,
+                 password: Optional[str] = None,
+                 spectator_delay: float = spectator.DELAY):
         self.host = host
         self.members: list[User] = []
         self.title = title[:16].strip()
@@ -690,7 +1197,15 @@ class Room:
         self.start_requested = False
         self._phase = PhaseType.IDLE
         self.setup: Setup = None
-        self.recording_tasks = recording_tasks
+        self.archiver = archiver
+        self.spectators = spectator.SpectatorTier(f"room {room_id}", spectator_delay)
+        self.tracer = tracing.Tracer(room_id, f"room {room_id}")
+        self.profile: Optional[profiler.RoomProfile] = None
+        self.events_emitted = 0
+        self.bytes_sent = 0
+        self.sending = 0
+        self.cpu_ns = 0
+        self.release_game_state()  # 게임이 초기화되기 전에 온 채팅이 빈 값을 보도록 합니다.
 
     def __repr__(self):
         return f"<Room #{self.id} {len(self.members)}/{self.capacity}{' '+self.phase().name if hasattr(self, '_phase') else ''}>"
@@ -709,6 +1224,10 @@ class Room:
     def full(self):
         return len(self.members) >= self.capacity
 
+    def admits(self, password: Optional[str]) -> bool:
+        """`password`가 이 방의 비밀번호와 맞는지 확인합니다. 비번 없는 공방은 누구나 들어올 수 있습니다."""
+        return self.password is None or (password[:8] if password else None) == self.password
+
     def empty(self):
         return self.members == []
 
@@ -716,6 +1235,7 @@ class Room:
         """생존한 `Player`들."""
         return {i: p for i, p in self.lineup.items() if p.alive()}
 
+    @tracing.traced("reveal_identity")
     async def reveal_identity(self, dead: Player):
         """망자의 직업과 유언을 공표합니다.
         `dead.dead_sanitized==True`라면 숨긴 채로 공표합니다.
@@ -742,10 +1262,14 @@ class Room:
         self.graveyard.append(dead)
         await asyncio.sleep(3 if dead.cause_of_death[-1] == DEMOCRACY else 5)
 
+    def open_record(self):
+        """새 게임의 기록을 엽니다. `INITIATING`으로 바뀌기 전에 열어야 그 뒤로 오는 이벤트가 빈 기록에 가지 않습니다."""
+        self.record = record.GameRecord(1, PhaseType.INITIATING.name, journal=record.Journal.for_room(self.id))
+
+    @tracing.traced("init_game")
     async def init_game(self, debug_mode: bool):
-        """게임을 초기화합니다."""
-        self.record = []
-        logger.info(f"Initiating a game in: {self}")
+        """게임을 초기화합니다. 기록은 `open_record()`로 이미 열려 있어야 합니다."""
+        logger.info("Initiating a game in: %s", self)
         self.formation = self.setup.trial()
         self.dead_last_night: list[Player] = []
         self.jail_queue: list[Player] = []
@@ -831,13 +1355,10 @@ class Room:
     async def run_game(self, debug_mode: bool):
         try:
             await self.init_game(debug_mode)
-            logger.info(f"Running a game in: {self}")
+            logger.info("Running a game in: %s", self)
         except:
-            logger.error(f"GAME TERMINATED IN {self}", exc_info=True)
-            content = {
-                "type": "BOOM"
-            }
-            await asyncio.gather(*[u.listen(content) for u in self.members], return_exceptions=True)
+            logger.error("GAME TERMINATED IN %s", self, exc_info=True)
+            await self.end_game(archive=False, boom=True)
             return
         try:
             while True:
@@ -849,8 +1370,10 @@ class Room:
                 # 최소한 5초는 쉬고 낮이 됩니다.
                 await asyncio.sleep(1 if debug_mode else 5)
                 self.day += 1
+                if self.profile and not await self.profile.next_day(self.day):
+                    self.profile = None
                 for i, r in self.remaining().items():
-                    r.extend_action_record()
+                    r.start_day(self.day)
                 # 아침
                 self.jail_queue.clear()
                 await self.turn_phase(PhaseType.MORNING)
@@ -967,25 +1490,64 @@ class Room:
                     break
             await self.finish_game()
         except:
-            logger.error(f"GAME TERMINATED IN {self}", exc_info=True)
-            content = {
-                "type": "BOOM"
-            }
-            await asyncio.gather(*[u.listen(content) for u in self.members], return_exceptions=True)
+            logger.error("GAME TERMINATED IN %s", self, exc_info=True)
+            await self.end_game(archive=True, boom=True)
         else:
-            logger.info(f"A game finished in: {self}")
-        finally:
-            self.recording_tasks.append(
-                asyncio.create_task(db.archive(GameData(self))))
+            logger.info("A game finished in: %s", self)
+            await self.end_game(archive=True)
+
+    async def end_game(self, archive: bool, boom: bool = False):
+        """게임을 끝내고 대기 상태로 돌아갑니다. `archive`면 기록을 보관하고, 아니면 저널을 지웁니다.
+        `boom`이면 게임이 오류로 끝났음을 먼저 알립니다."""
+        # 게임 상태를 놓기 전에 먼저 대기 상태로 돌립니다. 아래에서 기다리는 동안 온 채팅은
+        # 기록에 덧붙지 않고 로비 채팅으로 갑니다. 새 게임은 `start_requested`가 풀린 뒤에야 시작됩니다.
+        self._phase = PhaseType.IDLE
+        try:
+            if boom:
+                await asyncio.gather(*[u.listen({"type": "BOOM"}) for u in self.members], return_exceptions=True)
+            if self.record and archive:
+                await self.record.close()
+                self.archiver.submit(GameSummary(self))
+            elif self.record:
+                try:
+                    await self.record.discard()
+                except OSError:
+                    logger.error("ERROR while removing the journal of %s", self, exc_info=True)
+            if self.profile:
+                profile, self.profile = self.profile, None
+                await profile.finish()
             for r in self.members:
                 if r.player in self.lineup.values():
                     r.player = None
+            self.release_game_state()
             await self.emit(Event(EventType.BACK_TO_IDLE, self.members, {"members": [u.username for u in self.members]}, no_record=True))
             await self.turn_phase(PhaseType.IDLE)
+        finally:
+            self.start_requested = False
+
+    def release_game_state(self):
+        """끝난 게임의 `Player`, 직업, 기록을 놓아 줍니다. 보관할 값은 `GameSummary`에 따로 있습니다."""
+        for player in getattr(self, "lineup", {}).values():
+            memory.LEAKS.watch(player, "Player")
+        self.lineup = {}
+        self.lineup_users = []
+        self.formation = []
+        self.dead_last_night = []
+        self.jail_queue = []
+        self.private_chat = {}
+        self.graveyard = []
+        self.winners = []
+        self.hell = []
+        self.leavers = []
+        self.elected = None
+        self.executed = []
+        self.suiciders = {}
+        self.submitted_nickname = {}
+        self.record = None
 
     async def finish_game(self):
         await self.turn_phase(PhaseType.FINISHING)
-        logger.info(f"Finishing a game in: {self}")
+        logger.info("Finishing a game in: %s", self)
         main_winner = None
         win_alone = False
         citizen_tie = False
@@ -1134,6 +1696,7 @@ class Room:
             if m.role().belongs_to(category) and m.user in self.members:
                 m.win()
 
+    @tracing.traced("trigger_evening_events")
     async def trigger_evening_events(self):
         converting_coros = []
         INTERN = 0
@@ -1198,6 +1761,8 @@ class Room:
             "OILED": [i for i, m in self.remaining().items() if m.oiled]
         }))
 
+    @metrics.NIGHT_EVENTS_SECONDS.timed
+    @tracing.traced("trigger_night_events")
     async def trigger_night_events(self):
         self.actors_today = self.remaining().values()
         INACTIVE = "INACTIVE"
@@ -1268,102 +1833,93 @@ class Room:
         done: set[Type[roles.Role]] = set()
         worked_roles: set[roles.Role] = set()
         for role in priority:
-            if role == SUICIDE:
-                self.suiciders.update({
-                    "will": actor
-                    for actor in self.actors_today
-                    if actor.will_suicide
-                })
-                for trigger, suiciders in self.suiciders.items():
-                    for s in suiciders:
-                        if s.is_healed():
-                            for m, data in s.healed_by.pop().heal_against(SUICIDE):
-                                await self.emit(Event(EventType.ABILITY_RESULT, m, data))
-                        else:
-                            await self.emit(Event(EventType.SOUND, self.members, {roles.AbilityResultKey.SOUND.name: SUICIDE}))
-                            await s.die(trigger if isinstance(trigger, str) else trigger.name)
-                            await asyncio.sleep(1)
-                for left in self.leavers:
-                    await self.emit(Event(EventType.SOUND, self.members, {roles.AbilityResultKey.SOUND.name: SUICIDE}))
-                    await left.die("leave")  # 치료 불가
-                self.leavers.clear()
-                self.suiciders.clear()
-            else:
-                if role == INACTIVE:
-                    actors_for_this_priority = [
-                        actor
-                        for actor in self.remaining().values()
-                        if not actor.role().belongs_to(roles.Visiting)
-                        and not actor.role().belongs_to(roles.ActiveOnly)
-                    ]
-                elif issubclass(role, roles.Killing):
-                    actors_for_this_priority = [
-                        actor
+            with self.tracer.span("priority", role=role if isinstance(role, str) else role.__name__):
+                if role == SUICIDE:
+                    self.suiciders.update({
+                        "will": actor
                         for actor in self.actors_today
-                        if actor.role().belongs_to(role)
-                        and not (
-                            actor.role().belongs_to(roles.KillingVisiting)
-                            and actor.visits[self.day]
-                            and actor.visits[self.day].role().belongs_to(roles.Veteran)
-                            and actor.visits[self.day].act[self.day]
-                        )
-                    ]
-                else:
-                    actors_for_this_priority = [
-                        actor
-                        for actor in self.remaining().values()
-                        if actor.role().belongs_to(role)
-                    ]
-                for actor in actors_for_this_priority:
-                    # TODO: ActiveAndVisiting 반영
-                    events = None
-                    if role in done:
-                        if actor.role().do_second_task_today:
-                            events = actor.role().second_task(self.day)
-                    elif actor.visits[self.day] or actor.act[self.day]:
-                        if determined := actor.visits[self.day]:
-                            if actor.role().opportunity is not None and actor.role().opportunity <= 0:  # 기회가 없는데 방문하도록 조종당하면
-                                events = roles.Visiting.visit(
-                                    actor.role(), self.day, determined)
+                        if actor.will_suicide
+                    })
+                    for trigger, suiciders in self.suiciders.items():
+                        for s in suiciders:
+                            if s.is_healed():
+                                for m, data in s.healed_by.pop().heal_against(SUICIDE):
+                                    await self.emit(Event(EventType.ABILITY_RESULT, m, data))
                             else:
-                                events = actor.role().visit(self.day, determined)
-                        else:
-                            events = actor.role().act(self.day)
+                                await self.emit(Event(EventType.SOUND, self.members, {roles.AbilityResultKey.SOUND.name: SUICIDE}))
+                                await s.die(trigger if isinstance(trigger, str) else trigger.name)
+                                await asyncio.sleep(1)
+                    for left in self.leavers:
+                        await self.emit(Event(EventType.SOUND, self.members, {roles.AbilityResultKey.SOUND.name: SUICIDE}))
+                        await left.die("leave")  # 치료 불가
+                    self.leavers.clear()
+                    self.suiciders.clear()
+                else:
+                    if role == INACTIVE:
+                        actors_for_this_priority = [
+                            actor
+                            for actor in self.remaining().values()
+                            if not actor.role().belongs_to(roles.Visiting)
+                            and not actor.role().belongs_to(roles.ActiveOnly)
+                        ]
+                    elif issubclass(role, roles.Killing):
+                        actors_for_this_priority = [
+                            actor
+                            for actor in self.actors_today
+                            if actor.role().belongs_to(role)
+                            and not (
+                                actor.role().belongs_to(roles.KillingVisiting)
+                                and actor.visits[self.day]
+                                and actor.visits[self.day].role().belongs_to(roles.Veteran)
+                                and actor.visits[self.day].act[self.day]
+                            )
+                        ]
                     else:
-                        events = actor.role().action_when_inactive(self.day)
-                    if not events:
-                        continue
-                    for e in events if isinstance(events, list) else [events]:
-                        if sound := e.get(roles.AbilityResultKey.SOUND):
-                            affected = e[roles.AbilityResultKey.INDIVIDUAL].keys()
-                            listening = set(self.members).difference(
-                                {p.user for p in affected})
-                            await asyncio.gather(*[self.emit(Event(EventType.SOUND, m, {
-                                roles.AbilityResultKey.SOUND.name: sound if isinstance(sound, str) else sound.__name__,
-                                roles.AbilityResultKey.LENGTH.name: e.get(roles.AbilityResultKey.LENGTH),
-                                "data": jsonablify(e[roles.AbilityResultKey.INDIVIDUAL][m])
-                            })) for m in affected] + [self.emit(Event(EventType.SOUND, listening, {
-                                roles.AbilityResultKey.SOUND.name: sound if isinstance(sound, str) else sound.__name__,
-                                roles.AbilityResultKey.LENGTH.name: e.get(roles.AbilityResultKey.LENGTH),
-                            }))])
-                            await asyncio.sleep(1)
-                        for m, data in e[roles.AbilityResultKey.INDIVIDUAL].items():
-                            result_type = data.get(roles.AbilityResultKey.TYPE)
-                            if result_type is roles.AbilityResultKey.KILLED:
-                                await m.die(
-                                    data[roles.AbilityResultKey.BY]
-                                    if isinstance(data[roles.AbilityResultKey.BY], str)
-                                    else data[roles.AbilityResultKey.BY].__name__
-                                )
-                            elif result_type is roles.AbilityResultKey.CONVERTED:
-                                await m.be(data[roles.AbilityResultKey.INTO](m, self.setup.constraints[data[roles.AbilityResultKey.INTO]]), jsonablify(data))
-                                if data.get("notes") is roles.Amnesiac and m.visits[self.day].role().opportunity is not None:
-                                    m.role().opportunity = m.visits[self.day].role(
-                                    ).opportunity or 1
+                        actors_for_this_priority = [
+                            actor
+                            for actor in self.remaining().values()
+                            if actor.role().belongs_to(role)
+                        ]
+                    for actor in actors_for_this_priority:
+                        # TODO: ActiveAndVisiting 반영
+                        events = None
+                        if role in done:
+                            if actor.role().do_second_task_today:
+                                events = actor.role().second_task(self.day)
+                        elif actor.visits[self.day] or actor.act[self.day]:
+                            if determined := actor.visits[self.day]:
+                                if actor.role().opportunity is not None and actor.role().opportunity <= 0:  # 기회가 없는데 방문하도록 조종당하면
+                                    events = roles.Visiting.visit(
+                                        actor.role(), self.day, determined)
+                                else:
+                                    events = actor.role().visit(self.day, determined)
                             else:
-                                await self.emit(Event(EventType.ABILITY_RESULT, m, jsonablify(data)))
-                        worked_roles.add(actor.role())
-                done.add(role)
+                                events = actor.role().act(self.day)
+                        else:
+                            events = actor.role().action_when_inactive(self.day)
+                        if not events:
+                            continue
+                        for e in events if isinstance(events, list) else [events]:
+                            if e.get(roles.AbilityResultKey.SOUND):
+                                await self.emit_sound(e)
+                                await asyncio.sleep(1)
+                            for m, data in e[roles.AbilityResultKey.INDIVIDUAL].items():
+                                result_type = data.get(roles.AbilityResultKey.TYPE)
+                                if result_type is roles.AbilityResultKey.KILLED:
+                                    await m.die(
+                                        data[roles.AbilityResultKey.BY]
+                                        if isinstance(data[roles.AbilityResultKey.BY], str)
+                                        else data[roles.AbilityResultKey.BY].__name__
+                                    )
+                                elif result_type is roles.AbilityResultKey.CONVERTED:
+                                    await m.be(data[roles.AbilityResultKey.INTO](m, self.setup.constraints[data[roles.AbilityResultKey.INTO]]), jsonablify(data))
+                                    if data.get("notes") is roles.Amnesiac and m.visits[self.day].role().opportunity is not None:
+                                        m.role().opportunity = m.visits[self.day].role(
+                                        ).opportunity or 1
+                                else:
+                                    await self.emit(Event(EventType.ABILITY_RESULT, m, jsonablify(data)))
+                            worked_roles.add(actor.role())
+                    done.add(role)
         await asyncio.gather(*[
             self.emit(Event(EventType.ABILITY_RESULT, spy, jsonablify(
                 spy.role().after_night()[roles.AbilityResultKey.INDIVIDUAL][spy])))
@@ -1378,6 +1934,21 @@ class Room:
             if exe.role().belongs_to(roles.Executioner) and list(exe.role().goal_target)[0] in self.dead_last_night:
                 await exe.be(roles.Jester(exe, self.setup.constraints[roles.Jester]))
 
+    async def emit_sound(self, e: dict):
+        """능력 결과 `e`의 소리를 냅니다. 능력을 받은 플레이어에게는 결과와 함께, 나머지 방 사람들에게는 소리만 보냅니다."""
+        sound = e[roles.AbilityResultKey.SOUND]
+        affected = e[roles.AbilityResultKey.INDIVIDUAL].keys()
+        affected_users = {p.user for p in affected}
+        listening = [m for m in self.members if m not in affected_users]
+        await asyncio.gather(*[self.emit(Event(EventType.SOUND, m, {
+            roles.AbilityResultKey.SOUND.name: sound if isinstance(sound, str) else sound.__name__,
+            roles.AbilityResultKey.LENGTH.name: e.get(roles.AbilityResultKey.LENGTH),
+            "data": jsonablify(e[roles.AbilityResultKey.INDIVIDUAL][m])
+        })) for m in affected] + [self.emit(Event(EventType.SOUND, listening, {
+            roles.AbilityResultKey.SOUND.name: sound if isinstance(sound, str) else sound.__name__,
+            roles.AbilityResultKey.LENGTH.name: e.get(roles.AbilityResultKey.LENGTH),
+        }))])
+
     async def timer(self, of: PhaseType, for_: Union[float, int]):
         wake_at = (60, 30, 10, 5, 0)
         for sec in wake_at:
@@ -1395,15 +1966,19 @@ class Room:
 
     async def turn_phase(self, into: PhaseType):
         """`into` phase에 돌입합니다."""
-        self._phase = into
-        await self.emit(Event(EventType.PHASE, self.members, {
-            ContentKey.PHASE.name: into.name,
-            ContentKey.WHO.name:
-                self.elected.index
-                if self.in_game() and self.phase() is not PhaseType.INITIATING and self.elected
-                else None,
-        }, no_record=into is PhaseType.INITIATING or into is PhaseType.IDLE))
-        await self.broadcaster.room_status_change(self)
+        with self.tracer.span("turn_phase", phase=into.name):
+            self._phase = into
+            if self.in_game() and into is not PhaseType.INITIATING:
+                self.record.mark_phase(self.day, into.name)
+                await self.record.flush()
+            await self.emit(Event(EventType.PHASE, self.members, {
+                ContentKey.PHASE.name: into.name,
+                ContentKey.WHO.name:
+                    self.elected.index
+                    if self.in_game() and self.phase() is not PhaseType.INITIATING and self.elected
+                    else None,
+            }, no_record=into is PhaseType.INITIATING or into is PhaseType.IDLE))
+            await self.broadcaster.room_status_change(self)
 
     def find_player_by_index(self, index: int):
         """`index`번 플레이어를 가져옵니다."""
@@ -1419,36 +1994,106 @@ class Room:
         어떤 이벤트를 누구에게 어떤 타입으로 보내는지 결정하는 것은
         전적으로 `emit()`을 호출하는 함수의 몫입니다.
         """
-        if self.in_game() and not e.no_record:
-            data = {
-                "type": e.type.name,
-                "content": e.content,
-                "from": e.from_.username if e.from_ else None,  # TODO: username을 unique id로 대체
-                "to": [
-                    m.username
-                    if isinstance(m, User)
-                    else m.user.username
-                    for m in e.to
-                ],  # TODO: username을 unique id로 대체
-                "time": time.time()
-            }
-            self.record.append(data)
-        await asyncio.gather(*[member.listen({
-            "type": e.type.name,
-            "content": e.content,
-        }) for member in e.to])
+        with self.tracer.span("emit", type=e.type.name):
+            if self.in_game() and not e.no_record:
+                data = {
+                    "type": e.type.name,
+                    "content": e.content,
+                    "from": e.from_.username if e.from_ else None,  # TODO: username을 unique id로 대체
+                    "to": [
+                        m.username
+                        if isinstance(m, User)
+                        else m.user.username
+                        for m in e.to
+                    ],  # TODO: username을 unique id로 대체
+                    "time": record.now_ms(),
+                    "flags": record.PUBLIC if e.to is self.members else 0,
+                }
+                self.record.append(data)
+            metrics.EVENTS_EMITTED.inc(label=e.type.name)
+            self.events_emitted += 1
+            if e.from_:
+                e.from_.events_emitted += 1
+            if e.to is self.members:
+                self.spectators.publish(e.type.name, e.content)
+            sending = len(e.to)
+            self.sending += sending
+            try:
+                await asyncio.gather(*[member.listen({
+                    "type": e.type.name,
+                    "content": e.content,
+                }) for member in e.to])
+            finally:
+                self.sending -= sending
+
+
+class Participant(NamedTuple):
+    """게임 참가자 한 명의 결과. `GameParticipants` 테이블의 행 하나에 대응합니다."""
+    user_id: Optional[int]
+    seat: int
+    initial_role: str
+    final_role: str
+    won: bool
+    death_cause: Optional[str]
 
 
-class GameData:
-    """게임 기록입니다. 메타데이터를 포함합니다."""
+class GameSummary:
+    """끝난 게임의 요약. 보관에 필요한 값만 가지며 만든 뒤에는 바꿀 수 없습니다.
+    `Room`, `Player`, `User`를 참조하지 않으므로 게임이 끝나면 방의 게임 상태를 바로 놓아 줄 수 있습니다.
+
+    Attributes:
+        `formation`, `constraints`, `exclusion`: `Setup.jsonablify()`의 각 값을 JSON으로 직렬화한 문자열.
+        `participants`: 자리 번호 순서의 `Participant`들.
+        `record`: 게임 기록. 저널이 있으면 기록은 저널 파일에 있습니다.
+    """
+    __slots__ = (
+        "title",
+        "private",
+        "rank_mode",
+        "setup_title",
+        "inventor",
+        "formation",
+        "constraints",
+        "exclusion",
+        "participants",
+        "record",
+    )
 
     def __init__(self, room: Room):
-        self.title = room.title
-        self.private = room.password is not None
-        self.lineup = room.lineup
-        self.setup = room.setup
-        self.record = room.record[:]
-        self.rank_mode = False  # TODO
+        setup = room.setup.jsonablify()
+        winners = {player for player, role in room.winners}
+        values = {
+            "title": room.title,
+            "private": room.password is not None,
+            "rank_mode": False,  # TODO
+            "setup_title": setup["title"],
+            "inventor": setup["inventor"],
+            "formation": json.dumps(setup["formation"]),
+            "constraints": json.dumps(setup["constraints"]),
+            "exclusion": json.dumps(setup["exclusion"]),
+            "participants": tuple(
+                Participant(
+                    user_id=p.user.id,
+                    seat=i,
+                    initial_role=p._role_record[0].name,
+                    final_role=p.role().name,
+                    won=p in winners,
+                    death_cause=None if p.alive() else p.cause_of_death[-1]
+                ) for i, p in sorted(room.lineup.items())
+            ),
+            "record": room.record,
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self):
+        return f"<GameSummary [{self.title}] {len(self.participants)} players>"
 
 
 class User:
@@ -1456,20 +2101,35 @@ class User:
 
     Attributes:
         `username`: 사용자명.
-        `ws`: 이 `User`에 연결된 `WebSocket`.
+        `id`: 유저 ID.
+        `permission`: 권한. `Users` 테이블의 `Permission`입니다.
+        `transport`: 이 `User`와 메시지를 주고받는 `transport.Transport`.
         `existing`: 중복 접속 여부. 이 계정으로 중복 접속이 시도되면 기존 `User` 오브젝트에 `existing=True`가 적용됩니다.
         `room`: 현재 있는 `Room`.
         `player`: 현재 인게임 `Player`.
+        `replay`: 보고 있는 다시 보기(`replay.Replay`).
+        `spectating`: 관전 중인 `Room`.
+        `messages`: 받은 메시지 수.
+        `events_emitted`: 이 유저가 보낸 것으로 나간 이벤트 수(채팅 등).
+        `bytes_sent`: 이 유저에게 보낸 바이트 수.
+        `cpu_ns`: 이 유저의 메시지를 처리하는 데 쓴 CPU 시간(ns).
     """
 
-    def __init__(self, username: str, ws: WebSocket):
+    def __init__(self, username: str, transport: transport.Transport):
         self.username = username
-        # TODO: self.id
-        self.ws = ws
+        self.id: Optional[int] = None  # Users 테이블의 ID. 로그인하지 않았다면 None.
+        self.permission: Optional[str] = None
+        self.transport = transport
         self.existing = False
         self.room: Room = None
         self.in_game = False
         self.player: Player = None
+        self.replay: Optional[replay.Replay] = None
+        self.spectating: Optional[Room] = None
+        self.messages = 0
+        self.events_emitted = 0
+        self.bytes_sent = 0
+        self.cpu_ns = 0
 
     def __repr__(self):
         return f"<User [{self.username}]>"
@@ -1480,12 +2140,17 @@ class User:
         return NotImplemented
 
     def __hash__(self):
-        return self.username  # TODO
+        return hash(self.username)
 
     async def enter(self, room: Room):
+        if self.replay:
+            self.replay.stop()
+            self.replay = None
+        if self.spectating:
+            self.stop_spectating()
         self.room = room
         room.members.append(self)
-        logger.debug(f"{self.username} enters {room}")
+        logger.debug("%s enters %s", self.username, room)
         room_info = room.get_room_ingame_info()
         if room.in_game():
             room.hell.append(self)
@@ -1494,6 +2159,16 @@ class User:
         await room.emit(Event(EventType.ENTER, room.members, enter_notice))
         await self.room.broadcaster.room_status_change(self.room)
 
+    def spectate(self, room: Room):
+        self.spectating = room
+        room.spectators.add(self)
+        logger.debug("%s spectates %s", self.username, room)
+
+    def stop_spectating(self):
+        self.spectating.spectators.remove(self)
+        logger.debug("%s stops spectating %s", self.username, self.spectating)
+        self.spectating = None
+
     async def leave(self):
         """방을 나갑니다. 더 이상 `user.room`으로 방에 접근할 수 없습니다.
         게임 중 탈주도 이 함수에서 처리합니다.
@@ -1503,11 +2178,11 @@ class User:
         self.room.members.remove(self)
         if self is left.host and not left.empty():
             left.host = left.members[0]
-            logger.debug(f"{left.host} now hosts {left}.")
+            logger.debug("%s now hosts %s.", left.host, left)
             # TODO: announce new host
         if self.player:
             if self.player.alive():
-                logger.warning(f"{self} left {left} alive")
+                logger.warning("%s left %s alive", self, left)
                 left.leavers.append(self)
                 await left.emit(Event(EventType.LEAVE, left.members, {"index": self.player.index}))
             else:
@@ -1516,7 +2191,7 @@ class User:
         else:
             await left.emit(Event(EventType.LEAVE, left.members, {"who": self.username}))
         self.room = None
-        logger.debug(f"{self} leaves room #{left.id}")
+        logger.debug("%s leaves room #%d", self, left.id)
         await left.broadcaster.room_status_change(left)
 
     async def speak(self, msg: str):
@@ -1556,23 +2231,52 @@ class User:
             if is_command(msg, Command.SLASH):
                 pass
             else:
-                content = {ContentKey.FROM: self.username,
-                           ContentKey.MESSAGE: msg}
+                content = {ContentKey.FROM.name: self.username,
+                           ContentKey.MESSAGE.name: msg}
                 await room.emit(Event(EventType.MESSAGE, room.members, content, self))
-                logger.debug(f"[{room.id}] {self.username}: {msg}")
+                logger.debug("[%d] %s: %s", room.id, self.username, msg)
 
     async def listen(self, data: dict):
+        await self._deliver(self.transport.send(data))
+
+    async def listen_text(self, text: str):
+        """이미 JSON으로 직렬화된 `text`를 그대로 보냅니다."""
+        await self._deliver(self.transport.send_text(text))
+
+    async def _deliver(self, sending):
+        started = time.perf_counter()
         try:
-            await self.ws.send_json(data)
-        except TypeError:  # JSON 변환 불가
-            raise
-        # 나간 경우. 이때는 그냥 ws_endpoint의 finally까지 기다리기만 하면 됩니다.
-        except (RuntimeError, ConnectionClosed):
-            pass
+            sent = await sending
+        # 나간 경우. 이때는 그냥 GameServer.serve()의 finally까지 기다리기만 하면 됩니다.
+        except transport.Closed:
+            return
+        metrics.BYTES_SENT.inc(sent)
+        self.bytes_sent += sent
+        if room := self.room or self.spectating:
+            room.bytes_sent += sent
+        metrics.LISTEN_SECONDS.observe(time.perf_counter() - started)
 
 
 class Player:
-    """인게임 플레이어. 시체를 겸합니다."""
+    """인게임 플레이어. 시체를 겸합니다.
+
+    방 하나에 15명씩 만들어지므로 `__slots__`를 쓰고, 날마다의 행동 기록은 미리 잡아 둔 배열에 둡니다.
+
+    Attributes:
+        `crimes`: 저지른 범죄의 비트 집합. 비트는 `CRIME_BITS`를 따릅니다.
+        `visits`: 날마다 방문한 플레이어.
+        `visited_by`: 날마다 이 플레이어를 방문한 플레이어 번호의 비트 집합. `visitors()`로 읽습니다.
+        `act`: 날마다 고유 능력을 쓰는지 여부.
+        `last_day`: 행동 기록이 있는 마지막 날.
+    """
+    __slots__ = (
+        "user", "index", "nickname", "room", "_role_record", "has_left", "lw", "crimes",
+        "visits", "visited_by", "act", "last_day", "bodyguarded_by", "healed_by", "oiled", "is_behind",
+        "has_voted_to", "has_voted_to_skip", "voted_count", "execution_choice", "will_suicide",
+        "jailed_by", "controlled_by", "framed", "blackmailed_on", "cause_of_death", "dead_sanitized",
+        "__weakref__",  # memory.LEAKS
+    )
+    ACTION_DAYS = 16  # 행동 기록 배열의 처음 길이. 모자라면 두 배로 늘립니다.
 
     def __init__(self,
                  user: User,
@@ -1589,12 +2293,13 @@ class Player:
             role(self, constraints)]
         self.has_left = False
         self.lw = ""
-        self.crimes = {c: False for c in CrimeType}
-        self.visits: list[Union[None, Player]] = [None, None]
-        self.visited_by: list[set[Player]] = [None, set()]
+        self.crimes = 0
+        self.visits: list[Optional[Player]] = [None] * self.ACTION_DAYS
+        self.visited_by = array("Q", bytes(8 * self.ACTION_DAYS))
+        self.act = bytearray(self.ACTION_DAYS)
+        self.last_day = 1
         self.bodyguarded_by: list[Player] = []
         self.healed_by: list[Player] = []
-        self.act: list[bool] = [False, False]
         self.oiled = False
         self.is_behind: Player = None
         self.has_voted_to: Player = None
@@ -1711,7 +2416,7 @@ class Player:
             }))]*self.role().votes)
 
     async def die(self, cause: str):
-        logger.debug(f"{self} dies in {self.room}")
+        logger.debug("%s dies in %s", self, self.room)
         self.cause_of_death.append(cause)
         await self.room.emit(Event(EventType.DEAD, self, {"cause": cause}))
 
@@ -1719,7 +2424,21 @@ class Player:
         self.room.winners.append((self, self.role()))
 
     def commit_crime(self, crime: CrimeType):
-        self.crimes[crime] = True
+        self.crimes |= CRIME_BITS[crime]
+
+    def has_committed(self, crime: CrimeType) -> bool:
+        return bool(self.crimes & CRIME_BITS[crime])
+
+    def crime_record(self) -> dict[CrimeType, bool]:
+        return {crime: bool(self.crimes & bit) for crime, bit in CRIME_BITS.items()}
+
+    def add_visitor(self, day: int, visitor: Player):
+        self.visited_by[day] |= 1 << visitor.index
+
+    def visitors(self, day: int) -> list[Player]:
+        """`day`일에 이 플레이어를 방문한 플레이어들을 번호 순으로 반환합니다."""
+        visited_by = self.visited_by[day]
+        return [player for index, player in self.room.lineup.items() if visited_by >> index & 1]
 
     def write_lw(self, lw: str):
         self.lw = lw
@@ -1904,7 +2623,7 @@ class Player:
                                 ContentKey.ROLE: roles.Jailor.__name__
                                 if self.role().belongs_to(roles.Jailing)
                                 else self.role().name,
-                                ContentKey.ACTIVE: self.act[room.day]
+                                ContentKey.ACTIVE: bool(self.act[room.day])
                             }
                             event = self._make_event(
                                 EventType.ACT,
@@ -1967,10 +2686,14 @@ class Player:
                 event = self._make_event(EventType.ERROR, self, content)
         return event
 
-    def extend_action_record(self):
-        self.visits.append(None)
-        self.visited_by.append(set())
-        self.act.append(False)
+    def start_day(self, day: int):
+        """`day`일의 행동 기록을 시작합니다."""
+        while day >= len(self.act):
+            grown = len(self.act)
+            self.visits.extend([None] * grown)
+            self.visited_by.extend(array("Q", bytes(8 * grown)))
+            self.act.extend(bytes(grown))
+        self.last_day = day
         self.healed_by.clear()
         self.bodyguarded_by.clear()
 
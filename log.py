@@ -1,2 +1,104 @@
+"""로그.
+
+`start()`를 부르면 `logger`의 레코드는 큐에만 들어가고, 파일과 표준 출력에 쓰는 일은 `QueueListener`의
+스레드가 합니다. 따라서 로그를 쓰느라 이벤트 루프가 막히지 않습니다.
+
+레코드에는 `room_id`, `day`, `phase`, `user`가 붙습니다. 값은 레코드를 만드는 쪽(이벤트 루프)에서
+`current_room`과 `current_user`로 채웁니다. 게임 태스크는 `profiler.create_room_task()`가,
+접속 하나를 처리하는 태스크는 `GameServer.endpoint()`가 값을 정해 둡니다.
+
+메시지는 `logger.debug("%s dies in %s", player, room)`처럼 %-형식으로 넘겨야
+로그 수준이 낮아 버려지는 레코드의 `__repr__()`을 부르지 않습니다.
+"""
+from __future__ import annotations
+import sys
+import json
+import queue
 import logging
-logger = logging.getLogger("uvicorn.error")
\ No newline at end of file
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+from uvicorn.logging import DefaultFormatter
+
+logger = logging.getLogger("uvicorn.error")
+
+current_room: ContextVar[Optional[Any]] = ContextVar("current_room", default=None)  # game.Room
+current_user: ContextVar[Optional[Any]] = ContextVar("current_user", default=None)  # game.User
+FIELDS = ("room_id", "day", "phase", "user")
+
+_listener: Optional[QueueListener] = None
+_enqueue: Optional[logging.Handler] = None
+
+
+class ContextFilter(logging.Filter):
+    """레코드에 지금 태스크의 방과 유저를 붙입니다. 큐에 넣기 전, 이벤트 루프에서 돕니다."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        user = current_user.get()
+        room = current_room.get() or (user.room if user else None)
+        record.user = user.username if user else None
+        if room is None:
+            record.room_id = record.day = record.phase = None
+        else:
+            record.room_id = room.id
+            record.day = getattr(room, "day", None) if room.in_game() else None
+            record.phase = room.phase().name
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """레코드 하나를 JSON 한 줄로 씁니다."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for field in FIELDS:
+            if (value := getattr(record, field, None)) is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _Enqueue(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 메시지를 여기서 완성해 두어야 다른 스레드에서 인자의 `__repr__()`을 부르지 않습니다.
+        # 예외는 포매터가 다른 스레드에서 문자열로 만듭니다.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def start(json_output: bool = False, path: Optional[str] = None):
+    """`logger`의 출력을 큐 뒤의 스레드로 옮깁니다. `path`가 있으면 그 파일에도 씁니다."""
+    global _listener, _enqueue
+    if _listener:
+        return
+    formatter = JsonFormatter() if json_output else DefaultFormatter("%(levelprefix)s %(message)s")
+    handlers: list[logging.Handler] = [logging.StreamHandler(sys.stdout)]
+    if path:
+        handlers.append(logging.FileHandler(path, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    _enqueue = _Enqueue(records)
+    _enqueue.addFilter(ContextFilter())
+    logger.addHandler(_enqueue)
+    logger.propagate = False
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+
+def stop():
+    """큐에 남은 레코드를 모두 쓰고 스레드를 멈춥니다. 이후의 레코드는 원래대로 uvicorn의 핸들러가 씁니다."""
+    global _listener, _enqueue
+    if _listener:
+        logger.removeHandler(_enqueue)
+        logger.propagate = True
+        _listener.stop()
+        _listener = _enqueue = None
@@ -0,0 +1,117 @@
+"""이벤트 루프가 막히는 것을 잡아내는 감시견.
+
+루프 안의 태스크가 `interval`초마다 깨어나며 늦게 깨어난 시간(루프 지연)을 잽니다.
+루프 밖의 스레드는 그 태스크가 `threshold`초 넘게 깨어나지 못하면 루프가 지금 막혀 있다고 보고,
+그 순간 루프 스레드의 스택과 돌고 있던 태스크 이름, 그 태스크가 맡은 방을 로그에 남깁니다.
+"""
+from __future__ import annotations
+import re
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from types import FrameType
+from collections import deque
+from typing import Optional
+import metrics
+import profiler
+from log import logger
+
+INTERVAL = 0.1  # 초
+THRESHOLD = 0.25  # 초
+WINDOW = 1024  # 백분위를 낼 때 쓰는 최근 측정값 수
+QUANTILES = (0.5, 0.9, 0.99)
+ROOM_ID = re.compile(r"game in (\d+)")
+STEP_CODE = profiler.RoomStep._step.__code__
+
+
+class LoopWatchdog:
+    """
+    Attributes:
+        `interval`: 루프 지연을 재는 간격(초).
+        `threshold`: 이보다 오래 막히면 스택을 남깁니다(초).
+        `lags`: 최근 루프 지연(초).
+        `stalls`: 스택을 남긴 횟수.
+    """
+
+    def __init__(self, interval: float = INTERVAL, threshold: float = THRESHOLD, window: int = WINDOW):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags: deque[float] = deque(maxlen=window)
+        self.stalls = 0
+        self._heartbeat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._probe: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        metrics.gauge("loop_lag_seconds", "Event loop scheduling delay over the recent window.", self.percentiles, "quantile")
+        metrics.gauge("loop_stalls", "Times the loop was blocked longer than the threshold.", lambda: self.stalls)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._probe = asyncio.create_task(self._measure(), name="watchdog probe")
+        self._thread = threading.Thread(target=self._watch, name="watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._probe:
+            self._probe.cancel()
+            await asyncio.gather(self._probe, return_exceptions=True)
+        if self._thread:
+            await asyncio.to_thread(self._thread.join)
+
+    def percentiles(self) -> dict[str, float]:
+        if not self.lags:
+            return {}
+        ordered = sorted(self.lags)
+        result = {str(q): ordered[min(len(ordered)-1, int(len(ordered)*q))] for q in QUANTILES}
+        result["1"] = ordered[-1]
+        return result
+
+    async def _measure(self):
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - before - self.interval)
+            self.lags.append(lag)
+            self._heartbeat = time.monotonic()
+
+    def _watch(self):
+        reported = False  # 한 번 막힌 동안에는 한 번만 남깁니다.
+        while not self._stop.wait(self.interval / 2):
+            blocked = time.monotonic() - self._heartbeat - self.interval
+            if blocked < self.threshold:
+                reported = False
+            elif not reported:
+                reported = True
+                self.stalls += 1
+                self._report(blocked)
+
+    def _report(self, blocked: float):
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = "".join(traceback.format_stack(frame)) if frame else "(no frame)"
+        task = asyncio.current_task(self._loop)
+        name = task.get_name() if task else None
+        room = serving(frame)
+        if room is None and name and (match := ROOM_ID.search(name)):
+            room = match.group(1)
+        logger.warning("Event loop blocked for %.0fms+ in task %r%s:\n%s",
+                       blocked*1000, name, f" (room #{room})" if room else "", stack)
+
+
+
+def serving(frame: Optional[FrameType]) -> Optional[int]:
+    """루프 스레드의 스택에서 가장 안쪽의 `profiler.RoomStep` 걸음이 맡은 방 ID를 반환합니다.
+    게임 태스크뿐 아니라 방 안의 유저가 보낸 메시지를 처리하는 접속 태스크도 방을 알 수 있습니다.
+    돌고 있는 코루틴은 `cr_await`가 비어 있으므로 태스크의 코루틴이 아니라 스택을 따라갑니다."""
+    while frame is not None:
+        if frame.f_code is STEP_CODE and (room := frame.f_locals.get("room")) is not None:
+            return room.id
+        frame = frame.f_back
+    return None
@@ -1,43 +1,132 @@
 import random
-import base64
 import logging
-import binascii
+import secrets
 from starlette.applications import Starlette
 from starlette.config import Config
+from starlette.datastructures import Secret
 from starlette.requests import Request
-from starlette.authentication import AuthenticationBackend, AuthenticationError, SimpleUser, UnauthenticatedUser, AuthCredentials
 from starlette.middleware import Middleware
 from starlette.middleware.authentication import AuthenticationMiddleware
-from starlette.routing import WebSocketRoute
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route, WebSocketRoute
+import db
 import game
+import auth
+import metrics
+import spectator
+import memory
+import admin
+import log
 from log import logger
 
-class BasicAuthBackend(AuthenticationBackend):
-    async def authenticate(self, request:Request):
-        if auth := request.headers.get("Authorization"):
-            try:
-                scheme, credentials = auth.split()
-                if scheme.lower() != "basic":
-                    return
-                decoded = base64.b64decode(credentials).decode("ascii")
-            except (ValueError, UnicodeDecodeError, binascii.Error) as e:
-                raise AuthenticationError("Invalid basic auth credentials")
-            username, _, password = decoded.partition(":")
-            return AuthCredentials(["Authenticated"]), SimpleUser(username)
+async def read_credentials(request: Request) -> tuple[str, str]:
+    try:
+        body = await request.json()
+        return body["username"], body["password"]
+    except (ValueError, KeyError, TypeError):
+        raise auth.AuthenticationRejected("username과 password가 필요합니다.")
+
+def rejected(e: auth.AuthenticationRejected):
+    status_code = 429 if isinstance(e, auth.TooManyAttempts) else 503 if isinstance(e, auth.Busy) else 400
+    return JSONResponse({"error": str(e)}, status_code=status_code)
+
+async def register(request: Request):
+    try:
+        username, password = await read_credentials(request)
+        id = await request.app.gameserver.authenticator.register(username, password, request.client.host)
+    except auth.AuthenticationRejected as e:
+        return rejected(e)
+    return JSONResponse({"id": id, "username": username}, status_code=201)
+
+async def login(request: Request):
+    try:
+        username, password = await read_credentials(request)
+        user = await request.app.gameserver.authenticator.login(username, password, request.client.host)
+    except auth.AuthenticationRejected as e:
+        return rejected(e)
+    if user is None:
+        return JSONResponse({"error": "사용자명이나 비밀번호가 틀립니다."}, status_code=401)
+    token, expires = request.app.gameserver.sessions.issue(user)
+    return JSONResponse({"id": user.id, "username": user.username, "token": token, "expires": expires})
+
+def unauthenticated():
+    return JSONResponse({"error": "로그인해야 합니다."}, status_code=401)
+
+async def history(request: Request):
+    if not request.user.is_authenticated:
+        return unauthenticated()
+    try:
+        before = int(request.query_params["before"]) if "before" in request.query_params else None
+        limit = int(request.query_params.get("limit", db.HISTORY_PAGE_SIZE))
+        if (before is not None and before <= 0) or limit <= 0:
+            raise ValueError
+    except ValueError:
+        return JSONResponse({"error": "before와 limit은 양의 정수여야 합니다."}, status_code=400)
+    return JSONResponse(await request.app.gameserver.history(
+        request.path_params["user_id"], before, limit, request.user.id))
+
+async def game_metadata(request: Request):
+    if not request.user.is_authenticated:
+        return unauthenticated()
+    if metadata := await request.app.gameserver.game_metadata(request.path_params["game_id"], request.user.id):
+        return JSONResponse(metadata)
+    return JSONResponse({"error": "그런 게임이 없습니다."}, status_code=404)
+
+async def profile(request: Request):
+    if not request.user.is_authenticated:
+        return unauthenticated()
+    return JSONResponse(await request.app.gameserver.profile(request.path_params["user_id"], request.user.id))
+
+async def export_trace(request: Request):
+    if not request.user.is_authenticated or not await request.app.gameserver.is_admin(request.user.id):
+        return JSONResponse({"error": "관리자만 볼 수 있습니다."}, status_code=403)
+    room_id = request.path_params["room_id"]
+    if (trace := request.app.gameserver.trace(room_id)) is None:
+        return JSONResponse({"error": "그런 방이 없습니다."}, status_code=404)
+    return JSONResponse(trace, headers={"Content-Disposition": f'attachment; filename="room-{room_id}-trace.json"'})
+
+async def export_metrics(request: Request):
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 conf = Config(".env")
 DEBUG = conf("DEBUG", cast=bool, default=False)
+SPECTATOR_DELAY = conf("SPECTATOR_DELAY", cast=float, default=spectator.DELAY)
+SESSION_SECRET = conf("SESSION_SECRET", cast=Secret, default=None)
+SESSION_TTL = conf("SESSION_TTL", cast=float, default=auth.SESSION_TTL)
+ADMIN_INTERVAL = conf("ADMIN_INTERVAL", cast=float, default=admin.INTERVAL)
+memory.LEAKS.grace = conf("LEAK_GRACE", cast=float, default=memory.LEAK_GRACE)
+LOG_JSON = conf("LOG_JSON", cast=bool, default=False)
+LOG_FILE = conf("LOG_FILE", default=None)
 logger.setLevel(logging.INFO)
-server = game.GameServer()
+log.start(json_output=LOG_JSON, path=LOG_FILE)
+if SESSION_SECRET is None:
+    logger.warning("SESSION_SECRET is not set. Session tokens will not survive a restart.")
+server = game.GameServer(
+    spectator_delay=SPECTATOR_DELAY,
+    admin_interval=ADMIN_INTERVAL,
+    debug=DEBUG,
+    sessions=auth.SessionTokens(
+        str(SESSION_SECRET).encode() if SESSION_SECRET else secrets.token_bytes(32),
+        SESSION_TTL
+    )
+)
 routes = [
     WebSocketRoute("/game", server.endpoint),
-    # WebSocketRoute("/admin", ws.admin_endpoint),
+    Route("/register", register, methods=["POST"]),
+    Route("/login", login, methods=["POST"]),
+    Route("/api/users/{user_id:int}/history", history),
+    Route("/api/users/{user_id:int}/profile", profile),
+    Route("/api/games/{game_id:int}", game_metadata),
+    Route("/metrics", export_metrics),
+    Route("/api/rooms/{room_id:int}/trace", export_trace),
+    WebSocketRoute("/admin", server.admin_endpoint),
 ]
 middleware = [
-    Middleware(AuthenticationMiddleware, backend=BasicAuthBackend())
+    Middleware(AuthenticationMiddleware, backend=auth.TokenAuthBackend(server.sessions))
 ]
 
-app = Starlette(debug=DEBUG, routes=routes, middleware=middleware)
+app = Starlette(debug=DEBUG, routes=routes, middleware=middleware,
+                on_startup=[server.startup], on_shutdown=[server.shutdown, log.stop])
 app.gameserver = server
 
 random.seed()
\ No newline at end of file
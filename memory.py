@@ -0,0 +1,195 @@
+"""메모리 사용량 어림과 누수 탐지.
+
+`room_footprint()`는 방 하나가 붙잡고 있는 기록, 플레이어, 관전자 대기열의 크기를 어림합니다.
+`sys.getsizeof()`로 컨테이너를 몇 단계만 따라가므로 정확하지 않지만, 방끼리 비교하기에는 충분합니다.
+
+`LeakDetector`는 다 쓴 `Room`, `Player`, `User`를 약한 참조로 지켜보다가 `grace`초가 지나도
+살아 있으면 누수로 보고 그 객체를 붙잡고 있는 것들의 종류를 로그에 남깁니다. 이 확인은 힙 전체를 돌므로
+이벤트 루프를 잠깐 멈춥니다. `gc.collect()`와 `gc.get_referrers()`는 GIL을 놓지 않아 스레드로 옮겨도 루프가 멈추는 것은
+같으므로, 확인 한 번에 힙을 한 번만 돌고 살펴보는 객체 수를 `REFERRERS_MAX`개로 제한합니다.
+찾은 결과는 보관해 두므로 관리자 채널의 `MEMORY`는 힙을 다시 돌지 않습니다.
+
+`MemorySnapshots`는 tracemalloc 스냅숏을 찍어 직전 스냅숏과 비교합니다. 켜 두는 동안에는 할당이 느려지므로
+관리자 채널에서 필요할 때만 켭니다.
+"""
+from __future__ import annotations
+import gc
+import sys
+import time
+import types
+import asyncio
+import weakref
+import tracemalloc
+from collections import deque
+from typing import TYPE_CHECKING, Any, NamedTuple, Optional
+import metrics
+from log import logger
+
+if TYPE_CHECKING:
+    from game import Room
+
+LEAK_GRACE = 600  # 초
+CHECK_INTERVAL = 60  # 초
+TRACEMALLOC_FRAMES = 10
+REFERRERS_MAX = 20  # 확인 한 번에 붙잡고 있는 것을 찾아보는 객체 수
+_CONTAINERS = (list, tuple, set, frozenset, dict, deque)
+
+
+def approx_size(obj: Any, depth: int = 2) -> int:
+    """`obj`와, `depth`단계 안에 있는 컨테이너와 그 원소의 크기(바이트)를 어림합니다.
+    컨테이너가 아닌 객체는 맨 위의 것만 속성을 따라가므로 다른 플레이어나 방을 두 번 세지 않습니다."""
+    size = sys.getsizeof(obj)
+    if depth <= 0:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(sys.getsizeof(k) + approx_size(v, depth-1) for k, v in obj.items())
+    if isinstance(obj, _CONTAINERS):
+        return size + sum(approx_size(v, depth-1) for v in obj)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if (attributes := getattr(obj, "__dict__", None)) is not None:
+        return size + approx_size(attributes, depth)
+    return size + sum(
+        approx_size(getattr(obj, name), depth-1)
+        for name in getattr(type(obj), "__slots__", ())
+        if hasattr(obj, name)
+    )
+
+
+def room_footprint(room: Room) -> dict[str, int]:
+    """`room`이 붙잡고 있는 메모리(바이트)를 부분별로 어림합니다."""
+    return {
+        "record": room.record.nbytes() if getattr(room, "record", None) else 0,
+        "lineup": sum(approx_size(player) for player in getattr(room, "lineup", {}).values()),
+        "spectator_queue": room.spectators.nbytes(),
+    }
+
+
+class Leak(NamedTuple):
+    kind: str
+    description: str
+    age: float  # 초. 다 쓴 뒤로 지난 시간
+    referrers: dict[str, int]  # 붙잡고 있는 객체의 타입별 개수
+
+
+class LeakDetector:
+    """다 쓴 객체가 `grace`초 안에 사라지는지 지켜봅니다.
+
+    Attributes:
+        `grace`: 다 쓴 뒤 이 시간(초)이 지나도 살아 있으면 누수로 봅니다.
+        `interval`: 확인하는 간격(초).
+    """
+
+    def __init__(self, grace: float = LEAK_GRACE, interval: float = CHECK_INTERVAL):
+        self.grace = grace
+        self.interval = interval
+        self._watching: deque[tuple[float, str, str, weakref.ref]] = deque()
+        self._reported: list[tuple[float, str, str, weakref.ref, dict[str, int]]] = []
+        self._task: Optional[asyncio.Task] = None
+        metrics.gauge("leaked_objects", "Objects still alive long after their game or connection ended.", self.counts, "kind")
+
+    def watch(self, obj: Any, kind: str):
+        """`obj`를 다 썼다고 알립니다. `repr()`은 지금 찍어 둡니다."""
+        self._watching.append((time.monotonic(), kind, repr(obj), weakref.ref(obj)))
+
+    def counts(self) -> dict[str, int]:
+        counts: dict[str, int] = dict()
+        for _, kind, _, ref, _ in self._reported:
+            if ref() is not None:
+                counts[kind] = counts.get(kind, 0) + 1
+        return counts
+
+    def leaks(self) -> list[Leak]:
+        """누수로 본 객체들. 붙잡고 있는 것은 누수로 볼 때 찾아 둔 것이므로 힙을 다시 돌지 않습니다."""
+        now = time.monotonic()
+        return [
+            Leak(kind, description, now - since, referrers)
+            for since, kind, description, ref, referrers in self._reported
+            if ref() is not None
+        ]
+
+    @staticmethod
+    def _referrers(objs: list) -> list[dict[str, int]]:
+        """`objs` 각각을 붙잡고 있는 객체의 타입별 개수. 힙 전체를 도는 `gc.get_referrers()`는 한 번만 부릅니다."""
+        counts: list[dict[str, int]] = [dict() for _ in objs]
+        index = {id(obj): i for i, obj in enumerate(objs)}
+        for referrer in gc.get_referrers(*objs):
+            if isinstance(referrer, types.FrameType) or referrer is objs:
+                continue
+            name = type(referrer).__name__
+            for referent in gc.get_referents(referrer):
+                if (i := index.get(id(referent))) is not None:
+                    counts[i][name] = counts[i].get(name, 0) + 1
+        return counts
+
+    def check(self):
+        """`grace`초가 지난 것들을 확인하고 아직 살아 있는 것을 누수로 남깁니다."""
+        self._reported = [entry for entry in self._reported if entry[3]() is not None]
+        deadline = time.monotonic() - self.grace
+        overdue = []
+        while self._watching and self._watching[0][0] <= deadline:
+            if (entry := self._watching.popleft())[3]() is not None:
+                overdue.append(entry)
+        if not overdue:
+            return
+        gc.collect()  # 순환 참조로만 남은 것은 누수가 아닙니다.
+        leaked = [entry for entry in overdue if entry[3]() is not None]
+        inspected = self._referrers([entry[3]() for entry in leaked[:REFERRERS_MAX]])
+        for i, (since, kind, description, ref) in enumerate(leaked):
+            referrers = inspected[i] if i < len(inspected) else dict()
+            self._reported.append((since, kind, description, ref, referrers))
+            logger.warning("%s %s is still alive %.0fs after it was released; referrers: %s",
+                           kind, description, time.monotonic() - since, referrers)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="leak detector")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.check()
+
+
+class MemorySnapshots:
+    """tracemalloc 스냅숏을 찍어 직전 것과 비교합니다."""
+
+    def __init__(self, frames: int = TRACEMALLOC_FRAMES):
+        self.frames = frames
+        self._last: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._last = None
+
+    def stop(self):
+        tracemalloc.stop()
+        self._last = None
+
+    async def diff(self, top: int = 20) -> list[str]:
+        """스냅숏을 찍어 직전 스냅숏보다 많이 늘어난 곳 `top`개를 반환합니다.
+        처음 찍었을 때는 가장 많이 할당한 곳을 반환합니다."""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not tracing")
+        snapshot = await asyncio.to_thread(
+            lambda: tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        )
+        last, self._last = self._last, snapshot
+        if last is None:
+            stats = await asyncio.to_thread(snapshot.statistics, "lineno")
+        else:
+            stats = await asyncio.to_thread(snapshot.compare_to, last, "lineno")
+        return [str(stat) for stat in stats[:top]]
+
+
+LEAKS = LeakDetector()
@@ -0,0 +1,130 @@
+"""Prometheus 텍스트 형식으로 내보내는 지표.
+
+지표를 모으는 쪽(hot path)은 `dict`의 값 하나를 더하거나 `bisect` 한 번으로 끝납니다.
+문자열로 바꾸는 일은 `/metrics`를 읽을 때(`render()`)만 합니다.
+게이지는 값을 따로 갱신하지 않고 `render()`할 때 등록된 함수를 불러 읽습니다.
+"""
+from __future__ import annotations
+import time
+import inspect
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterator, Union
+
+PREFIX = "mafia_"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+GaugeValue = Union[float, dict[str, float]]
+
+_counters: dict[str, Counter] = dict()
+_histograms: dict[str, Histogram] = dict()
+_gauges: dict[str, tuple[str, str, Callable[[], GaugeValue]]] = dict()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labelled(name: str, label: str, value: str) -> str:
+    return f'{name}{{{label}="{_escape(value)}"}}' if label else name
+
+
+class Counter:
+    """늘어나기만 하는 값. `label`을 주면 라벨 값마다 따로 셉니다."""
+
+    def __init__(self, name: str, help: str, label: str = ""):
+        self.name = PREFIX + name
+        self.help = help
+        self.label = label
+        self.values: dict[str, float] = dict()
+        _counters[self.name] = self
+
+    def inc(self, amount: float = 1, label: str = ""):
+        self.values[label] = self.values.get(label, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label, value in self.values.items():
+            yield f"{_labelled(self.name, self.label, label)} {value}"
+
+
+class Histogram:
+    """값의 분포. `buckets`는 각 칸의 상한(초)입니다."""
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = DURATION_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets)+1)  # 마지막 칸은 +Inf
+        self.sum = 0.0
+        self.count = 0
+        _histograms[self.name] = self
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def timed(self, function: Callable):
+        """`function`이 걸린 시간을 잽니다. 코루틴 함수면 `await`가 끝날 때까지 잽니다."""
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def _timed(*args, **kwargs):
+                with self.time():
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def _timed(*args, **kwargs):
+                with self.time():
+                    return function(*args, **kwargs)
+        return _timed
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{bound}"}} {cumulative}'
+        yield f'{self.name}_bucket{{le="+Inf"}} {self.count}'
+        yield f"{self.name}_sum {self.sum}"
+        yield f"{self.name}_count {self.count}"
+
+
+def gauge(name: str, help: str, read: Callable[[], GaugeValue], label: str = ""):
+    """`render()`할 때 `read()`로 읽는 게이지를 등록합니다. 같은 이름으로 다시 등록하면 바뀝니다.
+    `read()`가 `dict`를 반환하면 키를 `label`의 값으로 씁니다."""
+    _gauges[PREFIX + name] = (help, label, read)
+
+def render() -> str:
+    lines: list[str] = []
+    for name, (help, label, read) in _gauges.items():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        value = read()
+        if isinstance(value, dict):
+            lines.extend(f"{_labelled(name, label, key)} {v}" for key, v in value.items())
+        else:
+            lines.append(f"{name} {value}")
+    for counter in _counters.values():
+        lines.extend(counter.render())
+    for histogram in _histograms.values():
+        lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
+
+
+EVENTS_EMITTED = Counter("events_emitted_total", "Events emitted by rooms.", "type")
+BYTES_SENT = Counter("bytes_sent_total", "Bytes of JSON text sent to clients.")
+LISTEN_SECONDS = Histogram("listen_seconds", "Time to send one message to a client.", LATENCY_BUCKETS)
+NIGHT_EVENTS_SECONDS = Histogram("night_events_seconds", "Time to resolve one night (trigger_night_events).")
+SETUP_VALIDATION_SECONDS = Histogram("setup_validation_seconds", "Time to validate one Setup.", LATENCY_BUCKETS)
@@ -0,0 +1,170 @@
+"""유저별·게임별로 테이블을 하나씩 만들던 예전 DB를 고정된 테이블로 옮기는 오프라인 도구.
+
+    records.db의 "(게임의 ID)" 테이블들과 GameEvents -> GameRecordChunks (`record.py`의 압축 형식)
+    each-game-metadata.db의 EachGameMetadata.Player1~Player15 -> GameParticipants
+
+서버를 끈 상태에서 실행해야 합니다. 테이블 하나를 트랜잭션 하나로 옮기고,
+옮긴 뒤에는 예전 테이블을 지웁니다(`--keep`을 주면 남겨 둡니다).
+중간에 멈춰도 다시 실행하면 남은 테이블부터 이어서 옮깁니다.
+
+예전 참가자 열에는 직업과 승패가 없으므로 GameParticipants의 해당 열은 NULL로 남습니다.
+유저별 게임 목록도 참가자 열에서 나오므로 games-per-user.db는 옮기지 않습니다. 옮긴 뒤에는 지워도 됩니다.
+
+    python migrate.py [--records sql/records.db] [--metadata sql/each-game-metadata.db] [--batch 1000] [--keep]
+"""
+import ast
+import json
+import sqlite3
+import argparse
+from typing import Iterable, Iterator
+import db
+import record
+
+def legacy_tables(conn: sqlite3.Connection) -> list[str]:
+    """이름이 숫자뿐인, 예전 방식의 테이블 이름들."""
+    return [
+        name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        if name.isdigit()
+    ]
+
+def stream(conn: sqlite3.Connection, table: str, batch: int) -> Iterator[tuple]:
+    """`table`의 행을 `batch`개씩만 메모리에 올리며 차례로 내놓습니다."""
+    cursor = conn.execute(f'SELECT * FROM "{table}"')
+    while rows := cursor.fetchmany(batch):
+        yield from rows
+
+def parse_line(line: str) -> dict:
+    """예전 기록 한 줄. JSON이거나, 더 예전 형식인 `str(dict)`입니다."""
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        entry = ast.literal_eval(line)
+    if isinstance(entry["time"], float):
+        entry["time"] = round(entry["time"]*1000)
+    entry.setdefault("flags", 0)
+    return entry
+
+def encode_lines(lines: Iterable[str]) -> Iterator[record.SealedChunk]:
+    """예전 기록 줄들을 덩어리로 묶습니다. 닫힌 덩어리만 메모리에 남지 않도록 바로 내놓습니다."""
+    game_record = record.GameRecord()
+    day = 1
+    for line in lines:
+        entry = parse_line(line)
+        if entry["type"] == "PHASE":
+            phase = entry["content"].get("PHASE")
+            if phase == "MORNING":
+                day += 1
+            game_record.mark_phase(day, phase)
+        game_record.append(entry)
+        yield from game_record.drain()
+    game_record.seal()
+    yield from game_record.drain()
+
+def insert_chunks(conn: sqlite3.Connection, game_id: int, chunks: Iterable[record.SealedChunk]):
+    conn.executemany(f"""
+        INSERT OR REPLACE INTO {db.GAME_RECORD_CHUNKS_TABLE_NAME} (GameID, Seq, Day, Phase, Events, Data)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, ((game_id, seq, *chunk) for seq, chunk in enumerate(chunks)))
+
+def migrate_records(path: str, batch: int, keep: bool) -> int:
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {db.GAME_RECORD_CHUNKS_TABLE_NAME} (
+            GameID INTEGER NOT NULL,
+            Seq INTEGER NOT NULL,
+            Day INTEGER NOT NULL,
+            Phase text NOT NULL,
+            Events INTEGER NOT NULL,
+            Data BLOB NOT NULL,
+            PRIMARY KEY (GameID, Seq)
+        )
+    """)
+    tables = legacy_tables(conn)
+    for number, table in enumerate(tables, 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 예전 테이블은 (순번, 내용) 꼴이므로 마지막 열을 내용으로 봅니다.
+            insert_chunks(conn, int(table), encode_lines(row[-1] for row in stream(conn, table, batch)))
+            if not keep:
+                conn.execute(f'DROP TABLE "{table}"')
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        print(f"records: {number}/{len(tables)} (game {table})")
+    has_game_events = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (db.GAME_EVENTS_TABLE_NAME,)).fetchone()
+    games = [game_id for game_id, in conn.execute(f"SELECT DISTINCT GameID FROM {db.GAME_EVENTS_TABLE_NAME}")] if has_game_events else []
+    for number, game_id in enumerate(games, 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute(f"SELECT Data FROM {db.GAME_EVENTS_TABLE_NAME} WHERE GameID=? ORDER BY Seq", (game_id,))
+            def _lines():
+                while rows := cursor.fetchmany(batch):
+                    yield from (data for data, in rows)
+            insert_chunks(conn, game_id, encode_lines(_lines()))
+            if not keep:
+                conn.execute(f"DELETE FROM {db.GAME_EVENTS_TABLE_NAME} WHERE GameID=?", (game_id,))
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        print(f"{db.GAME_EVENTS_TABLE_NAME}: {number}/{len(games)} (game {game_id})")
+    if has_game_events and not keep:
+        conn.execute(f"DROP TABLE {db.GAME_EVENTS_TABLE_NAME}")
+    conn.close()
+    return len(tables) + len(games)
+
+def migrate_participants(path: str, batch: int) -> int:
+    conn = sqlite3.connect(path, isolation_level=None)
+    columns = {name for _, name, *_ in conn.execute(f"PRAGMA table_info({db.EACH_GAME_METADATA_TABLE_NAME})")}
+    player_columns = [f"Player{i}" for i in range(1, 16) if f"Player{i}" in columns]
+    if not player_columns:
+        conn.close()
+        return 0
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {db.GAME_PARTICIPANTS_TABLE_NAME} (
+            GameID INTEGER NOT NULL,
+            UserID INTEGER,
+            Seat INTEGER NOT NULL,
+            InitialRole text,
+            FinalRole text,
+            Won bool,
+            DeathCause text,
+            PRIMARY KEY (GameID, Seat)
+        ) WITHOUT ROWID
+    """)
+    before = conn.total_changes
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.execute(f"SELECT ID, Total, {', '.join(player_columns)} FROM {db.EACH_GAME_METADATA_TABLE_NAME}")
+        def _participants():
+            while rows := cursor.fetchmany(batch):
+                for game_id, total, *players in rows:
+                    for seat, user_id in enumerate(players[:total], 1):
+                        yield game_id, user_id, seat
+        conn.executemany(f"""
+            INSERT OR IGNORE INTO {db.GAME_PARTICIPANTS_TABLE_NAME} (GameID, UserID, Seat)
+            VALUES (?, ?, ?)
+        """, _participants())
+        migrated = conn.total_changes - before
+    except:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {db.GAME_PARTICIPANTS_TABLE_NAME}ByUser ON {db.GAME_PARTICIPANTS_TABLE_NAME} (UserID, GameID)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {db.GAME_PARTICIPANTS_TABLE_NAME}ByRole ON {db.GAME_PARTICIPANTS_TABLE_NAME} (InitialRole, Won)")
+    conn.close()
+    print(f"participants: {migrated} rows")
+    return migrated
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="예전 방식의 테이블을 GameRecordChunks, GameParticipants로 옮깁니다.")
+    parser.add_argument("--records", default=db.INGAME_RECORDS_DB_PATH)
+    parser.add_argument("--metadata", default=db.EACH_GAME_METADATA_DB_PATH)
+    parser.add_argument("--batch", type=int, default=1000, help="한 번에 메모리에 올리는 행 수")
+    parser.add_argument("--keep", action="store_true", help="옮긴 뒤에도 예전 테이블을 지우지 않음")
+    args = parser.parse_args()
+    games = migrate_records(args.records, args.batch, args.keep)
+    participants = migrate_participants(args.metadata, args.batch)
+    print(f"migrated {games} game records and {participants} participants")
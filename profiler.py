@@ -0,0 +1,143 @@
+"""방마다 쓴 CPU 시간을 세고, 방 하나의 게임만 골라 cProfile로 프로파일링하는 기능.
+
+게임 태스크와, 게임 태스크가 만든 태스크(`asyncio.gather()`로 보내는 `emit()` 등)는 모두 `RoomStep`으로 감싸집니다.
+`RoomStep`은 코루틴이 한 걸음(`send()`/`throw()`) 나아갈 때마다 그 걸음에 쓴 스레드 CPU 시간을
+`Room.cpu_ns`에 더하고, 그 방을 프로파일링하고 있으면 그동안만 프로파일러를 켭니다.
+따라서 다른 방이나 서버 전체를 재지 않고, 이 방을 위해 쓴 시간만 잽니다.
+`GameServer.process_message()`도 메시지를 보낸 유저와 그 유저가 있는 방 앞으로 같은 방식으로 잽니다.
+
+태스크가 어느 방의 것인지는 `log.current_room`으로 압니다. `create_room_task()`로 만든 태스크와,
+그 태스크 안에서 만든 태스크는 contextvars를 물려받으므로 `install()`한 태스크 팩토리가 알아서 감쌉니다.
+"""
+from __future__ import annotations
+import os
+import time
+import asyncio
+import cProfile
+import collections.abc
+from typing import TYPE_CHECKING, Coroutine, Optional
+from log import logger, current_room, current_user
+
+if TYPE_CHECKING:
+    from game import Room, User
+
+PROFILE_DIR = "profiles"
+
+
+class RoomStep(collections.abc.Coroutine):
+    """`room`(과 `user`)을 위해 도는 코루틴. 걸음마다 CPU 시간을 더하고, `room.profile`이 있으면 켭니다.
+    `room`이 `None`이면 방 밖(로비)에서 도는 것이므로 `user`에게만 더합니다."""
+    __slots__ = ("_coro", "room", "user")
+
+    def __init__(self, coro: Coroutine, room: Optional[Room], user: Optional[User] = None):
+        self._coro = coro
+        self.room = room
+        self.user = user
+
+    def _step(self, step, *args):
+        room = self.room
+        active = room.profile.enable() if room is not None and room.profile else None
+        started = time.thread_time_ns()
+        try:
+            return step(*args)
+        finally:
+            elapsed = time.thread_time_ns() - started
+            if active:
+                active.disable()
+            if room is not None:
+                room.cpu_ns += elapsed
+            if self.user is not None:
+                self.user.cpu_ns += elapsed
+
+    def send(self, value):
+        return self._step(self._coro.send, value)
+
+    def throw(self, *args):
+        return self._step(self._coro.throw, *args)
+
+    def close(self):
+        self._coro.close()
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def __repr__(self):
+        return f"<RoomStep {self._coro!r} of {self.room!r}>"
+
+
+def _task_factory(loop: asyncio.AbstractEventLoop, coro: Coroutine, context=None):
+    if (room := current_room.get()) is not None and not isinstance(coro, RoomStep):
+        coro = RoomStep(coro, room)
+    if context is None:
+        return asyncio.Task(coro, loop=loop)
+    return asyncio.Task(coro, loop=loop, context=context)
+
+def install(loop: Optional[asyncio.AbstractEventLoop] = None):
+    """방의 태스크를 `RoomStep`으로 감싸는 태스크 팩토리를 설치합니다."""
+    (loop or asyncio.get_running_loop()).set_task_factory(_task_factory)
+
+def create_room_task(room: Room, coro: Coroutine, name: str) -> asyncio.Task:
+    """`room`을 위해 도는 태스크를 만듭니다. 이 태스크가 만드는 태스크도 `room`의 것이 됩니다."""
+    room_token = current_room.set(room)
+    user_token = current_user.set(None)  # 게임 태스크는 시작을 요청한 유저의 것이 아닙니다.
+    try:
+        return asyncio.create_task(coro, name=name)
+    finally:
+        current_user.reset(user_token)
+        current_room.reset(room_token)
+
+
+class RoomProfile:
+    """방 하나를 `days`일 동안 프로파일링합니다. 하루가 끝날 때마다
+    `directory`/room-(방 ID)-day-(날짜).pstats 파일에 씁니다.
+
+    Attributes:
+        `room_id`: 방 ID.
+        `days`: 남은 날 수.
+        `day`: 지금 재고 있는 날.
+    """
+
+    def __init__(self, room_id: int, days: int, day: int, directory: str = PROFILE_DIR):
+        self.room_id = room_id
+        self.days = days
+        self.day = day
+        self.directory = directory
+        self._profile = cProfile.Profile()
+
+    def enable(self) -> cProfile.Profile:
+        """지금 날의 프로파일러를 켜고 반환합니다. 끌 때는 반환된 것을 꺼야 합니다."""
+        self._profile.enable()
+        return self._profile
+
+    async def _dump(self, profile: cProfile.Profile, day: int) -> str:
+        path = os.path.join(self.directory, f"room-{self.room_id}-day-{day}.pstats")
+        def _write():
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(path)
+        await asyncio.to_thread(_write)
+        logger.info("Profile of room #%s written: %s", self.room_id, path)
+        return path
+
+    async def next_day(self, day: int) -> bool:
+        """지난 날의 결과를 쓰고 `day`일을 재기 시작합니다. 정한 날 수를 다 쟀으면 `False`."""
+        finished, finished_day = self._profile, self.day
+        self._profile = cProfile.Profile()
+        self.day = day
+        self.days -= 1
+        # 지금 걸음을 끝내 지난 날의 프로파일러가 꺼진 뒤에 씁니다.
+        await asyncio.sleep(0)
+        await self._dump(finished, finished_day)
+        return self.days > 0
+
+    async def finish(self) -> str:
+        """지금 날까지의 결과를 쓰고 끝냅니다."""
+        finished = self._profile
+        self._profile = cProfile.Profile()
+        await asyncio.sleep(0)
+        return await self._dump(finished, self.day)
@@ -0,0 +1,351 @@
+"""인게임 기록의 압축 형식.
+
+기록은 덩어리(chunk) 단위로 나뉘고, 덩어리 하나는 따로 풀 수 있습니다.
+덩어리는 단계가 바뀔 때마다, 또는 이벤트가 `CHUNK_EVENTS`개 쌓이면 닫힙니다.
+
+덩어리 하나의 구조 (zlib으로 압축하기 전):
+    MAGIC (2바이트)
+    머리 길이 (u32) | 머리 (JSON)
+        users: 유저 이름 표. 보낸 사람과 받는 사람은 이 표의 번호로 적습니다.
+        roles: 직업 이름 표. 내용 중 `ROLE_FIELDS` 키에 든 직업 이름은 {ROLE_TAG: 번호}로 적습니다.
+        events: 이벤트 종류 표.
+        groups: 받는 사람 묶음 표. 각 묶음은 users 번호의 list입니다.
+        day, phase: 덩어리가 시작될 때의 날짜와 단계.
+        t0: 덩어리가 시작될 때의 시각(ms).
+    이벤트마다:
+        EVENT_HEADER (종류 번호, 플래그, 보낸 사람 번호(없으면 -1), 받는 사람 묶음 번호, 직전 이벤트와의 시각 차(ms), 내용 길이)
+        내용 (JSON)
+
+기록 한 줄(entry)은 다음 꼴의 `dict`입니다. 푼 결과는 넣은 것과 같습니다.
+    {"type": str, "content": ..., "from": 유저 이름 | None, "to": [유저 이름, ...], "time": int (ms), "flags": int}
+flags의 비트는 `PUBLIC` 등입니다.
+내용은 전송될 때와 같이 JSON으로 바뀌므로 `dict`의 정수 키는 문자열이 됩니다.
+
+게임 중에 닫힌 덩어리는 방마다 하나씩 있는 저널 파일(`Journal`)에 덧붙여 쓰입니다.
+저널 파일의 각 프레임은 FRAME_HEADER (날짜, 이벤트 수, 단계 길이, 덩어리 길이) | 단계 | 덩어리 입니다.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import zlib
+import asyncio
+import struct
+import inspect
+from contextlib import suppress
+from typing import Any, Iterator, NamedTuple, Optional
+
+MAGIC = b"R1"
+CHUNK_EVENTS = 256
+ROLE_TAG = "\x00"
+LENGTH = struct.Struct("<I")
+EVENT_HEADER = struct.Struct("<BBhHiI")
+FRAME_HEADER = struct.Struct("<IIHI")
+JOURNAL_DIR = "journal"
+PUBLIC = 1  # 플래그: 방 전체에게 보낸 이벤트
+ROLE_FIELDS = frozenset({"ROLE", "role", "framed_role", "formation"})  # 직업·칸 이름이 들어가는 내용 키. 채팅 등 다른 문자열은 그대로 둡니다.
+
+_role_names: Optional[frozenset[str]] = None
+
+def role_names() -> frozenset[str]:
+    """내용 속에서 번호로 바꿀 직업·칸 이름들."""
+    global _role_names
+    if _role_names is None:
+        import roles
+        _role_names = frozenset(
+            name for name, class_ in inspect.getmembers(roles, inspect.isclass)
+            if issubclass(class_, (roles.Role, roles.Slot))
+        )
+    return _role_names
+
+def journals(directory: str = JOURNAL_DIR) -> list[str]:
+    """남아 있는 저널 파일들. 보관하거나 dead letter 파일로 옮긴 저널은 지워지므로, 남은 것은 서버가 게임 도중 죽은 게임입니다.
+    서버가 시작할 때 `archiver.Archiver.recover()`가 dead letter 파일로 옮깁니다."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".journal"))
+
+def now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+class SealedChunk(NamedTuple):
+    """닫힌 덩어리. `data`는 zlib으로 압축된 `bytes`입니다."""
+    day: int
+    phase: str
+    events: int
+    data: bytes
+
+
+class ChunkWriter:
+    """덩어리 하나를 만듭니다."""
+
+    def __init__(self, day: int, phase: str, t0: int):
+        self.day = day
+        self.phase = phase
+        self.t0 = t0
+        self._last = t0
+        self._users: dict[Any, int] = dict()
+        self._roles: dict[str, int] = dict()
+        self._events: dict[str, int] = dict()
+        self._groups: dict[tuple[int, ...], int] = dict()
+        self._body: list[bytes] = []
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def nbytes(self) -> int:
+        return sum(len(line) for line in self._body)
+
+    @staticmethod
+    def _intern(table: dict, key) -> int:
+        if (index := table.get(key)) is None:
+            index = table[key] = len(table)
+        return index
+
+    def _intern_roles(self, obj, role_field: bool = False):
+        if isinstance(obj, str):
+            return {ROLE_TAG: self._intern(self._roles, obj)} if role_field and obj in role_names() else obj
+        if isinstance(obj, dict):
+            return {key: self._intern_roles(value, key in ROLE_FIELDS) for key, value in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [self._intern_roles(item, role_field) for item in obj]
+        return obj
+
+    def add(self, entry: dict):
+        group = tuple(self._intern(self._users, user) for user in entry["to"])
+        content = json.dumps(self._intern_roles(entry["content"]), ensure_ascii=False, separators=(",", ":")).encode()
+        self._body.append(EVENT_HEADER.pack(
+            self._intern(self._events, entry["type"]),
+            entry.get("flags", 0),
+            -1 if entry["from"] is None else self._intern(self._users, entry["from"]),
+            self._intern(self._groups, group),
+            entry["time"] - self._last,
+            len(content)
+        ))
+        self._body.append(content)
+        self._count += 1
+        self._last = entry["time"]
+
+    def seal(self, level: int = 6) -> SealedChunk:
+        header = json.dumps({
+            "users": list(self._users),
+            "roles": list(self._roles),
+            "events": list(self._events),
+            "groups": [list(group) for group in self._groups],
+            "day": self.day,
+            "phase": self.phase,
+            "t0": self.t0,
+        }, ensure_ascii=False, separators=(",", ":")).encode()
+        raw = b"".join([MAGIC, LENGTH.pack(len(header)), header, *self._body])
+        return SealedChunk(self.day, self.phase, self._count, zlib.compress(raw, level))
+
+
+def _restore_roles(obj, roles: list[str]):
+    if isinstance(obj, dict):
+        if len(obj) == 1 and ROLE_TAG in obj:
+            return roles[obj[ROLE_TAG]]
+        return {key: _restore_roles(value, roles) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_restore_roles(item, roles) for item in obj]
+    return obj
+
+def decode_chunk(data: bytes) -> tuple[dict, Iterator[dict]]:
+    """덩어리 하나를 풉니다. 머리와, 기록 한 줄씩을 내놓는 iterator를 반환합니다.
+
+    Raises:
+        `ValueError`: 이 형식의 덩어리가 아닌 경우.
+    """
+    raw = zlib.decompress(data)
+    if raw[:len(MAGIC)] != MAGIC:
+        raise ValueError("기록 덩어리가 아닙니다.")
+    offset = len(MAGIC)
+    header_length, = LENGTH.unpack_from(raw, offset)
+    offset += LENGTH.size
+    header = json.loads(raw[offset:offset+header_length])
+    offset += header_length
+    def _entries():
+        nonlocal offset
+        users, events, groups, roles = header["users"], header["events"], header["groups"], header["roles"]
+        at = header["t0"]
+        while offset < len(raw):
+            event, flags, from_, group, delta, length = EVENT_HEADER.unpack_from(raw, offset)
+            offset += EVENT_HEADER.size
+            content = json.loads(raw[offset:offset+length])
+            offset += length
+            at += delta
+            yield {
+                "type": events[event],
+                "content": _restore_roles(content, roles),
+                "from": None if from_ < 0 else users[from_],
+                "to": [users[u] for u in groups[group]],
+                "time": at,
+                "flags": flags,
+            }
+    return header, _entries()
+
+
+class Journal:
+    """닫힌 덩어리를 덧붙여 쓰는 방별 저널 파일.
+    덩어리는 `add()`로 모아 두었다가 `flush()`에서 한꺼번에 쓰고 `fsync()`합니다.
+    파일 입출력은 모두 이벤트 루프 밖의 스레드에서 합니다.
+
+    Attributes:
+        `path`: 저널 파일 경로.
+        `fsync_interval`: `flush(force=False)`가 실제로 쓰는 최소 간격(초).
+    """
+
+    def __init__(self, path: str, fsync_interval: float = 1):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self._pending: list[bytes] = []
+        self._file = None
+        self._last_flush = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def for_room(cls, room_id: int, directory: str = JOURNAL_DIR):
+        return cls(os.path.join(directory, f"{room_id}-{now_ms()}.journal"))
+
+    def nbytes(self) -> int:
+        """아직 파일에 쓰지 않은 바이트 수."""
+        return sum(len(frame) for frame in self._pending)
+
+    def add(self, chunk: SealedChunk):
+        phase = chunk.phase.encode()
+        self._pending.append(FRAME_HEADER.pack(chunk.day, chunk.events, len(phase), len(chunk.data)) + phase + chunk.data)
+
+    def _write(self, frames: list[bytes]):
+        if self._file is None:
+            if directory := os.path.dirname(self.path):
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "ab")
+        self._file.write(b"".join(frames))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    async def flush(self, force: bool = False):
+        """모아 둔 덩어리를 씁니다. `force`가 아니면 `fsync_interval`마다 한 번만 씁니다."""
+        if not self._pending or not force and time.monotonic() - self._last_flush < self.fsync_interval:
+            return
+        async with self._lock:
+            frames, self._pending = self._pending, []
+            if frames:
+                await asyncio.to_thread(self._write, frames)
+            self._last_flush = time.monotonic()
+
+    async def close(self):
+        await self.flush(force=True)
+        async with self._lock:
+            if self._file is not None:
+                await asyncio.to_thread(self._file.close)
+                self._file = None
+
+    def chunks(self) -> Iterator[SealedChunk]:
+        """파일에 쓰인 덩어리를 차례로 읽습니다. 한 번에 덩어리 하나만 메모리에 올립니다.
+        파일을 직접 읽으므로 이벤트 루프 밖에서 호출해야 합니다."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            while header := f.read(FRAME_HEADER.size):
+                if len(header) < FRAME_HEADER.size:
+                    break  # 쓰다 만 프레임
+                day, events, phase_length, data_length = FRAME_HEADER.unpack(header)
+                phase = f.read(phase_length).decode()
+                data = f.read(data_length)
+                if len(data) < data_length:
+                    break
+                yield SealedChunk(day, phase, events, data)
+
+    async def remove(self):
+        await self.close()
+        with suppress(FileNotFoundError):
+            await asyncio.to_thread(os.remove, self.path)
+
+
+class GameRecord:
+    """게임 기록. `Room.record`로 쓰입니다.
+    아직 닫히지 않은 덩어리만 풀린 채로 메모리에 둡니다.
+    `journal`이 있으면 닫힌 덩어리는 저널 파일로 보내고, 없으면 압축된 채로 메모리에 둡니다.
+
+    Attributes:
+        `chunk_events`: 덩어리 하나에 넣는 최대 이벤트 수.
+        `journal`: 닫힌 덩어리를 쓰는 `Journal`.
+    """
+
+    def __init__(self, day: int = 1, phase: str = "", chunk_events: int = CHUNK_EVENTS, journal: Optional[Journal] = None):
+        self.chunk_events = chunk_events
+        self.day = day
+        self.phase = phase
+        self.journal = journal
+        self._sealed: list[SealedChunk] = []
+        self._open: Optional[ChunkWriter] = None
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def nbytes(self) -> int:
+        """메모리에 있는 기록의 바이트 수. 풀린 덩어리는 직렬화된 크기로 셉니다."""
+        return (
+            sum(len(chunk.data) for chunk in self._sealed)
+            + (self._open.nbytes() if self._open else 0)
+            + (self.journal.nbytes() if self.journal else 0)
+        )
+
+    def append(self, entry: dict):
+        if self._open is None:
+            self._open = ChunkWriter(self.day, self.phase, entry["time"])
+        self._open.add(entry)
+        self._length += 1
+        if len(self._open) >= self.chunk_events:
+            self.seal()
+
+    def mark_phase(self, day: int, phase: str):
+        """단계가 바뀌었음을 알립니다. 지금 덩어리를 닫으므로 새 덩어리는 이 단계에서 시작합니다."""
+        self.seal()
+        self.day = day
+        self.phase = phase
+
+    def seal(self):
+        if self._open is not None and len(self._open):
+            chunk = self._open.seal()
+            if self.journal:
+                self.journal.add(chunk)
+            else:
+                self._sealed.append(chunk)
+        self._open = None
+
+    async def flush(self):
+        """저널에 모인 덩어리를 때가 되었으면 씁니다."""
+        if self.journal:
+            await self.journal.flush()
+
+    async def close(self):
+        """지금 덩어리까지 닫고 저널을 모두 씁니다. 이후로는 기록을 덧붙이지 않습니다."""
+        self.seal()
+        if self.journal:
+            await self.journal.close()
+
+    async def discard(self):
+        """보관이 끝난 기록의 저널 파일을 지웁니다."""
+        if self.journal:
+            await self.journal.remove()
+
+    def drain(self) -> list[SealedChunk]:
+        """지금까지 메모리에 닫혀 있는 덩어리를 꺼냅니다. 꺼낸 덩어리는 이 기록에서 빠집니다."""
+        drained, self._sealed = self._sealed, []
+        return drained
+
+    def chunks(self) -> Iterator[SealedChunk]:
+        """모든 덩어리를 차례로 내놓습니다. 저널이 있으면 파일에서 읽으므로,
+        `close()` 뒤에 이벤트 루프 밖에서 호출해야 합니다."""
+        self.seal()
+        if self.journal:
+            yield from self.journal.chunks()
+        yield from self._sealed
+
+    def __iter__(self) -> Iterator[dict]:
+        for chunk in self.chunks():
+            yield from decode_chunk(chunk.data)[1]
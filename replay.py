@@ -0,0 +1,152 @@
+"""보관된 게임을 다시 보여 주는 기능.
+
+기록은 `db.record_chunks()`로 덩어리 몇 개씩만 읽어 와서 그때그때 풀어 보냅니다.
+게임 하나의 기록이 한꺼번에 메모리에 올라오지 않습니다.
+"""
+from __future__ import annotations
+import asyncio
+from typing import TYPE_CHECKING, Optional, Union
+import db
+import record
+from log import logger
+
+if TYPE_CHECKING:
+    from game import User
+
+SPEEDS: dict[str, Optional[int]] = {
+    "1x": 1,
+    "4x": 4,
+    "instant": None,  # 기다리지 않음
+}
+MAX_GAP = 10_000  # ms. 이벤트 사이가 이보다 길면 이만큼만 기다립니다.
+PUBLIC = "public"
+NICKNAME_PHASES = ("INITIATING", "NICKNAME_SELECTION")  # 자리 번호가 정해지는 단계
+
+
+class ReplayNotFound(Exception):
+    """다시 볼 기록이나 시점이 없는 경우."""
+
+
+class ReplayDenied(Exception):
+    """요청한 유저가 볼 수 없는 시점인 경우."""
+
+
+class Replay:
+    """유저 한 명에게 보관된 게임 하나를 다시 보여 줍니다.
+
+    Attributes:
+        `game_id`: 다시 볼 게임의 ID.
+        `speed`: `SPEEDS`의 키. 재생 중에도 `set_speed()`로 바꿀 수 있습니다.
+        `day`, `phase`: 이 날짜와 단계부터 보여 줍니다. `None`이면 처음부터.
+        `perspective`: `PUBLIC`이면 방 전체에게 보낸 이벤트만, 자리 번호면 그 자리의 참가자가 받은 이벤트만
+            보여 줍니다. 참가자는 자기 자리만, 다른 유저는 공개 방의 게임을 `PUBLIC`으로만 볼 수 있습니다.
+            `None`이면 참가자에게는 자기 자리로, 다른 유저에게는 `PUBLIC`으로 정해집니다.
+    """
+
+    def __init__(self,
+                 conns: db.ConnectionManager,
+                 user: User,
+                 game_id: int,
+                 speed: str = "1x",
+                 day: Optional[int] = None,
+                 phase: Optional[str] = None,
+                 perspective: Union[None, str, int] = None):
+        if not isinstance(game_id, int):
+            raise ValueError("게임 ID는 정수여야 합니다.")
+        if day is not None and not isinstance(day, int):
+            raise ValueError("날짜는 정수여야 합니다.")
+        if phase is not None and not isinstance(phase, str):
+            raise ValueError("단계는 문자열이어야 합니다.")
+        if perspective is not None and perspective != PUBLIC and not isinstance(perspective, int):
+            raise ValueError(f"시점은 자리 번호나 \"{PUBLIC}\"여야 합니다.")
+        self.conns = conns
+        self.user = user
+        self.game_id = game_id
+        self.day = day
+        self.phase = phase
+        self.perspective = perspective
+        self.set_speed(speed)
+        self._task: Optional[asyncio.Task] = None
+
+    def __repr__(self):
+        return f"<Replay #{self.game_id} for {self.user}>"
+
+    def set_speed(self, speed: str):
+        if speed not in SPEEDS:
+            raise ValueError(f"재생 속도는 {', '.join(SPEEDS)} 중 하나여야 합니다.")
+        self.speed = speed
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name=f"replay {self.game_id} for {self.user.username}")
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def viewer(self) -> Optional[str]:
+        """`perspective` 자리에 앉았던 참가자의 유저 이름. 게임 초반의 NICKNAME 이벤트에서 찾습니다."""
+        async for seq, day, phase, data in db.record_chunks(self.conns, self.game_id):
+            if phase not in NICKNAME_PHASES:
+                break
+            for entry in record.decode_chunk(data)[1]:
+                if entry["type"] == "NICKNAME" and entry["content"].get("index") == self.perspective:
+                    return entry["to"][0]
+        return None
+
+    async def _run(self):
+        try:
+            await self.play()
+        except (ReplayNotFound, ReplayDenied) as e:
+            await self.user.listen({"type": "ERROR", "content": {"REASON": str(e)}})
+        except asyncio.CancelledError:
+            raise
+        except:
+            logger.error("ERROR while replaying game #%s for %s", self.game_id, self.user, exc_info=True)
+
+    async def authorize(self):
+        """`user`가 `game_id`를 `perspective`로 볼 수 있는지 확인하고, `perspective`가 `None`이면 정합니다."""
+        visible, seat = await db.game_access(self.conns, self.game_id, self.user.id)
+        if not visible:
+            raise ReplayNotFound("그 게임이나 시점의 기록이 없습니다.")  # 비공개 게임이 있다는 것도 알리지 않음
+        if self.perspective is None:
+            self.perspective = PUBLIC if seat is None else seat
+        elif self.perspective != PUBLIC and self.perspective != seat:
+            raise ReplayDenied("자기가 앉았던 자리의 시점으로만 볼 수 있습니다.")
+
+    async def play(self):
+        await self.authorize()
+        start = await db.record_start(self.conns, self.game_id, self.day, self.phase)
+        if start is None:
+            raise ReplayNotFound("그 게임이나 시점의 기록이 없습니다.")
+        viewer = None
+        if isinstance(self.perspective, int):
+            if (viewer := await self.viewer()) is None:
+                raise ReplayNotFound(f"{self.perspective}번 자리의 참가자를 찾을 수 없습니다.")
+        await self.user.listen({"type": "REPLAY", "content": {
+            "game_id": self.game_id,
+            "day": self.day,
+            "phase": self.phase,
+            "perspective": self.perspective,
+            "speed": self.speed,
+        }})
+        last = None
+        async for seq, day, phase, data in db.record_chunks(self.conns, self.game_id, start):
+            for entry in record.decode_chunk(data)[1]:
+                if self.perspective == PUBLIC and not entry["flags"] & record.PUBLIC:
+                    continue
+                if viewer is not None and viewer not in entry["to"]:
+                    continue
+                factor = SPEEDS[self.speed]
+                if factor and last is not None:
+                    await asyncio.sleep(min(entry["time"] - last, MAX_GAP) / 1000 / factor)
+                last = entry["time"]
+                await self.user.listen({"type": "REPLAY_EVENT", "content": {
+                    "day": day,
+                    "phase": phase,
+                    "time": entry["time"],
+                    "type": entry["type"],
+                    "content": entry["content"],
+                }})
+            await asyncio.sleep(0)  # instant에서도 다른 태스크가 돌 수 있게
+        await self.user.listen({"type": "REPLAY_END", "content": {"game_id": self.game_id}})
+
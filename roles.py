@@ -17,6 +17,13 @@ def role_order_key(class_):
         return 3
     return -1
 
+def faction(class_) -> Optional[Type[Team]]:
+    """직업이 속한 큰 세력(`Town`, `Mafia`, `Triad`, `Neutral`)을 반환합니다."""
+    for team in (Mafia, Triad, Neutral, Town):
+        if issubclass(class_, team):
+            return team
+    return None
+
 def pool() -> list[tuple[str, Union[Type[Slot], Type[Role]]]]:
     is_possible_slot = lambda obj: obj is Any or (inspect.isclass(obj) and issubclass(obj, Slot) and issubclass(obj, Team) and not obj.not_for_first and not obj.disabled)
     return sorted(sorted(inspect.getmembers(sys.modules[__name__], is_possible_slot)), key=lambda item:role_order_key(item[1]))
@@ -213,7 +220,7 @@ class Role:
         """
         self.me.visits[day] = target.is_behind or target
         if not self.me.visits[day].death_announced():
-            self.me.visits[day].visited_by[day].add(self.me)
+            self.me.visits[day].add_visitor(day, self.me)
         return {AbilityResultKey.INDIVIDUAL: {self.me: {AbilityResultKey.ROLE: self.__class__}}}
 
     def after_night(self):
@@ -624,7 +631,7 @@ class Framing(Visiting):
     def visit(self, day: int, framed: game.Player):
         data = super().visit(day, framed)
         self.me.commit_crime(game.CrimeType.TRESPASS)
-        crime_pool = [c for c, done in self.me.visits[day].crimes.items() if not done]
+        crime_pool = [c for c in game.CrimeType if not self.me.visits[day].has_committed(c)]
         dest_pool = [evil.visits[day] for evil in self.me.room.remaining().values()
                      if evil.role().belongs_to(Mafia)
                         or evil.role().belongs_to(Triad)
@@ -637,13 +644,13 @@ class Framing(Visiting):
         if crime_pool:
             self.me.visits[day].commit_crime(framed_crime)
         framed_to = random.choice(dest_pool)
-        framed_to.visited_by[day].add(self.me.visits[day])
+        framed_to.add_visitor(day, self.me.visits[day])
         self.me.visits[day].framed[FrameKey.TO] = framed_to
         self.me.visits[day].framed[FrameKey.ROLE] = random.choice(role_pool)
         data[AbilityResultKey.INDIVIDUAL][self.me].update({
             "framed_crime": framed_crime,
             "framed_to": framed_to.index,
-            "framed_role": self.me.visits[day][FrameKey.ROLE]
+            "framed_role": self.me.visits[day].framed[FrameKey.ROLE]
         })
         return data
 
@@ -677,7 +684,7 @@ class Following(Investigating):
                 "visits": investiagted.visits[day].index
                         if investiagted.visits[day]
                         else None,
-                "act": investiagted.act[day]
+                "act": bool(investiagted.act[day])
             }
         else:
             result = {
@@ -686,7 +693,7 @@ class Following(Investigating):
                             and investiagted.visits[day])
                         else None,
                 "act": False if investiagted.role().immune_to_detection
-                    else investiagted.act[day]
+                    else bool(investiagted.act[day])
             }
         return result
 
@@ -754,10 +761,10 @@ class IdentityInvestigating(Investigating):
             return {"role": investigated.role().name}
         else:
             if self.ignore_immune:
-                return {"crimes": {c.name:value for c, value in investigated.crimes.items()}}
+                return {"crimes": {c.name:value for c, value in investigated.crime_record().items()}}
             elif investigated.role().immune_to_detection:
                 return {"crimes": {c.name:False for c in game.CrimeType}}
-            return {"crimes": investigated.crimes}
+            return {"crimes": investigated.crime_record()}
 
 class Jailing(ActiveOnly, Killing):
     def __init__(self, me: game.Player, constraints: dict):
@@ -1040,9 +1047,9 @@ class Coroner(Investigating, TownInvestigative):
             return {
                 "role": investigated.role().name,
                 "cause_of_death": investigated.cause_of_death,
-                "last_target": investigated.visits[-1],
-                "visitors": [sorted([visitor.role().name for visitor in visitors])
-                             for visitors in investigated.visited_by[1:]],
+                "last_target": investigated.visits[investigated.last_day],
+                "visitors": [sorted([visitor.role().name for visitor in investigated.visitors(d)])
+                             for d in range(1, investigated.last_day+1)],
             }
         return {"alive": True}
 
@@ -1355,7 +1362,7 @@ class Veteran(ActiveOnly, TownKilling, TownPower):
             }
         }]
         for visitor in [v for v in self.me.room.actors_today if v.visits[day] is self.me and not v.role().belongs_to(Lookout)]:
-            self.me.visited_by[day].add(visitor)
+            self.me.add_visitor(day, visitor)
             event = {
                 AbilityResultKey.SOUND: self.__class__,
                 AbilityResultKey.INDIVIDUAL: {}
@@ -1799,7 +1806,7 @@ class MassMurderer(Visiting, NeutralKilling):
 
     def visit(self, day: int, landlord: game.Player):
         data = super().visit(day, landlord)
-        victims = {v for v in landlord.visited_by[day] if v is not self.me}
+        victims = {v for v in landlord.visitors(day) if v is not self.me}
         if not landlord.visits[day] and landlord is not self.me:
             victims.add(landlord)
         data.update({
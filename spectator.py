@@ -0,0 +1,99 @@
+"""방을 구경하는 관전자들에게 공개 이벤트를 늦춰서 보내는 기능.
+
+`Room.emit()`은 방 전체에게 보내는 이벤트를 `SpectatorTier.publish()`로 한 번만 직렬화해 넘기고 끝납니다.
+관전자 수만큼의 전송은 방마다 하나씩 도는 펌프 태스크가 `delay`초 뒤에 합니다.
+"""
+from __future__ import annotations
+import json
+import time
+import asyncio
+from collections import deque
+from typing import TYPE_CHECKING, Optional
+from log import logger
+
+if TYPE_CHECKING:
+    from game import User
+
+DELAY = 30  # 초
+SEND_TIMEOUT = 5  # 초. 관전자 한 명에게 보내는 데 이보다 오래 걸리면 그 관전자는 관전을 그만둡니다.
+
+
+class SpectatorTier:
+    """방 하나의 관전자들과, 아직 보내지 않은 공개 이벤트를 담는 버퍼.
+    관전자는 `Room.members`에 들어가지 않으므로 게임 진행에 아무런 영향을 주지 않습니다.
+
+    Attributes:
+        `name`: 펌프 태스크 이름에 쓰입니다.
+        `delay`: 이벤트가 일어난 뒤 관전자에게 보내기까지 기다리는 시간(초).
+        `spectators`: 관전자 `User`들.
+    """
+
+    def __init__(self, name: str, delay: float = DELAY):
+        self.name = name
+        self.delay = delay
+        self.spectators: set[User] = set()
+        self._buffer: deque[tuple[float, str]] = deque()
+        self._arrived = asyncio.Event()
+        self._pump: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self.spectators)
+
+    def backlog(self) -> int:
+        """아직 보내지 않은 이벤트 수."""
+        return len(self._buffer)
+
+    def nbytes(self) -> int:
+        """아직 보내지 않은 이벤트의 바이트 수."""
+        return sum(len(text) for _, text in self._buffer)
+
+    def publish(self, event_type: str, content: dict):
+        """공개 이벤트 하나를 버퍼에 넣습니다. 관전자가 없으면 아무것도 하지 않습니다."""
+        if not self.spectators:
+            return
+        self._buffer.append((time.monotonic() + self.delay, json.dumps({"type": event_type, "content": content})))
+        self._arrived.set()
+
+    def add(self, user: User):
+        self.spectators.add(user)
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run(), name=f"spectators of {self.name}")
+
+    def remove(self, user: User):
+        self.spectators.discard(user)
+        if not self.spectators:
+            self.close()
+
+    def close(self):
+        """펌프를 멈추고 보내지 않은 이벤트를 버립니다."""
+        if self._pump:
+            self._pump.cancel()
+            self._pump = None
+        self._buffer.clear()
+
+    async def _run(self):
+        while True:
+            if not self._buffer:
+                self._arrived.clear()
+                await self._arrived.wait()
+            due, _ = self._buffer[0]
+            if (wait := due - time.monotonic()) > 0:
+                await asyncio.sleep(wait)
+            now = time.monotonic()
+            texts = []
+            while self._buffer and self._buffer[0][0] <= now:
+                texts.append(self._buffer.popleft()[1])
+            receivers = list(self.spectators)
+            for text in texts:
+                results = await asyncio.gather(*[
+                    asyncio.wait_for(user.listen_text(text), SEND_TIMEOUT)
+                    for user in receivers
+                ], return_exceptions=True)
+                for user, result in zip(receivers, results):
+                    if isinstance(result, asyncio.TimeoutError) and user in self.spectators:
+                        # 느린 관전자 한 명 때문에 다른 관전자가 밀리지 않도록 내보냅니다.
+                        logger.warning("Spectator %s is too slow. Dropping.", user)
+                        user.stop_spectating()
+                    elif isinstance(result, Exception):
+                        logger.warning("Failed to send a delayed event to spectator %s: %r", user, result)
+                receivers = [user for user in receivers if user in self.spectators]
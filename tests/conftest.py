@@ -0,0 +1,29 @@
+"""테스트는 저마다 임시 디렉터리에서 돌아가므로 DB와 저널이 저장소에 생기지 않습니다."""
+import os
+import sys
+import asyncio
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import game
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def with_server():
+    """`test(server)` 코루틴을 시작한 디버그 모드 `GameServer`로 돌립니다."""
+    def run(test):
+        async def main():
+            server = game.GameServer(debug=True)
+            await server.startup()
+            try:
+                await test(server)
+            finally:
+                await server.shutdown()
+        asyncio.run(main())
+    return run
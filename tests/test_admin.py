@@ -0,0 +1,84 @@
+import asyncio
+import auth
+import db
+import game
+import metrics
+import transport
+
+
+async def connect(server: game.GameServer, user_id: int) -> tuple[game.User, asyncio.Task]:
+    user = game.User(f"user{user_id}", transport.LoopbackTransport())
+    user.id = user_id
+    serving = asyncio.create_task(server.serve(user))
+    await asyncio.sleep(0)
+    return user, serving
+
+
+def test_ban_disconnects_and_revokes(with_server):
+    async def test(server):
+        user_id = await db.create_user(server.db, "alice", "hash")
+        user, serving = await connect(server, user_id)
+        token, _ = server.sessions.issue(auth.AuthenticatedUser("alice", user_id))
+        assert await server.process_admin_message({"type": "BAN", "user_id": user_id}) == {"type": "BAN", "user_id": user_id}
+        await asyncio.wait_for(serving, 1)
+        assert user.transport.closed == 1008
+        assert server.sessions.verify(token) is None
+        assert (await server.users.get(user_id)).banned
+        assert await server.process_admin_message({"type": "UNBAN", "user_id": user_id}) == {"type": "UNBAN", "user_id": user_id}
+        assert not (await server.users.get(user_id)).banned
+    with_server(test)
+
+
+def test_set_permission(with_server):
+    async def test(server):
+        user_id = await db.create_user(server.db, "bob", "hash")
+        user, serving = await connect(server, user_id)
+        assert not await server.is_admin(user_id)
+        response = await server.process_admin_message({"type": "SET_PERMISSION", "user_id": user_id, "permission": auth.ADMIN})
+        assert response == {"type": "SET_PERMISSION", "user_id": user_id}
+        assert user.permission == auth.ADMIN
+        assert await server.is_admin(user_id)
+        await user.transport.close()
+        await serving
+    with_server(test)
+
+
+def test_revoke_sessions(with_server):
+    async def test(server):
+        user, serving = await connect(server, 7)
+        token, _ = server.sessions.issue(auth.AuthenticatedUser("carol", 7))
+        assert await server.process_admin_message({"type": "REVOKE_SESSIONS", "user_id": 7}) == {"type": "REVOKE_SESSIONS", "user_id": 7}
+        await asyncio.wait_for(serving, 1)
+        assert user.transport.closed == 1008
+        assert server.sessions.verify(token) is None
+    with_server(test)
+
+
+def test_rejects_bad_arguments(with_server):
+    async def test(server):
+        user_id = await db.create_user(server.db, "dave", "hash")
+        for message in (
+            {"type": "BAN"},
+            {"type": "BAN", "user_id": str(user_id)},
+            {"type": "BAN", "user_id": True},
+            {"type": "UNBAN", "user_id": 0},
+            {"type": "REVOKE_SESSIONS", "user_id": -1},
+            {"type": "BAN", "user_id": user_id + 100},
+            {"type": "SET_PERMISSION", "user_id": user_id},
+            {"type": "SET_PERMISSION", "user_id": user_id, "permission": "root"},
+        ):
+            assert (await server.process_admin_message(message))["type"] == "ERROR", message
+        assert not (await server.users.get(user_id)).banned
+        assert (await server.users.get(user_id)).permission == auth.BASIC
+    with_server(test)
+
+
+def test_usernames_stay_off_metrics(with_server):
+    async def test(server):
+        user, serving = await connect(server, 1)
+        user.bytes_sent = 1000
+        assert user.username not in metrics.render()
+        assert server.admin.snapshot()["top_users"]["bytes_sent"][0] == (user.username, 1000)
+        await user.transport.close()
+        await serving
+    with_server(test)
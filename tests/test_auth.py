@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+import auth
+
+
+class Clock:
+    """`auth.time` 대신 쓰는 시계. `advance()`로만 흐릅니다."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(auth, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def loads(monkeypatch) -> list[int]:
+    """`db.user_record()` 대신 DB를 읽지 않고 유저를 만들어 주며, 읽은 유저 ID를 차례로 적습니다."""
+    loaded = []
+    async def user_record(conns, user_id):
+        loaded.append(user_id)
+        await asyncio.sleep(0.01)
+        return (user_id, f"user{user_id}", auth.BASIC, False) if user_id > 0 else None
+    monkeypatch.setattr(auth.db, "user_record", user_record)
+    return loaded
+
+
+def test_concurrent_misses_load_once(clock, loads):
+    async def test():
+        cache = auth.UserCache(None)
+        first = await asyncio.gather(*[cache.get(1) for _ in range(10)], cache.get(2))
+        assert loads == [1, 2]
+        assert all(record is first[0] for record in first[:10]) and first[0].username == "user1"
+        assert await asyncio.gather(cache.get(-1), cache.get(-1)) == [None, None]
+        assert loads == [1, 2, -1]
+        assert await cache.get(1) is first[0] and loads == [1, 2, -1]
+    asyncio.run(test())
+
+
+def test_reloads_after_ttl(clock, loads):
+    async def test():
+        cache = auth.UserCache(None, ttl=60)
+        await cache.get(1)
+        clock.advance(59)
+        await cache.get(1)
+        assert loads == [1]
+        clock.advance(1)
+        await cache.get(1)
+        assert loads == [1, 1]
+        cache.invalidate(1)
+        await cache.get(1)
+        assert loads == [1, 1, 1]
+    asyncio.run(test())
+
+
+def test_evicts_least_recently_used(clock, loads):
+    async def test():
+        cache = auth.UserCache(None, capacity=2)
+        await cache.get(1)
+        await cache.get(2)
+        await cache.get(1)  # 이제 2가 가장 오래 안 쓰였습니다.
+        await cache.get(3)
+        assert len(cache) == 2 and loads == [1, 2, 3]
+        await cache.get(1)
+        assert loads == [1, 2, 3]
+        await cache.get(2)
+        assert loads == [1, 2, 3, 2]
+    asyncio.run(test())
@@ -0,0 +1,131 @@
+import os
+import json
+import asyncio
+from types import SimpleNamespace
+import archiver
+import db
+import game
+import record
+
+
+def summary(*user_ids: int, private: bool = False, events: int = 3) -> SimpleNamespace:
+    """`db.archive()`와 `archiver.Archiver`가 읽는 값만 가진 `game.GameSummary` 대신."""
+    game_record = record.GameRecord(chunk_events=2)
+    for i in range(events):
+        game_record.append({"type": "MESSAGE", "content": {"MESSAGE": str(i)}, "from": None, "to": [], "time": i, "flags": record.PUBLIC})
+    game_record.seal()
+    return SimpleNamespace(
+        title="room",
+        setup_title="setup",
+        inventor=0,
+        formation="[]",
+        constraints="{}",
+        exclusion="[]",
+        private=private,
+        participants=tuple(game.Participant(user_id, seat, "Citizen", "Citizen", True, None) for seat, user_id in enumerate(user_ids, 1)),
+        record=game_record,
+    )
+
+
+def with_db(test):
+    async def main():
+        conns = db.ConnectionManager()
+        await conns.open()
+        try:
+            await db.create_databases(conns)
+            await test(conns)
+        finally:
+            await conns.close()
+    asyncio.run(main())
+
+
+def test_archive_only_writes_participants_for_history():
+    async def test(conns):
+        await db.archive(conns, summary(1, 2))
+        assert [game["game_id"] for game in await db.match_history(conns, 2)] == [1]
+        assert not os.path.exists("sql/games-per-user.db")
+    with_db(test)
+
+
+class FailingRecord:
+    """`chunks()`를 처음 `failures`번은 실패하는 기록."""
+
+    def __init__(self, game_record: record.GameRecord, failures: int):
+        self.game_record = game_record
+        self.failures = failures
+
+    def chunks(self):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        return self.game_record.chunks()
+
+    def __iter__(self):
+        return iter(self.game_record)
+
+    async def discard(self):
+        pass
+
+
+async def archived_games(conns: db.ConnectionManager) -> list[tuple[int, int]]:
+    """보관된 게임마다 (게임 ID, 기록 덩어리 수)."""
+    async with conns.read(db.EACH_GAME_METADATA_DB_PATH) as META:
+        games = [game_id for game_id, in await (await META.execute(f"SELECT ID FROM {db.EACH_GAME_METADATA_TABLE_NAME}")).fetchall()]
+    async with conns.read(db.INGAME_RECORDS_DB_PATH) as RECORDS:
+        return [(game_id, (await (await RECORDS.execute(
+            f"SELECT COUNT(*) FROM {db.GAME_RECORD_CHUNKS_TABLE_NAME} WHERE GameID=?", (game_id,))).fetchone())[0]) for game_id in games]
+
+
+def test_archive_retries_the_record_under_the_same_id():
+    async def test(conns):
+        game = summary(1, 2)
+        game.record = FailingRecord(game.record, failures=1)
+        await archiver.Archiver(conns, backoff=0)._archive_with_retry(game)
+        assert await archived_games(conns) == [(1, 2)]
+    with_db(test)
+
+
+def test_archive_dead_letters_with_the_committed_id():
+    async def test(conns):
+        game = summary(1, 2)
+        game_record = game.record
+        game.record = FailingRecord(game_record, failures=3)
+        await archiver.Archiver(conns, retries=3, backoff=0)._archive_with_retry(game)
+        assert await archived_games(conns) == [(1, 0)]
+        with open(archiver.DEAD_LETTER_PATH, encoding="utf-8") as f:
+            dead, = [json.loads(line) for line in f]
+        assert dead["game_id"] == 1 and len(dead["record"]) == 3
+        # 복구: 메타데이터는 그대로 두고 기록만 같은 게임 ID로 다시 넣습니다.
+        await db.archive_record(conns, dead["game_id"], game_record)
+        assert await archived_games(conns) == [(1, 2)]
+    with_db(test)
+
+
+def test_match_history_pages():
+    async def test(conns):
+        # 같은 순간에 끝난 게임들. 페이지는 게임 ID로 나누므로 시각이 같아도 겹치거나 빠지지 않습니다.
+        await asyncio.gather(*[db.archive(conns, summary(1, 2) if i % 2 else summary(1, 3)) for i in range(5)])
+        await db.archive(conns, summary(2, 3))
+        pages, before = [], None
+        while page := await db.match_history(conns, 1, before=before, limit=2):
+            pages.append([game["game_id"] for game in page])
+            before = page[-1]["game_id"]
+        assert pages == [[5, 4], [3, 2], [1]]
+        assert await db.match_history(conns, 1, before=1) == []
+        assert [game["game_id"] for game in await db.match_history(conns, 2)] == [6, 4, 2]
+        assert (await db.match_history(conns, 3, limit=1))[0]["seat"] == 2
+    with_db(test)
+
+
+def test_match_history_hides_private_games():
+    async def test(conns):
+        await db.archive(conns, summary(1, 2))
+        await db.archive(conns, summary(1, 2, private=True))
+        visible = lambda games: [game["game_id"] for game in games]
+        assert visible(await db.match_history(conns, 1)) == [1]
+        assert visible(await db.match_history(conns, 1, viewer=3)) == [1]
+        assert visible(await db.match_history(conns, 1, viewer=1)) == [2, 1]
+        assert visible(await db.match_history(conns, 1, viewer=2)) == [2, 1]
+        assert await db.game_metadata(conns, 2, viewer=3) is None
+        assert (await db.user_profile(conns, 1, viewer=3))["played"] == 1
+    with_db(test)
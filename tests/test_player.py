@@ -0,0 +1,104 @@
+import random
+import pytest
+import game
+import roles
+
+
+def constraints(role: type[roles.Role]) -> dict:
+    return {
+        option: spec[roles.ConstraintKey.DEFAULT]
+        for option, spec in (role.modifiable_constraints() or {}).items()
+    }
+
+
+@pytest.fixture
+def lineup() -> dict[int, game.Player]:
+    """1번 Framer, 2번 Mafioso, 3번 Citizen, 4번 Coroner, 5번 Citizen."""
+    host = game.User("host", None)
+    room = game.Room(host, "players", 15, 1, None, None)
+    room.day = 1
+    for index, role in enumerate((roles.Framer, roles.Mafioso, roles.Citizen, roles.Coroner, roles.Citizen), 1):
+        room.lineup[index] = game.Player(game.User(f"p{index}", None), f"p{index}", index, role, constraints(role), room)
+    return room.lineup
+
+
+def test_visitors(lineup):
+    lineup[3].add_visitor(1, lineup[5])
+    lineup[3].add_visitor(1, lineup[1])
+    lineup[3].add_visitor(1, lineup[5])
+    assert lineup[3].visitors(1) == [lineup[1], lineup[5]]
+    assert lineup[5].visitors(1) == []
+    lineup[3].start_day(2)
+    assert lineup[3].visitors(2) == []
+    assert lineup[3].visitors(1) == [lineup[1], lineup[5]]
+
+
+def test_crime_record(lineup):
+    player = lineup[3]
+    assert not any(player.crime_record().values())
+    player.commit_crime(game.CrimeType.MURDER)
+    player.commit_crime(game.CrimeType.TRESPASS)
+    player.commit_crime(game.CrimeType.MURDER)
+    record = player.crime_record()
+    assert list(record) == list(game.CrimeType)
+    assert {crime for crime, committed in record.items() if committed} == {game.CrimeType.MURDER, game.CrimeType.TRESPASS}
+    assert player.has_committed(game.CrimeType.MURDER) and not player.has_committed(game.CrimeType.ARSON)
+
+
+def test_records_grow_past_action_days(lineup):
+    player = lineup[3]
+    player.visits[1] = lineup[5]
+    player.act[1] = True
+    player.add_visitor(1, lineup[2])
+    last = game.Player.ACTION_DAYS * 2 + 3
+    for day in range(2, last + 1):
+        player.start_day(day)
+        player.visits[day] = lineup[day % 5 + 1]
+        player.add_visitor(day, lineup[4])
+    assert player.last_day == last
+    assert len(player.act) == len(player.visits) == len(player.visited_by) > last
+    assert player.visits[1] is lineup[5] and player.act[1]
+    assert player.visitors(1) == [lineup[2]]
+    assert all(player.visitors(day) == [lineup[4]] for day in range(2, last + 1))
+    assert player.visits[last] is lineup[last % 5 + 1]
+
+
+def test_framer(lineup, monkeypatch):
+    framer, mafioso, framed, _, target = (lineup[i] for i in range(1, 6))
+    monkeypatch.setattr(random, "choice", lambda pool: pool[-1])
+    mafioso.visits[1] = target
+    target.add_visitor(1, mafioso)
+    data = framer.role().visit(1, framed)[roles.AbilityResultKey.INDIVIDUAL][framer]
+    assert framer.has_committed(game.CrimeType.TRESPASS)
+    assert framed.visitors(1) == [framer]
+    # 누명을 쓴 사람은 마피아가 방문한 곳을 방문한 것처럼, 마피아 직업인 것처럼 보입니다.
+    assert framed.framed[roles.FrameKey.TO] is target and data["framed_to"] == target.index
+    assert target.visitors(1) == [mafioso, framed]
+    assert framed.framed[roles.FrameKey.ROLE] is mafioso.role()
+    assert [crime for crime, committed in framed.crime_record().items() if committed] == [data["framed_crime"]]
+    framer.role().after_night()
+    assert framed.framed == {}
+
+
+def test_coroner_autopsy(lineup):
+    dead, coroner = lineup[3], lineup[4]
+    last = game.Player.ACTION_DAYS + 4
+    dead.add_visitor(1, lineup[2])
+    dead.add_visitor(1, lineup[5])
+    for day in range(2, last + 1):
+        for player in lineup.values():
+            player.start_day(day)
+    dead.visits[last] = lineup[1]
+    dead.add_visitor(last, lineup[1])
+    dead.cause_of_death.append("MAFIA")
+    dead.room.graveyard.append(dead)
+    coroner.start_day(last + 1)
+    data = coroner.role().visit(last + 1, dead)[roles.AbilityResultKey.INDIVIDUAL][coroner]
+    assert dead.visitors(last + 1) == []  # 공표된 시체는 방문 기록이 남지 않습니다.
+    autopsy = data[roles.AbilityResultKey.RESULT]
+    assert autopsy["role"] == "Citizen" and autopsy["cause_of_death"] == ["MAFIA"]
+    assert autopsy["last_target"] is lineup[1]
+    assert len(autopsy["visitors"]) == last
+    assert autopsy["visitors"][0] == ["Citizen", "Mafioso"]
+    assert autopsy["visitors"][last - 1] == ["Framer"]
+    assert not any(autopsy["visitors"][1:last - 1])
@@ -0,0 +1,104 @@
+import json
+import asyncio
+import archiver
+import record
+
+T0 = 1_700_000_000_000
+
+
+def entry(type_: str, content, from_, to: list, time: int, flags: int = 0) -> dict:
+    return {"type": type_, "content": content, "from": from_, "to": to, "time": time, "flags": flags}
+
+
+def game_events() -> list[dict]:
+    everyone = ["alice", "밥", "carol"]
+    return [
+        entry("GAME_INFO", {"formation": ["Mafioso", "RandomTown", "Doctor"], "lineup": {"1": "alice", "2": "밥", "3": "carol"}},
+              None, everyone, T0, record.PUBLIC),
+        entry("ROLE", {"ROLE": "Mafioso"}, None, ["alice"], T0 + 5),
+        entry("MESSAGE", {"MESSAGE": "Doctor", "FROM": "밥"}, "밥", everyone, T0 + 1_000, record.PUBLIC),
+        entry("MESSAGE", {"MESSAGE": "나는 Mafioso 아님 🙂", "FROM": "carol"}, "carol", everyone, T0 + 1_200, record.PUBLIC),
+        entry("ABILITY_RESULT", {"result": {"role": "Doctor", "framed_role": "Citizen", "act": False}}, None, ["carol"], T0 + 1_200),
+        entry("VOTE", {"WHO": -1, "TARGET": 2**40, "votes": [0, -7, 3]}, "alice", everyone, T0 + 60_000, record.PUBLIC),
+        entry("DEAD", {"WHO": 2, "role": None, "WILL": "", "nested": [{"ROLE": "RandomTown"}, "Mafioso"]}, None, everyone, T0 + 90_000, record.PUBLIC),
+    ]
+
+
+def jsonified(entries: list[dict]) -> list[dict]:
+    return [dict(e, content=json.loads(json.dumps(e["content"]))) for e in entries]
+
+
+def test_chunk_round_trip():
+    events = game_events()
+    writer = record.ChunkWriter(1, "DAY", T0)
+    for e in events:
+        writer.add(e)
+    header, entries = record.decode_chunk(writer.seal().data)
+    assert (header["day"], header["phase"], header["t0"]) == (1, "DAY", T0)
+    assert list(entries) == jsonified(events)
+
+
+def test_only_role_fields_are_interned():
+    writer = record.ChunkWriter(1, "DAY", T0)
+    writer.add(entry("MESSAGE", {"MESSAGE": "Doctor", "FROM": "Mafioso"}, "Mafioso", ["Mafioso"], T0))
+    writer.add(entry("ROLE", {"ROLE": "Citizen", "formation": ["Citizen"]}, None, ["Mafioso"], T0))
+    header, entries = record.decode_chunk(writer.seal().data)
+    assert header["roles"] == ["Citizen"]
+    chat, role = entries
+    assert chat["content"] == {"MESSAGE": "Doctor", "FROM": "Mafioso"}
+    assert role["content"] == {"ROLE": "Citizen", "formation": ["Citizen"]}
+
+
+def test_game_record_across_chunks():
+    events = game_events()
+    game_record = record.GameRecord(chunk_events=3)
+    for i, e in enumerate(events):
+        if i == 2:
+            game_record.mark_phase(1, "DISCUSSION")
+        game_record.append(e)
+    game_record.seal()
+    assert [(c.day, c.phase, c.events) for c in game_record.chunks()] == [(1, "", 2), (1, "DISCUSSION", 3), (1, "DISCUSSION", 2)]
+    assert list(game_record) == jsonified(events)
+
+
+def test_journal_survives_crash_without_torn_tail():
+    async def test():
+        journal = record.Journal.for_room(1)
+        game_record = record.GameRecord(chunk_events=2, journal=journal)
+        events = game_events()
+        for e in events[:4]:
+            game_record.append(e)
+        await game_record.flush()
+        await journal.flush(force=True)
+        for e in events[4:6]:
+            game_record.append(e)  # 닫혔지만 flush되지 않은 덩어리. 서버가 죽으면 사라집니다.
+        # 쓰다가 죽은 프레임: 머리만 온전하고 덩어리는 반만 쓰였습니다.
+        torn = record.ChunkWriter(3, "NIGHT", T0)
+        torn.add(events[6])
+        chunk = torn.seal()
+        with open(journal.path, "ab") as f:
+            f.write(record.FRAME_HEADER.pack(chunk.day, chunk.events, len(chunk.phase), len(chunk.data)) + chunk.phase.encode() + chunk.data[:len(chunk.data)//2])
+        return journal.path  # close()하지 않습니다.
+    path = asyncio.run(test())
+    assert record.journals() == [path]
+    recovered = list(record.Journal(path).chunks())
+    assert [(c.day, c.phase, c.events) for c in recovered] == [(1, "", 2), (1, "", 2)]
+    assert [entry for c in recovered for entry in record.decode_chunk(c.data)[1]] == jsonified(game_events()[:4])
+    with open(path, "ab") as f:
+        f.write(b"\x01\x00")  # 머리도 다 쓰지 못한 프레임
+    assert len(list(record.Journal(path).chunks())) == 2
+
+
+def test_archiver_recovers_journal_to_dead_letter():
+    async def test():
+        journal = record.Journal.for_room(2)
+        game_record = record.GameRecord(chunk_events=3, journal=journal)
+        for e in game_events():
+            game_record.append(e)
+        await journal.flush(force=True)
+        await archiver.Archiver(None, dead_letter_path="dead-letter.jsonl").recover(record.journals())
+    asyncio.run(test())
+    assert record.journals() == []
+    with open("dead-letter.jsonl", encoding="utf-8") as f:
+        dead, = [json.loads(line) for line in f]
+    assert dead["recovered"] and dead["record"] == jsonified(game_events()[:6])
@@ -0,0 +1,98 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+import db
+import game
+import record
+import replay
+import transport
+
+EVERYONE = ["alice", "bob"]
+
+
+def entry(type_: str, content: dict, to: list, time: int) -> dict:
+    return {"type": type_, "content": content, "from": None, "to": to, "time": time,
+            "flags": record.PUBLIC if to is EVERYONE else 0}
+
+
+def archived_game(private: bool = False) -> SimpleNamespace:
+    """alice(1번 자리)와 bob(2번 자리)이 한 게임. 단계마다 덩어리가 나뉩니다."""
+    game_record = record.GameRecord(1, "NICKNAME_SELECTION")
+    for seat, name in enumerate(EVERYONE, 1):
+        game_record.append(entry("NICKNAME", {"index": seat}, [name], seat))
+    for day, phases in ((1, ("DISCUSSION", "NIGHT")), (2, ("MORNING", "DISCUSSION", "NIGHT"))):
+        for phase in phases:
+            game_record.mark_phase(day, phase)
+            at = day*100 + len(game_record)
+            game_record.append(entry("PHASE", {"PHASE": phase}, EVERYONE, at))
+            game_record.append(entry("ROLE", {"ROLE": "Mafioso", "phase": phase}, ["alice"], at + 1))
+            game_record.append(entry("ABILITY_RESULT", {"role": "Doctor", "phase": phase}, ["bob"], at + 2))
+    game_record.seal()
+    return SimpleNamespace(
+        title="room", setup_title="setup", inventor=0, formation="[]", constraints="{}", exclusion="[]", private=private,
+        participants=(game.Participant(1, 1, "Mafioso", "Mafioso", True, None), game.Participant(2, 2, "Doctor", "Doctor", False, None)),
+        record=game_record,
+    )
+
+
+def user(name: str, user_id: int) -> game.User:
+    viewer = game.User(name, transport.LoopbackTransport())
+    viewer.id = user_id
+    return viewer
+
+
+def with_game(test, private: bool = False):
+    async def main():
+        conns = db.ConnectionManager()
+        await conns.open()
+        try:
+            await db.create_databases(conns)
+            game_id = await db.archive(conns, archived_game(private))
+            await test(conns, game_id)
+        finally:
+            await conns.close()
+    asyncio.run(main())
+
+
+async def watch(conns: db.ConnectionManager, viewer: game.User, game_id: int, **options) -> list[dict]:
+    await replay.Replay(conns, viewer, game_id, speed="instant", **options).play()
+    messages = viewer.transport.drain()
+    assert messages[-1]["type"] == "REPLAY_END"
+    return [m["content"] for m in messages if m["type"] == "REPLAY_EVENT"]
+
+
+def test_perspective_does_not_leak_private_events():
+    async def test(conns, game_id):
+        bob = await watch(conns, user("bob", 2), game_id)
+        assert {e["type"] for e in bob} == {"NICKNAME", "PHASE", "ABILITY_RESULT"}
+        assert [e["content"] for e in bob if e["type"] == "NICKNAME"] == [{"index": 2}]
+        carol = await watch(conns, user("carol", 3), game_id)
+        assert {e["type"] for e in carol} == {"PHASE"}
+        assert await watch(conns, user("bob", 2), game_id, perspective=replay.PUBLIC) == carol
+        for viewer, seat in (("bob", 1), ("carol", 1), ("carol", 2)):
+            with pytest.raises(replay.ReplayDenied):
+                await watch(conns, user(viewer, {"bob": 2, "carol": 3}[viewer]), game_id, perspective=seat)
+    with_game(test)
+
+
+def test_private_game_is_not_found_for_others():
+    async def test(conns, game_id):
+        with pytest.raises(replay.ReplayNotFound):
+            await watch(conns, user("carol", 3), game_id)
+        assert {e["type"] for e in await watch(conns, user("alice", 1), game_id)} == {"NICKNAME", "PHASE", "ROLE"}
+    with_game(test, private=True)
+
+
+def test_seek_to_day_and_phase():
+    async def test(conns, game_id):
+        alice = user("alice", 1)
+        events = await watch(conns, alice, game_id, day=2)
+        assert [(e["day"], e["phase"], e["type"]) for e in events[:2]] == [(2, "MORNING", "PHASE"), (2, "MORNING", "ROLE")]
+        assert {e["day"] for e in events} == {2}
+        events = await watch(conns, alice, game_id, day=2, phase="NIGHT")
+        assert [(e["day"], e["phase"], e["type"]) for e in events] == [(2, "NIGHT", "PHASE"), (2, "NIGHT", "ROLE")]
+        events = await watch(conns, alice, game_id, day=1, phase="NIGHT")
+        assert (events[0]["day"], events[0]["phase"]) == (1, "NIGHT") and events[-1]["phase"] == "NIGHT" and events[-1]["day"] == 2
+        with pytest.raises(replay.ReplayNotFound):
+            await watch(conns, alice, game_id, day=3)
+    with_game(test)
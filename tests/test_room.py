@@ -0,0 +1,100 @@
+import json
+import asyncio
+import game
+import record
+import roles
+import transport
+
+CITIZEN = {option: spec[roles.ConstraintKey.DEFAULT] for option, spec in roles.Citizen.modifiable_constraints().items()}
+
+
+async def enter_new_room(server: game.GameServer, *names: str, password: str = "") -> tuple[game.Room, list[game.User], list[asyncio.Task]]:
+    """`names`의 유저들을 접속시키고 첫 유저가 만든 방에 모두 들여보냅니다."""
+    users = [game.User(name, transport.LoopbackTransport()) for name in names]
+    serving = [asyncio.create_task(server.serve(user)) for user in users]
+    await asyncio.sleep(0)
+    await server.process_message(users[0], {"type": "CREATE", "title": "room", "password": password})
+    for user in users[1:]:
+        await server.process_message(user, {"type": "ENTER", "id": users[0].room.id})
+    for user in users:
+        user.transport.drain()
+    return users[0].room, users, serving
+
+
+async def leave(users: list[game.User], serving: list[asyncio.Task]):
+    for user in users:
+        await user.transport.close()
+    await asyncio.gather(*serving)
+
+
+def test_chat_before_init_game(with_server):
+    async def test(server):
+        room, users, serving = await enter_new_room(server, "host", "guest")
+        # 방장이 시작한 뒤 init_game()이 `lineup`을 채우기 전에 온 채팅
+        room.record = record.GameRecord(1, game.PhaseType.INITIATING.name)
+        await room.turn_phase(game.PhaseType.INITIATING)
+        await users[1].speak("hello")
+        assert room.lineup == {} and room.hell == []
+        assert not [m for m in users[0].transport.drain() if m["type"] == game.EventType.MESSAGE.name]
+        room.record = None
+        room._phase = game.PhaseType.IDLE
+        await leave(users, serving)
+    with_server(test)
+
+
+def test_lobby_chat_is_json(with_server):
+    async def test(server):
+        room, users, serving = await enter_new_room(server, "host", "guest")
+        watcher = game.User("watcher", transport.LoopbackTransport())
+        serving.append(asyncio.create_task(server.serve(watcher)))
+        users.append(watcher)
+        await asyncio.sleep(0)
+        await server.process_message(watcher, {"type": "SPECTATE", "id": room.id})
+        await users[1].speak("hello")
+        messages = [m for m in users[0].transport.drain() if m["type"] == game.EventType.MESSAGE.name]
+        assert messages == [{"type": "MESSAGE", "content": {"FROM": "guest", "MESSAGE": "hello"}}]
+        assert json.loads(json.dumps(messages[0])) == messages[0]
+        await leave(users, serving)
+    with_server(test)
+
+
+def test_spectate_private_room_needs_password(with_server):
+    async def test(server):
+        room, users, serving = await enter_new_room(server, "host", password="secret")
+        watcher = game.User("watcher", transport.LoopbackTransport())
+        serving.append(asyncio.create_task(server.serve(watcher)))
+        users.append(watcher)
+        await asyncio.sleep(0)
+        watcher.transport.drain()
+        for password in (None, "wrong"):
+            await server.process_message(watcher, {"type": "SPECTATE", "id": room.id, "password": password})
+            assert watcher.transport.drain() == [{"type": "ERROR", "content": {"REASON": "비밀번호가 틀렸습니다."}}]
+            assert watcher.spectating is None and not len(room.spectators)
+        await server.process_message(watcher, {"type": "SPECTATE", "id": room.id, "password": "secret"})
+        assert watcher.spectating is room
+        assert [m["type"] for m in watcher.transport.drain()] == ["SPECTATE"]
+        await leave(users, serving)
+    with_server(test)
+
+
+def test_sound_reaches_everyone_else(with_server):
+    async def test(server):
+        room, users, serving = await enter_new_room(server, "host", "guest", "third")
+        for index, user in enumerate(users, 1):
+            room.lineup[index] = user.player = game.Player(user, user.username, index, roles.Citizen, CITIZEN, room)
+        room.record = record.GameRecord(1, game.PhaseType.NIGHT.name)
+        room._phase = game.PhaseType.NIGHT
+        killed = room.lineup[2]
+        await room.emit_sound({
+            roles.AbilityResultKey.SOUND: roles.Mafioso,
+            roles.AbilityResultKey.INDIVIDUAL: {killed: {roles.AbilityResultKey.TYPE: roles.AbilityResultKey.KILLED}},
+        })
+        heard = {user.username: [m["content"] for m in user.transport.drain()] for user in users}
+        assert heard["guest"] == [{"SOUND": "Mafioso", "LENGTH": None, "data": {"TYPE": "KILLED"}}]
+        assert heard["host"] == heard["third"] == [{"SOUND": "Mafioso", "LENGTH": None}]
+        assert [entry["to"] for entry in room.record] == [["guest"], ["host", "third"]]
+        room.record = None
+        room._phase = game.PhaseType.IDLE
+        room.release_game_state()
+        await leave(users, serving)
+    with_server(test)
@@ -0,0 +1,62 @@
+import json
+import asyncio
+import db
+import game
+import roles
+import transport
+
+CONTENT = {
+    "title": "five",
+    "formation": ["Mafioso", "Citizen", "Citizen", "Doctor", "Citizen"],
+    "constraints": {},
+    "exclusion": {},
+}
+
+
+def test_load_caches_under_the_requested_digest(with_server, monkeypatch):
+    loads = []
+    async def load_setup_content(conns, digest):
+        loads.append(digest)
+        return json.dumps(CONTENT)  # 예전 방식으로 저장되어 지금 계산한 해시와 다른 해시
+    monkeypatch.setattr(db, "load_setup_content", load_setup_content)
+    async def test(server):
+        cache = server.setup_cache
+        alice = game.User("alice", transport.LoopbackTransport())
+        bob = game.User("bob", transport.LoopbackTransport())
+        first = await cache.load("old-digest", alice)
+        second = await cache.load("old-digest", bob)
+        assert loads == ["old-digest"]
+        assert cache.get("old-digest") is not None
+        assert (first.inventor, second.inventor) == ("alice", "bob")
+        first.formation.append(roles.Citizen)
+        first.constraints[roles.Doctor] = {}
+        first.pool_per_slot[0].clear()
+        third = await cache.load("old-digest", alice)
+        assert len(third.formation) == 5 and roles.Doctor not in third.constraints and third.pool_per_slot[0]
+        assert cache.get("old-digest").inventor == "alice"
+    with_server(test)
+
+
+def test_setup_load_errors_reach_only_the_host(with_server, monkeypatch):
+    async def test(server):
+        users = [game.User(name, transport.LoopbackTransport()) for name in ("host", "guest")]
+        serving = [asyncio.create_task(server.serve(user)) for user in users]
+        await asyncio.sleep(0)
+        await server.process_message(users[0], {"type": "CREATE", "title": "room", "password": ""})
+        await server.process_message(users[1], {"type": "ENTER", "id": users[0].room.id})
+        for user in users:
+            user.transport.drain()
+        await server.process_message(users[0], {"type": "SETUP_LOAD", "slot": 1})
+        async def broken(*args):
+            raise RuntimeError("db is gone")
+        monkeypatch.setattr(db, "load_setup_digest", broken)
+        await server.process_message(users[0], {"type": "SETUP_LOAD", "slot": 1})
+        assert users[0].transport.drain() == [
+            {"type": "ERROR", "content": {"REASON": "그 칸에는 저장된 설정이 없습니다."}},
+            {"type": "ERROR", "content": {"REASON": "설정 불러오기 중 알 수 없는 오류가 발생했습니다."}},
+        ]
+        assert users[1].transport.drain() == []
+        for user in users:
+            await user.transport.close()
+        await asyncio.gather(*serving)
+    with_server(test)
@@ -0,0 +1,52 @@
+import asyncio
+import pytest
+import game
+import transport
+
+
+def test_transport_is_abstract():
+    with pytest.raises(TypeError):
+        transport.Transport()
+
+    class SendOnly(transport.Transport):
+        async def send(self, data: dict) -> int:
+            return 0
+
+    with pytest.raises(TypeError):
+        SendOnly()
+
+
+async def expect(loopback: transport.LoopbackTransport, type: str) -> dict:
+    """`type` 메시지가 올 때까지 그 앞의 메시지를 버리며 기다립니다."""
+    while (message := await asyncio.wait_for(loopback.outbox.get(), 1))["type"] != type:
+        pass
+    return message
+
+
+def test_serve_over_loopback(with_server):
+    async def test(server):
+        alice = game.User("alice", transport.LoopbackTransport())
+        bob = game.User("bob", transport.LoopbackTransport())
+        serving = [asyncio.create_task(server.serve(user)) for user in (alice, bob)]
+        assert (await expect(alice.transport, "INITIAL_INFORMATION"))["username"] == "alice"
+        await expect(bob.transport, "INITIAL_INFORMATION")
+
+        alice.transport.put({"type": "CREATE", "title": "loopback", "password": ""})
+        room_id = (await expect(alice.transport, "CREATE"))["content"]["CREATED"]
+        assert (await expect(bob.transport, "NEW_ROOM"))["room"]["id"] == room_id
+        bob.transport.put({"type": "ENTER", "id": room_id})
+        assert (await expect(bob.transport, "ENTER"))["content"] == {"who": "bob"}
+        assert bob.room is alice.room is server.rooms[room_id]
+
+        alice.transport.put({"type": "MESSAGE", "text": "hello"})
+        assert "hello" in (await expect(bob.transport, "MESSAGE"))["content"].values()
+
+        await bob.transport.close()
+        await asyncio.wait_for(serving[1], 1)
+        assert bob not in server.online and bob.room is None
+        assert server.rooms[room_id].members == [alice]
+
+        await alice.transport.close()
+        await asyncio.wait_for(serving[0], 1)
+        assert not server.online and room_id not in server.rooms
+    with_server(test)
@@ -0,0 +1,333 @@
+"""한 프로세스가 방을 몇 개까지 버티는지 재는 부하 생성기.
+
+`--rooms`개의 방마다 `--players`명의 봇이 WebSocket으로 접속해 방을 만들고(방장), 들어가고, 설정을 보내고,
+게임을 시작해 끝날 때까지 놉니다. 게임이 끝나면 방장이 곧바로 다시 시작합니다.
+봇은 `--chat-rate`(초당)만큼 채팅을 하고, 단계가 바뀔 때마다 투표·방문 같은 명령을 `--command-chance`의 확률로 보냅니다.
+
+채팅 내용에는 보낸 시각이 들어 있어서, 같은 방의 봇이 받은 순간 이벤트 전달 지연(보낸 뒤 받기까지)을 잽니다.
+서버의 루프 지연은 `/metrics`의 `mafia_loop_lag_seconds`를 읽습니다.
+
+    python tools/loadtest.py [--rooms 10] [--players 7] [--duration 120] [--debug]
+
+`--url`을 주지 않으면 임시 디렉터리에서 `main:app`을 uvicorn으로 직접 띄웁니다.
+`--debug`면 서버를 디버그 모드로 띄워(단계가 짧고 로그인이 없음) 게임이 빨리 돕니다.
+아니면 봇마다 가입하고 로그인해 받은 세션 토큰으로 접속합니다. bcrypt 때문에 가입에 시간이 걸립니다.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+from enum import Enum
+from typing import Optional
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import roles
+PASSWORD = "loadtest1234"
+PROBE = re.compile(r"^load (\d+)$")
+LOOP_LAG = re.compile(r'^mafia_loop_lag_seconds\{quantile="([^"]+)"\} (\S+)$', re.MULTILINE)
+
+
+def percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered)-1, int(len(ordered)*p))]
+
+
+class Stats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.connect_times: list[float] = []
+        self.latencies: list[float] = []  # 초
+        self.loop_lag: dict[str, float] = dict()
+        self.games = 0
+        self.events = 0
+        self.errors = 0
+
+    def report(self, final: bool = False) -> str:
+        elapsed = time.perf_counter() - self.started
+        connect_span = (max(self.connect_times) - min(self.connect_times)) if len(self.connect_times) > 1 else 0
+        lines = [
+            f"{'final' if final else 'progress'} @ {elapsed:.0f}s",
+            f"  connected {len(self.connect_times)} clients"
+            + (f" ({len(self.connect_times)/connect_span:.1f}/s)" if connect_span else ""),
+            (
+                f"  delivery latency p50 {percentile(self.latencies, 0.5)*1000:.1f}ms "
+                f"p90 {percentile(self.latencies, 0.9)*1000:.1f}ms "
+                f"p99 {percentile(self.latencies, 0.99)*1000:.1f}ms "
+                f"max {max(self.latencies)*1000:.1f}ms ({len(self.latencies)} samples)"
+                if self.latencies else "  delivery latency: no samples yet"
+            ),
+            "  server loop lag " + " ".join(f"p{float(q)*100:g} {v*1000:.1f}ms" for q, v in self.loop_lag.items()),
+            f"  games completed {self.games} ({self.games / (elapsed/60):.2f}/min), "
+            f"events received {self.events}, errors {self.errors}",
+        ]
+        return "\n".join(lines)
+
+
+def http(url: str, body: Optional[dict] = None) -> tuple[int, str]:
+    request = urllib.request.Request(url, data=json.dumps(body).encode() if body is not None else None,
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+
+async def issue_token(base: str, username: str) -> str:
+    """가입하고 로그인해 세션 토큰을 받습니다. 서버가 바쁘다고 하면(429/503) 조금 있다가 다시 합니다."""
+    for path, accepted in (("/register", (201, 400)), ("/login", (200,))):
+        while True:
+            status, text = await asyncio.to_thread(http, base + path, {"username": username, "password": PASSWORD})
+            if status in accepted:
+                break
+            if status not in (429, 503):
+                raise RuntimeError(f"{path} {status}: {text}")
+            await asyncio.sleep(random.uniform(0.1, 0.5))
+    return json.loads(text)["token"]
+
+
+def default_constraints() -> dict[str, dict]:
+    """무작위 칸에서 어떤 직업이 나와도 되도록 모든 직업의 세부 설정을 기본값으로 채웁니다."""
+    name = lambda value: value.name if isinstance(value, Enum) else value
+    return {
+        role_name: {
+            name(option): name(spec[roles.ConstraintKey.DEFAULT])
+            for option, spec in (role.modifiable_constraints() or {}).items()
+        }
+        for role_name, role in roles.pool() if roles.is_specific_role(role)
+    }
+
+
+class Bot:
+    def __init__(self, args, stats: Stats, name: str, token: Optional[str]):
+        self.args = args
+        self.stats = stats
+        self.name = name
+        self.token = token
+        self.ws = None
+        self.index: Optional[int] = None
+        self.lineup: list[int] = []
+        self.phase = "IDLE"
+        self.members = 0
+        self.room_id: Optional[int] = None
+        self.created = asyncio.Event()
+        self.setup_applied = asyncio.Event()
+        self.idle = asyncio.Event()
+
+    async def connect(self):
+        url = f"{self.args.ws}/game" + (f"?token={self.token}" if self.token else "")
+        self.ws = await websockets.connect(url, max_size=None)
+        self.stats.connect_times.append(time.perf_counter())
+        json.loads(await self.ws.recv())  # INITIAL_INFORMATION
+
+    async def send(self, message: dict):
+        await self.ws.send(json.dumps(message))
+
+    async def say(self, text: str):
+        await self.send({"type": "MESSAGE", "text": text})
+
+    async def receive(self):
+        async for text in self.ws:
+            received = time.perf_counter_ns()
+            self.stats.events += 1
+            message = json.loads(text)
+            content = message.get("content") or {}
+            kind = message.get("type")
+            if kind == "MESSAGE" and (match := PROBE.match(str(content.get("MESSAGE", "")))):
+                self.stats.latencies.append((received - int(match.group(1))) / 1e9)
+            elif kind == "CREATE":
+                self.room_id = content["CREATED"]
+            elif kind == "NEW_ROOM" and message["room"]["id"] == self.room_id:
+                # CREATE가 온 뒤에야 방이 목록에 들어가므로, 이것을 받아야 다른 봇이 들어갈 수 있습니다.
+                self.created.set()
+            elif kind == "ENTER":
+                self.members += 1
+            elif kind == "LEAVE":
+                self.members -= 1
+            elif kind == "SETUP":
+                self.setup_applied.set()
+            elif kind == "ERROR":
+                self.stats.errors += 1
+            elif kind == "NICKNAME":
+                self.index = content["index"]
+            elif kind == "LINEUP":
+                self.lineup = [int(i) for i in content["lineup"]]
+            elif kind == "BACK_TO_IDLE":
+                self.idle.set()
+            elif kind == "PHASE":
+                self.phase = content["PHASE"]
+                asyncio.create_task(self.act(self.phase))
+
+    def target(self) -> Optional[int]:
+        others = [i for i in self.lineup if i != self.index]
+        return random.choice(others) if others else None
+
+    async def act(self, phase: str):
+        """단계가 바뀌면 조금 있다가 그 단계에 맞는 명령을 보냅니다."""
+        await asyncio.sleep(random.uniform(0, 1))
+        try:
+            if phase == "NICKNAME_SELECTION":
+                await self.say(f"/닉네임 bot{random.randrange(10000)}")
+            elif random.random() >= self.args.command_chance:
+                return
+            elif phase == "EVENING" and (target := self.target()):
+                await self.say(f"/방문 {target}")
+            elif phase == "VOTE" and (target := self.target()):
+                await self.say(f"/투표 {target}")
+            elif phase == "VOTE_EXECUTION":
+                await self.say(random.choice(("/유죄", "/무죄")))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def chat(self):
+        if self.args.chat_rate <= 0:
+            return
+        while True:
+            await asyncio.sleep(random.expovariate(self.args.chat_rate))
+            await self.say(f"load {time.perf_counter_ns()}")
+
+
+class Room:
+    def __init__(self, args, stats: Stats, number: int, tokens: list[Optional[str]]):
+        self.args = args
+        self.stats = stats
+        self.bots = [Bot(args, stats, f"lt{number}x{seat}", token) for seat, token in enumerate(tokens)]
+
+    async def run(self):
+        host, guests = self.bots[0], self.bots[1:]
+        for bot in self.bots:
+            await bot.connect()
+        background = [asyncio.create_task(bot.receive()) for bot in self.bots]
+        await host.send({"type": "CREATE", "title": f"load {host.name}", "password": None})
+        await host.created.wait()
+        for guest in guests:
+            await guest.send({"type": "ENTER", "id": host.room_id})
+        while host.members < len(self.bots):
+            await asyncio.sleep(0.05)
+        formation = self.args.formation or ["Citizen"]*(len(self.bots)-2) + ["Mafioso", "Godfather"]
+        await host.send({"type": "SETUP", "setup": {
+            "title": "load",
+            "formation": formation,
+            "constraints": default_constraints(),
+            "exclusion": {},
+        }})
+        await host.setup_applied.wait()
+        background.extend(asyncio.create_task(bot.chat()) for bot in self.bots)
+        try:
+            while True:
+                host.idle.clear()
+                await host.say("/시작")
+                await host.idle.wait()
+                self.stats.games += 1
+        finally:
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*[bot.ws.close() for bot in self.bots], return_exceptions=True)
+
+
+async def watch_loop_lag(args, stats: Stats):
+    while True:
+        status, text = await asyncio.to_thread(http, args.http + "/metrics")
+        if status == 200:
+            stats.loop_lag = {q: float(v) for q, v in LOOP_LAG.findall(text)}
+        await asyncio.sleep(1)
+
+
+async def report(args, stats: Stats):
+    while True:
+        await asyncio.sleep(args.report)
+        print(stats.report(), flush=True)
+
+
+async def main(args):
+    stats = Stats()
+    tokens: list[list[Optional[str]]] = [[None]*args.players for _ in range(args.rooms)]
+    if not args.debug:
+        print(f"registering {args.rooms*args.players} users...", flush=True)
+        semaphore = asyncio.Semaphore(4)
+        async def _issue(room: int, seat: int):
+            async with semaphore:
+                tokens[room][seat] = await issue_token(args.http, f"lt{room}x{seat}")
+        await asyncio.gather(*[_issue(r, s) for r in range(args.rooms) for s in range(args.players)])
+    stats.started = time.perf_counter()
+    helpers = [asyncio.create_task(watch_loop_lag(args, stats)), asyncio.create_task(report(args, stats))]
+    rooms = [asyncio.create_task(Room(args, stats, number, tokens[number]).run()) for number in range(args.rooms)]
+    done, _ = await asyncio.wait(rooms, timeout=args.duration, return_when=asyncio.FIRST_EXCEPTION)
+    for task in rooms + helpers:
+        task.cancel()
+    await asyncio.gather(*rooms, *helpers, return_exceptions=True)
+    for task in done:
+        if task.exception():
+            print(f"a room failed: {task.exception()!r}", file=sys.stderr)
+    print(stats.report(final=True))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn(args) -> subprocess.Popen:
+    """임시 디렉터리에서 서버를 띄우고 `/metrics`가 응답할 때까지 기다립니다."""
+    port = free_port()
+    args.http, args.ws = f"http://127.0.0.1:{port}", f"ws://127.0.0.1:{port}"
+    directory = tempfile.mkdtemp(prefix="loadtest-")
+    env = dict(os.environ, PYTHONPATH=ROOT, DEBUG=str(args.debug).lower())
+    print(f"server log: {os.path.join(directory, 'server.log')}", flush=True)
+    with open(os.path.join(directory, "server.log"), "w") as log:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--no-access-log"],
+            cwd=directory, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if http(args.http + "/metrics")[0] == 200:
+                return server
+        except OSError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("server did not start")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebSocket 부하 생성기")
+    parser.add_argument("--url", help="이미 떠 있는 서버(예: http://127.0.0.1:8000). 없으면 직접 띄웁니다.")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--players", type=int, default=7, help="방마다 봇 수(5~15)")
+    parser.add_argument("--formation", nargs="*", help="직업 구성. 기본값은 시민 여럿과 마피아 둘")
+    parser.add_argument("--duration", type=float, default=120, help="초")
+    parser.add_argument("--chat-rate", type=float, default=0.2, help="봇 하나가 초당 보내는 채팅 수")
+    parser.add_argument("--command-chance", type=float, default=0.5, help="단계마다 명령을 보낼 확률")
+    parser.add_argument("--report", type=float, default=10, help="중간 보고 간격(초)")
+    parser.add_argument("--debug", action="store_true", help="서버를 디버그 모드로 띄웁니다(직접 띄울 때만).")
+    args = parser.parse_args()
+    if not 5 <= args.players <= 15:
+        parser.error("--players must be between 5 and 15")
+    server = None
+    if args.url:
+        args.http = args.url.rstrip("/")
+        args.ws = re.sub(r"^http", "ws", args.http)
+    else:
+        server = spawn(args)
+    try:
+        asyncio.run(main(args))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
@@ -0,0 +1,112 @@
+"""방마다 따로 모으는 가벼운 구간(span) 기록.
+
+구간은 방마다 크기가 정해진 링 버퍼(`Tracer`)에 쌓이고, 오래된 것부터 밀려납니다.
+필요할 때 `chrome_trace()`로 Chrome trace event 형식(chrome://tracing, Perfetto)의 `dict`로 꺼냅니다.
+같은 방 안에서도 `asyncio.gather()`로 동시에 도는 구간이 있으므로 태스크마다 다른 줄(tid)에 그립니다.
+"""
+from __future__ import annotations
+import os
+import time
+import asyncio
+import functools
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, NamedTuple, Optional
+
+SPAN_CAPACITY = 4096
+_PROCESS = os.getpid()
+
+
+class Span(NamedTuple):
+    name: str
+    start: int  # ns
+    duration: int  # ns
+    tid: int
+    task: str
+    args: Optional[dict[str, Any]]
+
+
+def _current_task() -> tuple[int, str]:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return (id(task), task.get_name()) if task else (0, "main")
+
+
+class Tracer:
+    """구간을 모으는 링 버퍼.
+
+    Attributes:
+        `pid`: Chrome trace에서 이 버퍼를 묶어 보여 줄 번호. 방이면 방 ID, 서버면 0입니다.
+        `name`: Chrome trace에서 이 버퍼에 붙는 이름.
+    """
+
+    def __init__(self, pid: int, name: str, capacity: int = SPAN_CAPACITY):
+        self.pid = pid
+        self.name = name
+        self.spans: deque[Span] = deque(maxlen=capacity)
+
+    def start(self, name: str, **args) -> tuple[str, int, dict]:
+        """구간을 엽니다. 반환값을 `finish()`에 넘기면 구간이 기록됩니다."""
+        return name, time.perf_counter_ns(), args
+
+    def finish(self, started: tuple[str, int, dict]):
+        name, start, args = started
+        tid, task = _current_task()
+        self.spans.append(Span(name, start, time.perf_counter_ns() - start, tid, task, args or None))
+
+    @contextmanager
+    def span(self, name: str, **args):
+        started = self.start(name, **args)
+        try:
+            yield
+        finally:
+            self.finish(started)
+
+    def wrap(self, name: str):
+        """코루틴 함수 전체를 이 버퍼의 구간 하나로 기록하는 데코레이터."""
+        def _decorator(function: Callable):
+            @functools.wraps(function)
+            async def _traced(*args, **kwargs):
+                with self.span(name):
+                    return await function(*args, **kwargs)
+            return _traced
+        return _decorator
+
+    def chrome_trace(self) -> dict:
+        events: list[dict] = [{"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0, "args": {"name": self.name}}]
+        tasks: dict[int, str] = dict()
+        for span in self.spans:
+            tasks[span.tid] = span.task
+            event = {
+                "name": span.name,
+                "cat": self.name,
+                "ph": "X",
+                "ts": span.start / 1000,
+                "dur": span.duration / 1000,
+                "pid": self.pid,
+                "tid": span.tid,
+            }
+            if span.args:
+                event["args"] = span.args
+            events.append(event)
+        events.extend(
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": task}}
+            for tid, task in tasks.items()
+        )
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"process": _PROCESS}}
+
+
+def traced(name: str):
+    """메서드 전체를 `self.tracer`의 구간 하나로 기록하는 데코레이터."""
+    def _decorator(function: Callable):
+        @functools.wraps(function)
+        async def _traced(self, *args, **kwargs):
+            with self.tracer.span(name):
+                return await function(self, *args, **kwargs)
+        return _traced
+    return _decorator
+
+
+SERVER = Tracer(0, "server")  # 방에 속하지 않는 작업(보관 등)
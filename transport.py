@@ -0,0 +1,135 @@
+"""유저와 메시지를 주고받는 통로.
+
+`User`는 `Transport`로만 메시지를 주고받습니다. 실제 접속은 `WebSocketTransport`가 맡고,
+봇, 시뮬레이션, 테스트는 `LoopbackTransport`를 씁니다. `LoopbackTransport`는 소켓도 JSON 변환도 거치지 않고
+파이썬 객체를 그대로 큐에 넣으므로, 유저 수천 명을 `GameServer.serve()`나 `GameServer.process_message()`에
+바로 물려 CPU가 허락하는 만큼 빠르게 돌릴 수 있습니다.
+
+    transport = LoopbackTransport()
+    user = User("bot", transport)
+    serving = asyncio.create_task(server.serve(user))
+    transport.put({"type": "CREATE", "title": "봇 방", "password": ""})
+    message = await transport.outbox.get()
+"""
+from __future__ import annotations
+import json
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Optional
+from websockets.exceptions import ConnectionClosed
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+
+class Closed(Exception):
+    """상대가 떠나서 더 주고받을 수 없습니다."""
+
+
+class Transport(ABC):
+    """유저 한 명과 주고받는 통로. `accept()` 말고는 모두 구현해야 합니다."""
+
+    async def accept(self):
+        """접속을 받아들입니다. 받아들일 것이 없는 통로는 그대로 둡니다."""
+
+    @abstractmethod
+    async def send(self, data: dict) -> int:
+        """`data`를 보내고 보낸 바이트 수를 반환합니다. 상대가 떠났으면 `Closed`."""
+
+    @abstractmethod
+    async def send_text(self, text: str) -> int:
+        """이미 JSON으로 직렬화된 `text`를 보내고 보낸 바이트 수를 반환합니다. 상대가 떠났으면 `Closed`."""
+
+    @abstractmethod
+    async def receive(self) -> dict:
+        """상대가 보낸 메시지 하나를 기다립니다. 상대가 떠났으면 `Closed`."""
+
+    @abstractmethod
+    async def close(self, code: int = 1000):
+        """접속을 닫습니다."""
+
+
+class WebSocketTransport(Transport):
+    """Starlette `WebSocket`으로 JSON 텍스트를 주고받습니다."""
+
+    def __init__(self, ws: WebSocket):
+        self.ws = ws
+
+    def __repr__(self):
+        return f"<WebSocketTransport {self.ws.client}>"
+
+    async def accept(self):
+        await self.ws.accept()
+
+    async def send(self, data: dict) -> int:
+        return await self.send_text(json.dumps(data))  # JSON 변환이 불가능하면 TypeError
+
+    async def send_text(self, text: str) -> int:
+        try:
+            await self.ws.send_text(text)
+        except (RuntimeError, ConnectionClosed) as e:
+            raise Closed from e
+        return len(text)  # ensure_ascii이므로 글자 수가 곧 바이트 수
+
+    async def receive(self) -> dict:
+        try:
+            message = await self.ws.receive_json()
+            self.ws._raise_on_disconnect(message)
+        except WebSocketDisconnect as e:
+            raise Closed from e
+        return message
+
+    async def close(self, code: int = 1000):
+        await self.ws.close(code=code)
+
+
+class LoopbackTransport(Transport):
+    """같은 프로세스 안의 봇과 파이썬 객체를 그대로 주고받습니다.
+
+    서버가 보낸 것은 `outbox`에 쌓이고, 봇은 `put()`으로 서버에 보냅니다.
+    `outbox`의 객체는 다른 유저에게 보낸 것과 같은 객체일 수 있으므로 고치면 안 됩니다.
+    바이트로 바꾸지 않으므로 보낸 바이트 수는 언제나 0입니다.
+
+    Attributes:
+        `outbox`: 서버가 이 유저에게 보낸 메시지들.
+        `closed`: 닫혔으면 그 코드, 아니면 `None`.
+    """
+
+    def __init__(self):
+        self.outbox: asyncio.Queue[dict] = asyncio.Queue()
+        self._inbox: asyncio.Queue[Optional[dict]] = asyncio.Queue()
+        self.closed: Optional[int] = None
+
+    def __repr__(self):
+        return f"<LoopbackTransport {id(self):#x}>"
+
+    async def send(self, data: dict) -> int:
+        if self.closed is not None:
+            raise Closed
+        self.outbox.put_nowait(data)
+        return 0
+
+    async def send_text(self, text: str) -> int:
+        return await self.send(json.loads(text))
+
+    def put(self, message: dict):
+        """봇이 서버에 `message`를 보냅니다."""
+        if self.closed is not None:
+            raise Closed
+        self._inbox.put_nowait(message)
+
+    def drain(self) -> list[dict]:
+        """기다리지 않고 지금까지 받은 메시지를 모두 꺼냅니다."""
+        messages = []
+        while not self.outbox.empty():
+            messages.append(self.outbox.get_nowait())
+        return messages
+
+    async def receive(self) -> dict:
+        if (message := await self._inbox.get()) is None:
+            raise Closed
+        return message
+
+    async def close(self, code: int = 1000):
+        """닫습니다. 봇이 떠날 때도 이것을 부릅니다."""
+        if self.closed is None:
+            self.closed = code
+            self._inbox.put_nowait(None)